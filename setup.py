@@ -35,12 +35,17 @@ setup(
     classifiers = [
         "Development Status :: 2 - Pre-Alpha",
         "Intended Audience :: Developers",
-        "License :: OSI Approved :: Apache Software License"
+        "License :: OSI Approved :: Apache Software License",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only"
     ],
+    # The executables it builds still run on older interpreters (see the
+    # --python option).
+    python_requires = ">=3.7",
     packages = find_packages(),
     entry_points = {
         "console_scripts": [
-            "superzippy = superzippy.packaging:run"
+            "superzippy = superzippy.client:run"
         ]
     },
     # This ensures that the MANIFEST.IN file is used for both binary and source
@@ -0,0 +1,3 @@
+from .builder import Builder, BuildError
+
+__all__ = ["Builder", "BuildError"]
@@ -0,0 +1,305 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module implementing ``superzippy build-all``, which builds many executables
+described by a manifest file in one go.
+
+The manifest is a TOML (or JSON) file with an optional ``defaults`` table and
+a list of ``target`` tables:
+
+.. code-block:: toml
+
+    [defaults]
+    options = ["--no-source"]
+
+    [[target]]
+    name = "tinyscript"
+    packages = ["./tinyscript"]
+    entry_point = "tinyscript.main:foo"
+    output = "dist/tinyscript.sz"
+    requirements = ["requirements.txt"]
+    raw_copy = ["data/"]
+    options = ["-O"]
+
+Each target is built as if by running superzippy with the given options,
+packages and entry point from the manifest's directory, so relative paths
+(including those given in ``options``, ex: ``--lock``) are relative to it.
+Values in ``defaults`` are used for anything a target doesn't specify,
+except for ``options`` which are combined.
+
+Targets are built concurrently, and the CPUs are divided between the targets
+being built at once (each gets its share as its default ``--jobs``). Targets
+that install exactly the same packages and requirements files share a single
+installation through the install cache. Targets that only have some
+dependencies in common install them separately, though pip's own caches
+avoid downloading them more than once.
+
+"""
+
+# stdlib
+from optparse import OptionParser, make_option
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import sys
+import time
+
+# internal
+from . import buildcontext
+from . import packaging
+
+#: The keys a target may contain.
+TARGET_KEYS = set(["name", "packages", "entry_point", "output",
+    "requirements", "raw_copy", "options"])
+
+#: The format of every log message, which names the target it was logged for.
+LOG_FORMAT = "[%(levelname)s] %(superzippy_target)s%(message)s"
+
+#: Maps the id of the build of each target being built (see
+#: :mod:`superzippy.buildcontext`) to the target's name.
+_target_names = {}
+
+class InvalidManifest(ValueError):
+    """
+    Raised when a manifest file can't be understood.
+
+    """
+
+def _load_toml(f):
+    try:
+        import tomllib # Python 3.11+
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise InvalidManifest("Reading TOML manifests requires Python "
+                "3.11 or the tomli package. Use a JSON manifest instead.")
+
+    return tomllib.load(f)
+
+def load_manifest(path):
+    """
+    Reads the manifest at ``path``.
+
+    :returns: A list of target dictionaries with the defaults applied.
+
+    """
+
+    with open(path, "rb") as f:
+        if path.endswith(".json"):
+            manifest = json.loads(f.read().decode("utf-8"))
+        else:
+            manifest = _load_toml(f)
+
+    defaults = manifest.get("defaults", {})
+    targets = manifest.get("target", [])
+    if not targets:
+        raise InvalidManifest("%s does not contain any targets." % (path, ))
+
+    result = []
+    for i in targets:
+        unknown = set(i) - TARGET_KEYS
+        if unknown:
+            raise InvalidManifest("Unknown target keys: %s." %
+                (", ".join(sorted(unknown)), ))
+
+        target = dict(defaults)
+        target.update(i)
+        target["options"] = \
+            list(defaults.get("options", [])) + list(i.get("options", []))
+
+        if "entry_point" not in target:
+            raise InvalidManifest("Every target needs an entry_point.")
+
+        target.setdefault("name", os.path.basename(
+            target.get("output", target["entry_point"])))
+
+        result.append(target)
+
+    return result
+
+def get_target_arguments(target):
+    """
+    Returns the command line arguments (without the program name) that
+    would build ``target`` with ``superzippy`` when run from the manifest's
+    directory.
+
+    """
+
+    args = list(target["options"])
+
+    if "output" in target:
+        args += ["-o", target["output"]]
+
+    for i in target.get("requirements", []):
+        args += ["-r", i]
+
+    for i in target.get("raw_copy", []):
+        args += ["-c", i]
+
+    args += target.get("packages", [])
+    args.append(target["entry_point"])
+
+    return args
+
+def build_target(name, args, manifest_dir):
+    """
+    Builds a single target, with every relative path in ``args`` relative to
+    ``manifest_dir``.
+
+    :returns: ``(name, succeeded, seconds)``
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    with buildcontext.build_context() as build:
+        _target_names[build] = name
+        try:
+            log.info("Building %s.", name)
+
+            start_time = time.time()
+            try:
+                options, args = packaging.parse_arguments(args)
+                args = packaging.resolve_paths(options, args, manifest_dir)
+                succeeded = packaging.main(options, args) == 0
+            except SystemExit:
+                # parse_arguments() exits when the options are invalid, and
+                # will have explained why.
+                succeeded = False
+            except Exception:
+                log.exception("Unexpected error while building %s.", name)
+                succeeded = False
+        finally:
+            del _target_names[build]
+
+    return name, succeeded, time.time() - start_time
+
+class TargetFilter(logging.Filter):
+    """
+    Tags each record with the name of the target it was logged for, followed
+    by a colon and a space (as its ``superzippy_target`` attribute, empty if
+    it wasn't logged for a target), so that the messages of targets built at
+    once can be told apart.
+
+    """
+
+    def filter(self, record):
+        build = getattr(record, "superzippy_build",
+            buildcontext.current_build())
+        name = _target_names.get(build)
+        record.superzippy_target = "" if name is None else name + ": "
+
+        return True
+
+def parse_arguments(args):
+    option_list = [
+        make_option(
+            "-v", "--verbose", action = "count", default = 0,
+            help = "Same as superzippy's --verbose option."
+        ),
+        make_option(
+            "-q", "--quiet", action = "store_true",
+            help = "Same as superzippy's --quiet option."
+        ),
+        make_option(
+            "--workers", action = "store", type = "int",
+            default = multiprocessing.cpu_count(),
+            help =
+                "The number of targets to build at once. Defaults to the "
+                "number of CPUs (%default). The CPUs are divided between "
+                "the targets built at once, which each default to their "
+                "share as their --jobs."
+        )
+    ]
+
+    parser = OptionParser(
+        usage = "usage: %prog build-all [options] MANIFEST",
+        description =
+            "Builds every target in MANIFEST. See the documentation of the "
+            "superzippy.batch module for the format of MANIFEST.",
+        option_list = option_list
+    )
+
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1:
+        parser.error("Exactly one manifest must be supplied.")
+
+    return options, args
+
+def main(options, args):
+    log = logging.getLogger("superzippy")
+
+    manifest_path = args[0]
+    try:
+        targets = load_manifest(manifest_path)
+    except (IOError, ValueError) as e:
+        log.critical("Could not read manifest %s: %s", manifest_path, e)
+        return 1
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    # Every target inherits our verbosity
+    verbosity = []
+    if options.verbose:
+        verbosity = ["-" + "v" * options.verbose]
+    elif options.quiet:
+        verbosity = ["-q"]
+
+    # Every target building at once gets its share of the CPUs, unless its
+    # own options say otherwise.
+    workers = max(1, min(options.workers, len(targets)))
+    cpu_share = ["--jobs", str(max(1, multiprocessing.cpu_count() // workers))]
+
+    jobs = [(i["name"], verbosity + cpu_share + get_target_arguments(i),
+            manifest_dir)
+        for i in targets]
+
+    for i in targets:
+        output_dir = os.path.dirname(os.path.join(manifest_dir,
+            i.get("output", "")))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    pool = buildcontext.ThreadPool(workers)
+    try:
+        results = pool.map(lambda x: build_target(*x), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    name_width = max(len(name) for name, succeeded, seconds in results)
+    for name, succeeded, seconds in results:
+        sys.stdout.write("%s  %-6s  %7.2fs\n" %
+            (name.ljust(name_width), "ok" if succeeded else "FAILED",
+                seconds))
+
+    return 0 if all(succeeded for name, succeeded, seconds in results) else 1
+
+def run(args):
+    options, args = parse_arguments(args)
+    packaging.setup_logging(options, args)
+
+    for i in logging.getLogger().handlers:
+        i.addFilter(TargetFilter())
+        i.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    return main(options, args)
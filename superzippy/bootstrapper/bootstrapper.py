@@ -19,16 +19,45 @@
 
 import sys
 import zipsite
+import zipindex
 import superconfig
 import module_locator
 import os.path
 
-zipsite.addsitedir(
-	os.path.abspath(os.path.join(
-		module_locator.module_path(), "site-packages"
-	)),
-	prepend_mode = True
-)
+archive_path = os.path.abspath(module_locator.module_path())
+site_dir = os.path.join(archive_path, "site-packages")
+
+# Packages that need to be real files are imported from wherever they've
+# been extracted to rather than from the archive (on Python 3.4 and newer,
+# older interpreters import everything from the archive)
+extract_dir = None
+if superconfig.extract_names and sys.version_info >= (3, 4):
+	import extractcache
+	extract_dir = extractcache.extract(archive_path,
+		superconfig.extract_names, superconfig.extract_key)
+
+# Installed first so that even imports done by .pth files use the index
+zipindex.install(archive_path, site_dir,
+	superconfig.extract_names if extract_dir else ())
+
+if superconfig.lazy_imports:
+	import lazyimport
+	lazyimport.install(superconfig.lazy_imports)
+
+# The .pth files were read when the archive was built, so rather than
+# searching the archive for them, the directories they name are added
+# straight away (each in front of the last, as zipsite.addsitedir() does) and
+# only their import lines are left to run.
+sys.path.insert(0, site_dir)
+for i in superconfig.site_paths:
+	path = os.path.join(archive_path, *i.split("/"))
+	if path not in sys.path:
+		sys.path.insert(0, path)
+
+if extract_dir:
+	sys.path.insert(0, extract_dir)
+
+zipsite.execute_imports(site_dir, superconfig.site_imports)
 
 if len(sys.argv) == 2 and sys.argv[1] == "--superzippy-debug-console":
 	# Pulled from http://stackoverflow.com/a/5597918/1989056
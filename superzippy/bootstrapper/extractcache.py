@@ -0,0 +1,235 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that extracts the packages named with ``--extract`` out of the
+archive the first time the executable runs, so that they're imported from
+(and can find their data files amongst) real files.
+
+The files are extracted into a directory named after the hash of their
+contents, which is worked out when building, within
+``$XDG_CACHE_HOME/superzippy/extracted``. Later runs (of this executable, or
+any other with the same files) use that directory without reading the
+archive at all.
+
+A directory only ever appears whole: files are extracted into a temporary
+directory which is then renamed, so any number of copies of the executable
+may start at once. Whenever something is extracted, directories that haven't
+been used for :data:`MAX_AGE` seconds are removed.
+
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from importlib.machinery import EXTENSION_SUFFIXES as _suffixes
+from importlib.util import cache_from_source
+
+#: The endings of the names of extension modules. Those for other platforms
+#: and interpreters are matched too, since the archive may have been built
+#: for one (and the ending of any extension module's name is one of these,
+#: ex: ``foo.cpython-311-x86_64-linux-gnu.so``).
+EXTENSION_SUFFIXES = tuple(sorted(set([".so", ".pyd"]).union(_suffixes)))
+
+#: The directory in the archive that packages are extracted from.
+SITE_PACKAGES = "site-packages/"
+
+#: Extracted directories unused for this long (in seconds) are removed.
+MAX_AGE = 30 * 24 * 60 * 60
+
+#: How often (in seconds) a directory's modification time is updated to show
+#: that it's being used.
+TOUCH_INTERVAL = 24 * 60 * 60
+
+#: Temporary directories are named with this prefix, and are removed when
+#: they're this old (in seconds), since whatever made them must have died.
+TEMPORARY_PREFIX = ".tmp-"
+TEMPORARY_MAX_AGE = 60 * 60
+
+def get_cache_dir():
+    """
+    Returns the directory that packages are extracted into. This respects
+    ``$XDG_CACHE_HOME``.
+
+    """
+
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "superzippy", "extracted")
+
+def is_extracted(name, names):
+    """
+    Returns ``True`` if the member ``name`` (relative to site-packages, ex:
+    ``foo/bar.py``) belongs to one of the top-level packages or modules in
+    ``names``.
+
+    >>> is_extracted("foo/data/x.txt", ["foo"])
+    True
+    >>> is_extracted("foo.pyc", ["foo"])
+    True
+    >>> is_extracted("foo.cpython-311-x86_64-linux-gnu.so", ["foo"])
+    True
+    >>> is_extracted("foobar.py", ["foo"])
+    False
+
+    """
+
+    top, slash, _ = name.partition("/")
+    if slash:
+        return top in names
+
+    base, extension = os.path.splitext(top)
+    if extension in (".py", ".pyc"):
+        return base in names
+
+    # Extension modules are named up to the first dot, like the import
+    # system does with each of its extension suffixes.
+    return top.endswith(EXTENSION_SUFFIXES) and \
+        top.partition(".")[0] in names
+
+def _get_destination(directory, name, members):
+    parts = name.split("/")
+    path = os.path.join(directory, *parts)
+
+    # Bytecode sits next to its source in the archive (see
+    # superzippy.bytecode), which is where zipimport looks for it but not
+    # where the regular import system does.
+    source = name[:-1]
+    if name.endswith(".pyc") and source in members:
+        path = cache_from_source(os.path.join(directory, *source.split("/")))
+
+    return path
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def extract_members(archive_path, names, directory):
+    """
+    Extracts every member of the archive at ``archive_path`` belonging to
+    ``names`` (see :func:`is_extracted`) into ``directory``.
+
+    """
+
+    with zipfile.ZipFile(archive_path) as archive:
+        members = set(i[len(SITE_PACKAGES):] for i in archive.namelist()
+            if i.startswith(SITE_PACKAGES))
+
+        for name in sorted(members):
+            if name.endswith("/") or not is_extracted(name, names):
+                continue
+
+            path = _get_destination(directory, name, members)
+            _makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(archive.read(SITE_PACKAGES + name))
+
+def _remove(path):
+    # Renamed first so that nobody sees a directory that's partly removed
+    doomed = os.path.join(os.path.dirname(path), "%sremoved-%d-%s" %
+        (TEMPORARY_PREFIX, os.getpid(), os.path.basename(path)))
+    try:
+        os.rename(path, doomed)
+    except OSError:
+        return
+
+    shutil.rmtree(doomed, ignore_errors = True)
+
+def remove_stale(cache_dir, keep = None, now = None):
+    """
+    Removes the directories in ``cache_dir`` (besides ``keep``) that haven't
+    been used for :data:`MAX_AGE` seconds, along with any abandoned
+    temporary directories.
+
+    """
+
+    if now is None:
+        now = time.time()
+
+    for i in os.listdir(cache_dir):
+        if i == keep:
+            continue
+
+        path = os.path.join(cache_dir, i)
+        try:
+            age = now - os.stat(path).st_mtime
+        except OSError:
+            continue
+
+        if i.startswith(TEMPORARY_PREFIX):
+            if age > TEMPORARY_MAX_AGE:
+                shutil.rmtree(path, ignore_errors = True)
+        elif age > MAX_AGE:
+            _remove(path)
+
+def extract(archive_path, names, key):
+    """
+    Makes sure that the top-level packages and modules in ``names`` have been
+    extracted from the archive at ``archive_path`` into the directory for
+    ``key`` (the hash of their contents).
+
+    :returns: The directory they're in, or ``None`` if they couldn't be
+            extracted (in which case they should be imported from the
+            archive).
+
+    """
+
+    cache_dir = get_cache_dir()
+    directory = os.path.join(cache_dir, key)
+
+    try:
+        mtime = os.stat(directory).st_mtime
+    except OSError:
+        pass
+    else:
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(directory, None)
+            except OSError:
+                pass
+
+        return directory
+
+    try:
+        _makedirs(cache_dir)
+        temporary = tempfile.mkdtemp(prefix = TEMPORARY_PREFIX,
+            dir = cache_dir)
+        try:
+            extract_members(archive_path, names, temporary)
+
+            try:
+                os.rename(temporary, directory)
+            except OSError:
+                # Somebody else extracted the same files first
+                if not os.path.isdir(directory):
+                    raise
+        finally:
+            if os.path.isdir(temporary):
+                shutil.rmtree(temporary, ignore_errors = True)
+
+        remove_stale(cache_dir, keep = key)
+    except (IOError, OSError, zipfile.BadZipfile):
+        return None
+
+    return directory
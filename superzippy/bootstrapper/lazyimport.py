@@ -0,0 +1,156 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that defers running the modules named with ``--lazy-import`` until
+they're first used.
+
+Importing one of those modules (or any module within one of those packages)
+gives back a module that hasn't been run yet, using
+``importlib.util.LazyLoader``. It's run the first time one of its attributes
+is looked up, so a module that's imported but never used costs next to
+nothing.
+
+Setting ``SUPERZIPPY_LAZY_IMPORT_REPORT`` prints which of the lazily imported
+modules ended up being used when the executable exits, which is handy for
+deciding what to make lazy. :func:`materialized` gives the same list to the
+executable itself.
+
+"""
+
+from __future__ import print_function
+
+import atexit
+import os
+import sys
+
+try:
+    from importlib.machinery import (BuiltinImporter, ExtensionFileLoader,
+        FrozenImporter)
+    import importlib.util
+    LazyLoader = importlib.util.LazyLoader
+except (ImportError, AttributeError):
+    LazyLoader = None
+
+#: Setting this environment variable prints a report when exiting.
+REPORT_VARIABLE = "SUPERZIPPY_LAZY_IMPORT_REPORT"
+
+#: ``(name, module, the module's type while it hasn't been run)`` for every
+#: module imported lazily so far.
+_lazy_modules = []
+
+if LazyLoader is not None:
+    class _LazyLoader(LazyLoader):
+        def exec_module(self, module):
+            # Looking at any of the module's attributes once it's lazy would
+            # run it, but checking its type doesn't (it's changed back once
+            # the module is run).
+            name = module.__spec__.name
+            LazyLoader.exec_module(self, module)
+            _lazy_modules.append((name, module, type(module)))
+
+class LazyFinder(object):
+    """
+    A meta path finder that finds modules using the finders after it in
+    ``sys.meta_path``, and makes the loaders of the modules in ``names`` (or
+    within the packages in ``names``) lazy.
+
+    """
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+
+    def _is_lazy(self, fullname):
+        parts = fullname.split(".")
+        return any(".".join(parts[:i]) in self.names
+            for i in range(1, len(parts) + 1))
+
+    def find_spec(self, fullname, path = None, target = None):
+        if not self._is_lazy(fullname):
+            return None
+
+        finders = sys.meta_path
+        if self in finders:
+            finders = finders[finders.index(self) + 1:]
+
+        for finder in finders:
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+
+            spec = find_spec(fullname, path, target)
+            if spec is None:
+                continue
+
+            # Extension modules can't be made lazy, and namespace packages
+            # have nothing to run.
+            if spec.loader is not None and \
+                    hasattr(spec.loader, "exec_module") and \
+                    not isinstance(spec.loader, ExtensionFileLoader):
+                spec.loader = _LazyLoader(spec.loader)
+
+            return spec
+
+        return None
+
+    def invalidate_caches(self):
+        pass
+
+def materialized():
+    """
+    Returns the names of the lazily imported modules that have been used
+    (and so have been run), in the order they were imported.
+
+    """
+
+    return [name for name, module, lazy_type in _lazy_modules
+        if type(module) is not lazy_type]
+
+def _report():
+    used = set(materialized())
+    print("superzippy: %d of %d lazily imported modules were used." %
+        (len(used), len(_lazy_modules)), file = sys.stderr)
+    for name, module, lazy_type in _lazy_modules:
+        print("  %s %s" % ("used  " if name in used else "unused", name),
+            file = sys.stderr)
+
+def install(names):
+    """
+    Makes the modules in ``names`` (and any modules within them) lazy.
+
+    :returns: ``True`` if they will be, ``False`` if this interpreter
+            doesn't support lazy imports (Python 3.5 is needed).
+
+    """
+
+    if LazyLoader is None:
+        return False
+
+    finder = LazyFinder(names)
+
+    # Modules built into the interpreter are never lazy
+    for i, existing in enumerate(sys.meta_path):
+        if existing not in (BuiltinImporter, FrozenImporter):
+            sys.meta_path.insert(i, finder)
+            break
+    else:
+        sys.meta_path.append(finder)
+
+    if os.environ.get(REPORT_VARIABLE):
+        atexit.register(_report)
+
+    return True
@@ -0,0 +1,507 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that imports modules from the archive's site-packages directory using
+the index written into the archive when it was built (see
+``superzippy.moduleindex``), rather than through ``zipimport``.
+
+Finding a module is a single dictionary lookup, and every member is read
+straight out of a memory map of the archive, without ever parsing the
+central directory. Archives without an index (or interpreters older than
+Python 3.4) are left to ``zipimport``.
+
+``pkg_resources`` is taught to read resources through the importer (the same
+way it reads them through ``zipimport``) when it's imported.
+
+"""
+
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+try:
+    from importlib.machinery import ModuleSpec, PathFinder
+    import importlib.util
+except ImportError:
+    ModuleSpec = None
+
+#: The name of the member holding the index. Must match
+#: ``superzippy.moduleindex.INDEX_NAME``.
+INDEX_NAME = "superzippy-index.json"
+
+_END_RECORD = struct.Struct("<4s4H2LH")
+_END_RECORD_SIGNATURE = b"PK\x05\x06"
+_ZIP64_LOCATOR_SIZE = 20
+_ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+_DIRECTORY_ENTRY = struct.Struct("<4s24x3H8xL")
+_DIRECTORY_ENTRY_SIGNATURE = b"PK\x01\x02"
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+class IndexedArchive(object):
+    """
+    An archive with an index, opened for reading.
+
+    The whole archive is mapped into memory rather than read, so members are
+    read without any system calls, and every process running the same
+    executable shares the same pages of memory.
+
+    :raises ValueError: If the archive has no index.
+    :raises IOError: If the archive can't be read.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        try:
+            self.index = self._read_index()
+        except:
+            self._map.close()
+            raise
+
+        self.members = self.index["members"]
+        self._view = memoryview(self._map)
+
+    def _read_index(self):
+        m = self._map
+
+        # The end of central directory record is at most 64 KiB (the longest
+        # possible comment) from the end of the file.
+        position = m.rfind(_END_RECORD_SIGNATURE,
+            max(0, len(m) - _END_RECORD.size - 0xffff))
+        if position < 0 or len(m) - position < _END_RECORD.size:
+            raise ValueError("%s is not a zip file." % (self.path, ))
+
+        # Archives that big are left to zipimport
+        locator = position - _ZIP64_LOCATOR_SIZE
+        if locator >= 0 and m[locator:locator + 4] == \
+                _ZIP64_LOCATOR_SIGNATURE:
+            raise ValueError("%s is a ZIP64 archive." % (self.path, ))
+
+        directory_size, directory_offset = \
+            _END_RECORD.unpack_from(m, position)[5:7]
+
+        # Anything in front of the archive that its offsets don't account
+        # for (ex: the #! line), found the same way zipfile finds it.
+        self._start = position - directory_size - directory_offset
+
+        # The index is the last member written, so its entry (which has no
+        # extra field or comment) ends the central directory.
+        name = INDEX_NAME.encode("ascii")
+        entry_start = position - _DIRECTORY_ENTRY.size - len(name)
+        if entry_start < 0:
+            raise ValueError("%s has no index." % (self.path, ))
+
+        signature, name_size, extra_size, comment_size, index_offset = \
+            _DIRECTORY_ENTRY.unpack_from(m, entry_start)
+        name_start = entry_start + _DIRECTORY_ENTRY.size
+        if signature != _DIRECTORY_ENTRY_SIGNATURE or \
+                (name_size, extra_size, comment_size) != (len(name), 0, 0) or \
+                m[name_start:name_start + name_size] != name:
+            raise ValueError("%s has no index." % (self.path, ))
+
+        header_start = self._start + index_offset
+        if m[header_start:header_start + 4] != _LOCAL_HEADER_SIGNATURE:
+            raise ValueError("%s has a bad index." % (self.path, ))
+
+        method, compressed_size, name_size, extra_size = \
+            struct.unpack_from("<8xH8xL4x2H", m, header_start)
+        data_start = header_start + _LOCAL_HEADER_SIZE + name_size + \
+            extra_size
+
+        return json.loads(self._decompress(
+            m[data_start:data_start + compressed_size], method).decode(
+                "utf-8"))
+
+    def _decompress(self, data, method):
+        if method == 8:
+            return zlib.decompress(data, -15)
+        elif method == 0:
+            return data
+
+        raise IOError("Unsupported compression method %d in %s." %
+            (method, self.path))
+
+    def read_buffer(self, name):
+        """
+        Returns the contents of the member ``name`` (relative to
+        site-packages) as a bytes-like object. Members that aren't
+        compressed are given as a ``memoryview`` of the archive itself,
+        without being copied.
+
+        :raises KeyError: If there's no such member.
+
+        """
+
+        offset, method, compressed_size, size = self.members[name]
+
+        header_start = self._start + offset
+        if self._map[header_start:header_start + 4] != \
+                _LOCAL_HEADER_SIGNATURE:
+            raise IOError("Bad local header for %s in %s." %
+                (name, self.path))
+
+        name_size, extra_size = struct.unpack_from("<2H", self._map,
+            header_start + 26)
+        data_start = header_start + _LOCAL_HEADER_SIZE + name_size + \
+            extra_size
+
+        return self._decompress(
+            self._view[data_start:data_start + compressed_size], method)
+
+    def read(self, name):
+        """
+        Returns the contents of the member ``name`` (relative to
+        site-packages) as bytes.
+
+        :raises KeyError: If there's no such member.
+
+        """
+
+        data = self.read_buffer(name)
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
+        return data
+
+class IndexedImporter(object):
+    """
+    A meta path finder, and the loader of the modules it finds, for the
+    modules in an :class:`IndexedArchive`'s site-packages directory at
+    ``root`` (ex: ``/tmp/foo.sz/site-packages``). Top-level packages and
+    modules in ``exclude`` are left for other finders.
+
+    Like ``zipimport.zipimporter``, ``archive`` is the path to the archive,
+    which ``pkg_resources.ZipProvider`` relies on.
+
+    """
+
+    def __init__(self, indexed, root, exclude = ()):
+        self.indexed = indexed
+        self.archive = indexed.path
+        self.root = root
+        self.modules = indexed.index["modules"]
+        if exclude:
+            self.modules = dict((k, v) for k, v in self.modules.items()
+                if k.split("/", 1)[0] not in exclude)
+        self.directories = set(indexed.index["directories"])
+
+        # Maps the name of each module found to its location in the index
+        self._locations = {}
+        self._children = None
+
+    def _get_path(self, name):
+        if not name:
+            return self.root
+
+        return os.path.join(self.root, *name.split("/"))
+
+    #### Finding modules
+
+    def _get_spec(self, fullname, location):
+        is_package, source, bytecode = self.modules[location]
+        self._locations[fullname] = location
+
+        spec = ModuleSpec(fullname, self,
+            origin = self._get_path(source or bytecode),
+            is_package = bool(is_package))
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = \
+                [os.path.dirname(spec.origin)]
+
+        return spec
+
+    def find_spec(self, fullname, path = None, target = None):
+        location = fullname.replace(".", "/")
+        if location not in self.modules:
+            return None
+
+        # Only modules that the regular import system would find in the
+        # archive are taken (ex: not if site-packages was taken off of
+        # sys.path, or if the parent package came from somewhere else).
+        # Modules anywhere else in the archive are left to the path entry
+        # finders.
+        if path is None:
+            if self.root not in sys.path:
+                return None
+        elif self._get_path(location.rpartition("/")[0]) not in path:
+            return None
+
+        return self._get_spec(fullname, location)
+
+    def invalidate_caches(self):
+        pass
+
+    def path_hook(self, path):
+        """
+        Returns a path entry finder for ``path`` if it's site-packages or a
+        directory in it, so that the regular import system doesn't fall back
+        to ``zipimport`` for them either. For use in ``sys.path_hooks``.
+
+        """
+
+        if path == self.root:
+            return _PathEntryFinder(self, "")
+        elif path.startswith(self.root + os.sep):
+            directory = path[len(self.root) + 1:].replace(os.sep, "/")
+            if directory in self.directories:
+                return _PathEntryFinder(self, directory)
+
+        raise ImportError("%s is not indexed." % (path, ))
+
+    def iter_children(self, directory):
+        """
+        Returns a list of ``(name, is package)`` for each module directly in
+        ``directory`` (relative to site-packages).
+
+        """
+
+        if self._children is None:
+            children = {}
+            for k, v in self.modules.items():
+                parent, _, name = k.rpartition("/")
+                children.setdefault(parent, []).append((name, bool(v[0])))
+            self._children = children
+
+        return sorted(self._children.get(directory, []))
+
+    #### Loading modules
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        code = self.get_code(module.__spec__.name)
+        exec(code, module.__dict__)
+
+    def _get_location(self, fullname):
+        location = self._locations.get(fullname)
+        if location is None:
+            location = fullname.replace(".", "/")
+
+        return location
+
+    def _get_info(self, fullname):
+        try:
+            return self.modules[self._get_location(fullname)]
+        except KeyError:
+            raise ImportError("No module named %s in %s." %
+                (fullname, self.root), name = fullname)
+
+    def get_code(self, fullname):
+        is_package, source, bytecode = self._get_info(fullname)
+
+        if bytecode is not None:
+            data = self.indexed.read_buffer(bytecode)
+            if bytes(data[:4]) == importlib.util.MAGIC_NUMBER:
+                # The header is 16 bytes long from Python 3.7 onwards
+                header_size = 16 if sys.version_info >= (3, 7) else 12
+                code = marshal.loads(memoryview(data)[header_size:])
+                _fix_filename(code, self._get_path(source or bytecode))
+                return code
+
+            if source is None:
+                raise ImportError("%s was compiled for a different version "
+                    "of Python." % (fullname, ), name = fullname)
+
+        return compile(self.indexed.read(source), self._get_path(source),
+            "exec", dont_inherit = True)
+
+    def get_source(self, fullname):
+        source = self._get_info(fullname)[1]
+        if source is None:
+            return None
+
+        return importlib.util.decode_source(self.indexed.read(source))
+
+    def is_package(self, fullname):
+        return bool(self._get_info(fullname)[0])
+
+    def get_filename(self, fullname):
+        is_package, source, bytecode = self._get_info(fullname)
+        return self._get_path(source or bytecode)
+
+    def get_data(self, path):
+        # Paths relative to the archive are accepted too, like zipimport
+        if not os.path.isabs(path):
+            path = os.path.join(self.archive, path)
+
+        if path.startswith(self.root + os.sep):
+            name = path[len(self.root) + 1:].replace(os.sep, "/")
+            if name in self.indexed.members:
+                return self.indexed.read(name)
+
+        raise IOError(2, "No such file in archive", path)
+
+    def get_resource_reader(self, fullname):
+        # Resources are rarely used, so zipimport (which reads the central
+        # directory) is left to deal with them.
+        import zipimport
+
+        parent = self._get_location(fullname).rpartition("/")[0]
+        importer = zipimport.zipimporter(self._get_path(parent))
+        if not hasattr(importer, "get_resource_reader"):
+            return None
+
+        return importer.get_resource_reader(fullname)
+
+class _PathEntryFinder(object):
+    """
+    A path entry finder for ``directory`` (relative to site-packages) in an
+    :class:`IndexedImporter`'s archive.
+
+    """
+
+    def __init__(self, importer, directory):
+        self.importer = importer
+        self.directory = directory
+
+    def find_spec(self, fullname, target = None):
+        name = fullname.rpartition(".")[2]
+        if self.directory:
+            name = self.directory + "/" + name
+
+        if name in self.importer.modules:
+            return self.importer._get_spec(fullname, name)
+
+        if name in self.importer.directories:
+            # A portion of a namespace package
+            spec = ModuleSpec(fullname, None)
+            spec.submodule_search_locations = \
+                [self.importer._get_path(name)]
+            return spec
+
+        return None
+
+    def invalidate_caches(self):
+        pass
+
+    def iter_modules(self, prefix = ""):
+        # Used by pkgutil.iter_modules()
+        for name, is_package in self.importer.iter_children(self.directory):
+            yield prefix + name, is_package
+
+class _ProviderHook(object):
+    """
+    A meta path finder that lets whichever finder would find
+    ``pkg_resources`` import it, and then registers a resource provider for
+    :class:`IndexedImporter` with it. Importing ``pkg_resources`` is slow, so
+    it's not done unless something else asks for it.
+
+    """
+
+    def find_spec(self, fullname, path = None, target = None):
+        if fullname != "pkg_resources":
+            return None
+
+        sys.meta_path.remove(self)
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            spec = find_spec and find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if hasattr(spec.loader, "exec_module"):
+            spec.loader = _ProviderLoader(spec.loader)
+
+        return spec
+
+    def invalidate_caches(self):
+        pass
+
+class _ProviderLoader(object):
+    """
+    Wraps the loader of ``pkg_resources`` so that a resource provider is
+    registered for :class:`IndexedImporter` once it has been executed.
+
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        create_module = getattr(self.loader, "create_module", None)
+        return create_module and create_module(spec)
+
+    def exec_module(self, module):
+        module.__loader__ = module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        _register_provider(module)
+
+def _register_provider(pkg_resources):
+    pkg_resources.register_loader_type(IndexedImporter,
+        pkg_resources.ZipProvider)
+
+def _fix_filename(code, path):
+    # Bytecode is compiled with names relative to the archive, make them
+    # the full path like zipimport does for source.
+    try:
+        import _imp
+        _imp._fix_co_filename(code, path)
+    except (ImportError, AttributeError):
+        pass
+
+def install(archive_path, root, exclude = ()):
+    """
+    Imports modules in ``root`` (the archive's site-packages directory, as it
+    appears on ``sys.path``) from the archive at ``archive_path`` using its
+    index, except for the top-level packages and modules in ``exclude``.
+
+    :returns: ``True`` if the index is being used, ``False`` if ``zipimport``
+            will be used instead.
+
+    """
+
+    if ModuleSpec is None:
+        return False
+
+    try:
+        archive = IndexedArchive(archive_path)
+    except (IOError, OSError, ValueError):
+        return False
+
+    importer = IndexedImporter(archive, root, exclude)
+
+    # Modules built into the interpreter still come first
+    for i, finder in enumerate(sys.meta_path):
+        if finder is PathFinder:
+            sys.meta_path.insert(i, importer)
+            break
+    else:
+        sys.meta_path.append(importer)
+
+    sys.path_hooks.insert(0, importer.path_hook)
+    sys.path_importer_cache.pop(root, None)
+
+    if "pkg_resources" in sys.modules:
+        _register_provider(sys.modules["pkg_resources"])
+    elif not any(isinstance(i, _ProviderHook) for i in sys.meta_path):
+        sys.meta_path.insert(0, _ProviderHook())
+
+    return True
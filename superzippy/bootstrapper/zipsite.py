@@ -15,18 +15,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""
+Module that lets ``site.addsitedir()`` add site directories that are inside
+of an archive (ex: ``/tmp/foo.sz/site-packages``), so that user code can
+still call it at runtime, and that runs the import lines of the archive's
+own .pth files (everything else in them was dealt with when the archive was
+built, see ``superzippy.pthfiles``).
+
+"""
 
-from __future__ import with_statement
 from __future__ import print_function
 import site as _site
 from site import *
 
 
-from contextlib import closing
 import zipfile
 import os
+import threading
 import traceback
 
+#: Maps every path :func:`is_archive` has been asked about to its answer.
+_is_archive_cache = {}
+
+#: Maps the path of every archive opened by :func:`get_archive` to the open
+#: :class:`zipfile.ZipFile`.
+_archives = {}
+
+#: Maps the path of every archive to the set of directories in it, see
+#: :func:`get_directories`.
+_directories = {}
+
+_archives_lock = threading.Lock()
+
 def get_path_parts(path):
     """
     Splits a path up into its parts.
@@ -73,6 +93,61 @@ def get_path_parts(path):
 
     return parts
 
+def is_archive(path):
+    """
+    Returns ``True`` if ``path`` is a zip file. Paths are only checked once,
+    and directories are never opened.
+
+    """
+
+    result = _is_archive_cache.get(path)
+    if result is None:
+        result = os.path.isfile(path) and zipfile.is_zipfile(path)
+        _is_archive_cache[path] = result
+
+    return result
+
+def get_archive(path):
+    """
+    Returns an open :class:`zipfile.ZipFile` for the archive at ``path``.
+    Every caller shares the same one, so the archive's central directory is
+    only read once. It must not be closed.
+
+    """
+
+    with _archives_lock:
+        archive = _archives.get(path)
+        if archive is None:
+            archive = _archives[path] = zipfile.ZipFile(path, mode = "r")
+
+    return archive
+
+def get_directories(path):
+    """
+    Returns the set of every directory in the archive at ``path`` (ex:
+    ``site-packages/foo``), including those that only exist because files
+    are in them.
+
+    """
+
+    with _archives_lock:
+        directories = _directories.get(path)
+
+    if directories is None:
+        directories = set()
+        for name in get_archive(path).namelist():
+            parts = name.rstrip("/").split("/")
+            if name.endswith("/"):
+                directories.add("/".join(parts))
+
+            for i in range(1, len(parts)):
+                directories.add("/".join(parts[:i]))
+
+        with _archives_lock:
+            _directories[path] = directories
+
+    return directories
+
 def split_zip_path(path):
     """
     Takes a path that includes at most a single zip file as a directory and
@@ -101,7 +176,7 @@ def split_zip_path(path):
         else:
             tail = ""
 
-        if zipfile.is_zipfile(front):
+        if is_archive(front):
             return front, tail
 
     return None, path
@@ -115,17 +190,13 @@ def exists(path):
         return os.path.exists(path)
 
     # otherwise check the zip file.
-    with closing(zipfile.ZipFile(archive_path, mode = "r")) as archive:
-        try:
-            archive.getinfo(file_path)
-        except KeyError:
-            try:
-                archive.getinfo(file_path + "/")
-            except KeyError:
-                return False
-
+    file_path = file_path.replace(os.sep, "/").rstrip("/")
+    if not file_path:
         return True
 
+    return file_path in get_archive(archive_path).NameToInfo or \
+        file_path in get_directories(archive_path)
+
 def addsitedir(sitedir, known_paths = None, prepend_mode = False):
     # We need to return exactly what they gave as known_paths, so don't touch
     # it.
@@ -148,18 +219,17 @@ def addsitedir(sitedir, known_paths = None, prepend_mode = False):
     else:
         sys.path.append(sitedir)
 
-    with closing(zipfile.ZipFile(archive_path, mode = "r")) as archive:
-        # Go trhough everything in the archive...
-        for i in archive.infolist():
-            # and grab all the .pth files.
-            if os.path.dirname(i.filename) == os.path.dirname(site_path) and \
-                    i.filename.endswith(os.extsep + "pth"):
-                addpackage(
-                    os.path.join(archive_path, site_path),
-                    os.path.basename(i.filename),
-                    effective_known_paths,
-                    prepend_mode = prepend_mode
-                )
+    # Go through everything in the archive...
+    for i in get_archive(archive_path).infolist():
+        # and grab all the .pth files.
+        if os.path.dirname(i.filename) == os.path.dirname(site_path) and \
+                i.filename.endswith(os.extsep + "pth"):
+            addpackage(
+                os.path.join(archive_path, site_path),
+                os.path.basename(i.filename),
+                effective_known_paths,
+                prepend_mode = prepend_mode
+            )
 
     return known_paths
 
@@ -174,12 +244,10 @@ def addpackage(sitedir, name, known_paths, prepend_mode = False):
 
     # Figure out if we're dealing with a zip file.
     archive_path, pth_file = split_zip_path(fullname)
-    archive = None
     if not archive_path:
-        f = open(pth_file, mode)
+        f = open(pth_file, "rb")
     else:
-        archive = zipfile.ZipFile(archive_path)
-        f = archive.open(pth_file, "r")
+        f = get_archive(archive_path).open(pth_file, "r")
 
     # Parse through the .pth file
     for n, line in enumerate(f):
@@ -202,19 +270,48 @@ def addpackage(sitedir, name, known_paths, prepend_mode = False):
                         sys.path.append(dir)
                     effective_known_paths.add(dircase)
         except Exception:
-            print("Error processing line {:d} of {}:\n".format(n + 1, fullname), file=sys.stderr)
-
-            # Pretty print the exception info
-            for record in traceback.format_exception(*sys.exc_info()):
-                for line in record.splitlines():
-                    print("  " + line, file=sys.stderr)
-
-            print("\nRemainder of file ignored", file=sys.stderr)
-
+            report_error(fullname, n + 1)
             break
 
     f.close()
-    if archive is not None:
-        archive.close()
 
     return known_paths
+
+def report_error(fullname, line_number):
+    """
+    Prints the exception being handled, which was raised by the given line
+    of the .pth file at ``fullname``, like ``site.addpackage()`` does.
+
+    """
+
+    print("Error processing line {:d} of {}:\n".format(line_number,
+        fullname), file=sys.stderr)
+
+    # Pretty print the exception info
+    for record in traceback.format_exception(*sys.exc_info()):
+        for line in record.splitlines():
+            print("  " + line, file=sys.stderr)
+
+    print("\nRemainder of file ignored", file=sys.stderr)
+
+def execute_imports(sitedir, imports):
+    """
+    Executes the import lines of the .pth files in ``sitedir``, which were
+    read when the archive was built (see ``superzippy.pthfiles``). A line
+    that raises an exception is reported and the rest of its file's lines
+    are skipped, like ``site.addpackage()`` does.
+
+    :param imports: A list of ``(.pth file, line number, line)`` tuples.
+
+    """
+
+    failed = set()
+    for name, line_number, line in imports:
+        if name in failed:
+            continue
+
+        try:
+            exec(line)
+        except Exception:
+            report_error(os.path.join(sitedir, name), line_number)
+            failed.add(name)
@@ -0,0 +1,214 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that remembers finished builds so that building exactly the same
+thing again only has to copy the earlier result.
+
+A build is identified by its inputs: the packages (including the contents of
+any local packages and requirements files), the raw copies, the entry point,
+the interpreter, the options that change what goes into the archive, and
+superzippy itself. Each input is hashed on its own so that when a build
+can't be found, the inputs that changed since the output file was last built
+can be logged.
+
+Like the install cache, packages that aren't local are identified only by
+what was asked for, so ``foo`` is considered unchanged even if a newer
+version of ``foo`` has been released since it was cached.
+
+"""
+
+# stdlib
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import pkg_resources
+
+# internal
+from . import cache
+
+#: The default maximum size of the build cache in bytes (256 MiB).
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+def get_superzippy_hash():
+    """
+    Hashes superzippy's own modules and the bootstrapper, which together
+    decide how an archive is put together.
+
+    """
+
+    digest = hashlib.sha1()
+    for package in ("superzippy", "superzippy.bootstrapper"):
+        for i in sorted(pkg_resources.resource_listdir(package, "")):
+            if i.endswith(".py"):
+                digest.update(i.encode("utf-8"))
+                digest.update(b"\0")
+                digest.update(pkg_resources.resource_string(package, i))
+
+    return digest.hexdigest()
+
+def _hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def get_build_inputs(options, packages, raw_copies, entry_point,
+        interpreter_tag):
+    """
+    Hashes every input of a build.
+
+    :param raw_copies: A list of ``(path, destination name)`` tuples.
+    :returns: An ordered dictionary mapping a description of each input (ex:
+            ``package ./foo``) to its hash.
+
+    """
+
+    inputs = OrderedDict()
+    inputs["superzippy"] = get_superzippy_hash()
+    inputs["interpreter"] = _hash_text(interpreter_tag)
+    inputs["entry point"] = _hash_text(entry_point)
+
+    inputs["options"] = _hash_text(json.dumps({
+        "compile": options.compile,
+        "optimize": options.optimize,
+        "include_source": options.include_source,
+        "compression": options.compression_policy.describe(),
+        "tree_shake": options.tree_shake,
+        "keep": options.keep,
+        "lazy_import": options.lazy_import,
+        "extract": options.extract
+    }, sort_keys = True))
+
+    for i in packages:
+        inputs["package %s" % (i, )] = cache.get_install_key([i], "")
+
+    for path, dest_name in raw_copies:
+        digest = hashlib.sha1(dest_name.encode("utf-8"))
+        inputs["raw copy %s" % (path, )] = \
+            cache.hash_tree(path, digest).hexdigest()
+
+    if options.wheel_dir:
+        # The wheels are identified by name and size rather than hashed,
+        # since there may be a great many of them.
+        wheels = sorted(
+            (i, os.path.getsize(os.path.join(options.wheel_dir, i)))
+            for i in os.listdir(options.wheel_dir))
+        inputs["wheel directory"] = _hash_text(json.dumps(wheels))
+
+    return inputs
+
+def get_build_key(inputs):
+    """
+    Combines the hashes returned by :func:`get_build_inputs` into a single
+    key.
+
+    """
+
+    return _hash_text(json.dumps(list(inputs.items())))
+
+def describe_changes(old_inputs, new_inputs):
+    """
+    Returns a list of messages describing how ``new_inputs`` differ from
+    ``old_inputs`` (ex: ``package ./foo changed``).
+
+    """
+
+    changes = []
+    for k, v in new_inputs.items():
+        if k not in old_inputs:
+            changes.append("%s was added" % (k, ))
+        elif old_inputs[k] != v:
+            changes.append("%s changed" % (k, ))
+
+    for k in old_inputs:
+        if k not in new_inputs:
+            changes.append("%s was removed" % (k, ))
+
+    return changes
+
+class BuildCache(cache.DirectoryCache):
+    """
+    A directory of finished archives, one per build key (see
+    :func:`get_build_key`), each stored alongside the inputs of its build.
+
+    """
+
+    directory = "builds"
+    description = "build cache"
+
+    def lookup(self, key):
+        """
+        Returns the path to the cached archive for ``key``, or ``None`` if
+        there is no such entry.
+
+        """
+
+        entry = self._lookup_entry(key)
+        if entry is None:
+            return None
+
+        return os.path.join(entry, "archive.sz")
+
+    def store(self, key, archive, inputs, output_file):
+        """
+        Copies the archive at ``archive`` into the cache under ``key`` and
+        evicts old entries if necessary.
+
+        :param inputs: The inputs that ``key`` was created from.
+        :param output_file: Where the archive was built, which
+                :meth:`find_previous_inputs` looks for.
+
+        """
+
+        def populate(entry):
+            shutil.copyfile(archive, os.path.join(entry, "archive.sz"))
+            with open(os.path.join(entry, "inputs.json"), "w") as f:
+                json.dump({
+                    "output": os.path.abspath(output_file),
+                    "inputs": inputs
+                }, f, indent = 4)
+
+        self._store_entry(key, populate)
+
+    def find_previous_inputs(self, output_file):
+        """
+        Returns the inputs of the most recently used entry that was built at
+        ``output_file``, or ``None`` if there isn't one.
+
+        """
+
+        output_file = os.path.abspath(output_file)
+
+        found = []
+        for i in os.listdir(self.path):
+            entry = self._entry_path(i)
+            try:
+                with open(os.path.join(entry, "inputs.json")) as f:
+                    info = json.load(f)
+                mtime = os.path.getmtime(entry)
+            except (IOError, OSError, ValueError):
+                # Not an entry, or one being evicted
+                continue
+
+            if info.get("output") == output_file:
+                found.append((mtime, info["inputs"]))
+
+        if not found:
+            return None
+
+        return max(found, key = lambda x: x[0])[1]
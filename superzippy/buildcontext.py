@@ -0,0 +1,100 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that keeps track of which build each thread is working for, so that
+the log messages of one build can be told apart from another's when several
+run in the same process (ex: in the daemon, or through
+:class:`superzippy.Builder`).
+
+The thread running a build starts it with :func:`build_context`, and thread
+pools created with :func:`ThreadPool` work for the build of the thread that
+created them. :class:`BuildFilter` tags each log record with the build it
+was logged for.
+
+"""
+
+# stdlib
+from contextlib import contextmanager
+import itertools
+import logging
+import threading
+
+_local = threading.local()
+_build_ids = itertools.count(1)
+_build_ids_lock = threading.Lock()
+
+def current_build():
+    """
+    Returns the id of the build the current thread is working for, or
+    ``None`` if it isn't working for one.
+
+    """
+
+    return getattr(_local, "build", None)
+
+def _set_build(build):
+    _local.build = build
+
+@contextmanager
+def build_context():
+    """
+    Makes the current thread work for a new build until the block exits.
+    Gives the new build's id.
+
+    """
+
+    with _build_ids_lock:
+        build = next(_build_ids)
+
+    previous = current_build()
+    _set_build(build)
+    try:
+        yield build
+    finally:
+        _set_build(previous)
+
+def ThreadPool(processes = None):
+    """
+    Same as :class:`multiprocessing.pool.ThreadPool`, but the workers work
+    for the current thread's build.
+
+    """
+
+    # Imported here since it's slow to import, and importing superzippy
+    # imports this module.
+    from multiprocessing import pool
+
+    return pool.ThreadPool(processes, _set_build, (current_build(), ))
+
+class BuildFilter(logging.Filter):
+    """
+    Tags each record with the build it was logged for (as its
+    ``superzippy_build`` attribute), and lets through only those logged for
+    ``build``.
+
+    """
+
+    def __init__(self, build):
+        logging.Filter.__init__(self)
+        self.build = build
+
+    def filter(self, record):
+        if not hasattr(record, "superzippy_build"):
+            record.superzippy_build = current_build()
+
+        return record.superzippy_build == self.build
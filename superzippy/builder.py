@@ -0,0 +1,193 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that lets other programs build Super Zips without running the
+``superzippy`` command.
+
+.. code-block:: python
+
+    from superzippy import Builder
+
+    builder = Builder(cache_dir = "/tmp/superzippy-cache", jobs = 4)
+    builder.build("dist/foo.sz", ["."], "tinyscript.main:foo")
+
+Everything a build creates is tracked by the build itself, so any number of
+builds may run at once in different threads (or in an asyncio event loop, see
+:meth:`Builder.build_async`), sharing the caches on disk and, if the builder
+has one, the cache of compressed members in memory.
+
+Builds log to the ``superzippy`` logger but never configure logging
+themselves.
+
+"""
+
+# stdlib
+import copy
+import functools
+import logging
+import os
+import os.path
+
+# internal
+from . import buildcontext
+
+# The rest of superzippy is imported by the methods that need it, since
+# importing superzippy imports this module, and the superzippy command
+# shouldn't pay for all of it when a daemon does its builds.
+
+class BuildError(Exception):
+    """
+    Raised when a build fails. The message is the reason the build logged.
+
+    """
+
+class _FailureHandler(logging.Handler):
+    """
+    Remembers the last critical message logged for ``build`` (see
+    :mod:`superzippy.buildcontext`), which is why that build failed.
+
+    """
+
+    def __init__(self, build):
+        logging.Handler.__init__(self, logging.CRITICAL)
+        self.addFilter(buildcontext.BuildFilter(build))
+        self.message = None
+
+    def emit(self, record):
+        self.message = record.getMessage()
+
+class Builder(object):
+    """
+    Builds Super Zips using the same options as the ``superzippy`` command.
+    Options are given as keyword arguments named after the command's long
+    options (ex: ``cache_dir``, ``tree_shake``, or ``wheel_dir``). Options
+    that turn something off are named after what they turn off (ex:
+    ``use_cache = False`` for ``--no-cache``).
+
+    :param member_cache_size: If given, builds share an in-memory cache of
+            up to this many bytes of compressed members (see
+            :class:`superzippy.zipdir.MemberCache`).
+    :param options: Options used by every build unless the build overrides
+            them.
+
+    :raises TypeError: If an option doesn't exist.
+
+    """
+
+    def __init__(self, member_cache_size = None, **options):
+        from . import packaging, zipdir
+
+        parser = packaging.get_option_parser()
+        self._defaults = parser.get_default_values()
+        self._option_names = set(i.dest for i in parser.option_list
+            if i.dest is not None)
+
+        self._check_options(options)
+        self.options = options
+
+        self.member_cache = None
+        if member_cache_size:
+            self.member_cache = zipdir.MemberCache(member_cache_size)
+
+    def _check_options(self, options):
+        for i in options:
+            if i not in self._option_names or i == "output":
+                raise TypeError("Unknown option %s." % (i, ))
+
+    def _get_options(self, output, packages, entry_point, cwd, overrides):
+        from . import packaging
+
+        self._check_options(overrides)
+
+        options = copy.deepcopy(self._defaults)
+        for k, v in list(self.options.items()) + list(overrides.items()):
+            setattr(options, k, v)
+
+        packaging.prepare_options(options)
+
+        options.output = output
+        options.member_cache = self.member_cache
+
+        args = list(packages) + [entry_point]
+        if cwd is not None:
+            args = packaging.resolve_paths(options, args,
+                os.path.abspath(cwd))
+
+        return options, args
+
+    def build(self, output, packages, entry_point, cwd = None, **options):
+        """
+        Builds a Super Zip.
+
+        :param output: The path of the file to write, or ``-`` to write to
+                standard output.
+        :param packages: A list of strings that will each be given to
+                ``pip install`` (ex: ``["."]`` or ``["clint==0.5.1"]``).
+        :param entry_point: The function to run, in the form
+                ``module:function``.
+        :param cwd: The directory that relative paths are relative to.
+                Defaults to the current working directory.
+        :param options: Options for this build only (see :class:`Builder`).
+
+        :returns: The path of the file written.
+        :raises BuildError: If the build fails.
+        :raises TypeError: If an option doesn't exist.
+        :raises superzippy.compression.InvalidRule: If a compression rule
+                is invalid.
+
+        """
+
+        from . import packaging
+
+        options, args = self._get_options(output, packages, entry_point,
+            cwd, options)
+
+        log = logging.getLogger("superzippy")
+        with buildcontext.build_context() as build:
+            failure = _FailureHandler(build)
+            log.addHandler(failure)
+            try:
+                return_value = packaging.main(options, args)
+            finally:
+                log.removeHandler(failure)
+
+        if return_value != 0:
+            raise BuildError(failure.message or "The build failed.")
+
+        if options.output == "-":
+            return options.output
+
+        return os.path.join(options.cwd, options.output)
+
+    def build_async(self, *args, **kwargs):
+        """
+        Same as :meth:`build`, but runs the build in the running asyncio
+        event loop's default executor and returns a future for its result.
+
+        .. code-block:: python
+
+            await asyncio.gather(
+                builder.build_async("foo.sz", ["."], "tinyscript.main:foo"),
+                builder.build_async("bar.sz", ["."], "tinyscript.main:bar"))
+
+        """
+
+        import asyncio
+
+        return asyncio.get_running_loop().run_in_executor(None,
+            functools.partial(self.build, *args, **kwargs))
@@ -0,0 +1,163 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that compiles a build directory to bytecode ahead of time.
+
+``zipimport`` can't write bytecode back into the archive, so without this
+every module imported from a Super Zip is compiled from source on every run.
+``zipimport`` only looks for ``module.pyc`` right next to ``module.py``
+(never in ``__pycache__``), so that's where the bytecode is put.
+
+The bytecode is written to a staging directory and added to the archive's
+manifest, so the sources (which may live in the install cache) are never
+touched.
+
+"""
+
+# stdlib
+import json
+import logging
+import os
+import os.path
+import subprocess
+
+def parse_version(interpreter_tag):
+    """
+    Returns the version (ex: ``(3, 3, 0)``) of the interpreter described by
+    ``interpreter_tag`` (see :func:`superzippy.cache.get_interpreter_tag`).
+
+    """
+
+    return tuple(int(i) for i in interpreter_tag.split("-")[1].split("."))
+
+#: Run by the target interpreter to compile files. Reads a JSON list of
+#: ``[source, bytecode, display name]`` lists from standard input, and writes
+#: a JSON list of the sources that couldn't be compiled to standard output.
+COMPILE_SCRIPT = """
+import json, py_compile, sys
+kwargs = {}
+if sys.version_info >= (3, 7):
+    kwargs["invalidation_mode"] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+failed = []
+for source, cfile, dfile in json.loads(sys.stdin.read()):
+    try:
+        py_compile.compile(source, cfile, dfile, True, **kwargs)
+    except Exception:
+        failed.append(source)
+sys.stdout.write(json.dumps(failed))
+"""
+
+def compile_files(python, files, optimize, output_target):
+    """
+    Compiles each source file in ``files`` (a list of ``(source, bytecode,
+    display_name)`` tuples) to the given bytecode file, using the interpreter
+    at ``python``. ``display_name`` is the file name used in tracebacks.
+
+    Files are compiled without any check of their source when imported
+    (where the interpreter supports it). Nothing can modify an archive, so
+    there is no point in checking, and this means the bytecode stays valid
+    when the archive is used in a different timezone (zip files store local
+    times).
+
+    :param optimize: 0, 1, or 2. Equivalent to running Python with no flags,
+            ``-O``, or ``-OO`` respectively.
+    :returns: The set of source files that could not be compiled, or
+            ``None`` if the interpreter couldn't be run at all.
+
+    """
+
+    for source, bytecode, display_name in files:
+        bytecode_dir = os.path.dirname(bytecode)
+        if not os.path.isdir(bytecode_dir):
+            os.makedirs(bytecode_dir)
+
+    command = [python]
+    if optimize:
+        command.append("-" + "O" * optimize)
+    command += ["-c", COMPILE_SCRIPT]
+
+    process = subprocess.Popen(command, stdin = subprocess.PIPE,
+        stdout = subprocess.PIPE, stderr = output_target)
+    output = process.communicate(json.dumps(files).encode("utf-8"))[0]
+    if process.returncode != 0:
+        return None
+
+    return set(json.loads(output.decode("utf-8")))
+
+def compile_manifest(options, manifest, staging_dir, output_target):
+    """
+    Compiles every ``.py`` file in ``manifest`` (a
+    :class:`superzippy.manifest.Manifest`) as configured by ``options``,
+    adding the bytecode to the manifest next to its source. The bytecode
+    files are written beneath ``staging_dir``; the sources are never
+    modified.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    log.debug("Compiling bytecode.")
+
+    files = []
+    for archive_name, path, data in manifest.items():
+        if "__pycache__" in archive_name.split("/"):
+            manifest.remove(archive_name)
+            continue
+
+        if not archive_name.endswith(".py"):
+            continue
+
+        staged_name = os.path.join(staging_dir, *archive_name.split("/"))
+        if path is None:
+            # Sources that only exist in memory are written out so that the
+            # interpreter can read them.
+            path = staged_name
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(path, "wb") as f:
+                f.write(data)
+
+        files.append((path, staged_name + "c", archive_name))
+
+    failed = compile_files(options.python, files, options.optimize,
+        output_target)
+    if failed is None:
+        log.warn("Could not run %s to compile bytecode.", options.python)
+        return
+
+    if failed:
+        # Packages often contain files that only compile with some versions
+        # of Python (ex: Python 2 specific test modules), so this is fine
+        # unless one of those files actually gets imported.
+        log.warn("%d files could not be compiled and will be compiled from "
+            "source when imported.", len(failed))
+
+    removed = 0
+    for source, bytecode, archive_name in files:
+        if source in failed:
+            continue
+
+        manifest.add_file(archive_name + "c", bytecode)
+
+        if not options.include_source:
+            manifest.remove(archive_name)
+            removed += 1
+
+    if removed:
+        log.debug("Removed %d source files.", removed)
@@ -0,0 +1,538 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that provides an on-disk cache of installed site-packages trees so
+that repeated builds of the same packages don't need to create a virtual
+environment and run pip every time, along with what it shares with the
+other caches (see :class:`DirectoryCache`).
+
+"""
+
+# stdlib
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+
+#: The default maximum size of the install cache in bytes (1 GiB).
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+#: Names of directories that are ignored when hashing a local package. pip
+#: creates some of these inside of the package's directory when installing
+#: it, so including them would change the hash on every build.
+IGNORED_DIRECTORIES = set(["build", "dist", "__pycache__", ".git", ".hg",
+    ".svn", ".tox"])
+
+#: The names of scratch directories (and of their lock files) start with this.
+SCRATCH_PREFIX = ".tmp-"
+
+#: How old (in seconds) a scratch directory without a lock file has to be
+#: before it's considered abandoned. Older versions of superzippy didn't lock
+#: their scratch directories.
+STALE_SCRATCH_AGE = 24 * 60 * 60
+
+def get_default_cache_dir():
+    """
+    Returns the directory superzippy caches things in when the user doesn't
+    specify one. This respects ``$XDG_CACHE_HOME``.
+
+    """
+
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "superzippy")
+
+#: Tags already found by get_interpreter_tag(), keyed by the interpreter's
+#: real path and modification time.
+_interpreter_tags = {}
+
+def get_interpreter_tag(python):
+    """
+    Returns a string identifying the implementation, version, and platform of
+    the interpreter at ``python``. Two interpreters with the same tag will
+    produce compatible site-packages trees.
+
+    Finding the tag means running the interpreter, so the result is
+    remembered for as long as the interpreter's file doesn't change.
+
+    """
+
+    try:
+        real_path = os.path.realpath(python)
+        key = (real_path, os.path.getmtime(real_path))
+    except OSError:
+        key = None
+
+    if key is not None and key in _interpreter_tags:
+        return _interpreter_tags[key]
+
+    script = (
+        "import sys, platform; sys.stdout.write('%s-%s-%s' % ("
+        "platform.python_implementation(), "
+        "'.'.join(str(i) for i in sys.version_info[:3]), "
+        "sys.platform))"
+    )
+
+    process = subprocess.Popen([python, "-c", script],
+        stdout = subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise RuntimeError("Could not determine version of %s." % (python, ))
+
+    tag = output.decode("ascii").strip()
+    if key is not None:
+        _interpreter_tags[key] = tag
+
+    return tag
+
+def _update_hash_with_file(digest, path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+
+            digest.update(chunk)
+
+def hash_tree(path, digest = None):
+    """
+    Hashes the names and contents of every file beneath ``path`` (which may
+    also be a single file). Build artifacts and version control directories
+    are skipped (see :data:`IGNORED_DIRECTORIES`).
+
+    :returns: The updated ``digest`` object (a new sha1 object if ``digest``
+            is ``None``).
+
+    """
+
+    if digest is None:
+        digest = hashlib.sha1()
+
+    if not os.path.isdir(path):
+        _update_hash_with_file(digest, path)
+        return digest
+
+    for dir_path, dir_names, file_names in os.walk(path):
+        # Sorting in place makes os.walk visit directories in a stable order
+        dir_names[:] = sorted(i for i in dir_names if
+            i not in IGNORED_DIRECTORIES and not i.endswith(".egg-info"))
+
+        for i in sorted(file_names):
+            if i.endswith((".pyc", ".pyo")):
+                continue
+
+            file_path = os.path.join(dir_path, i)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+            digest.update(b"\0")
+            _update_hash_with_file(digest, file_path)
+
+    return digest
+
+def get_install_key(packages, interpreter_tag):
+    """
+    Computes the cache key for installing ``packages`` (a list of strings
+    that would each be given to ``pip install``) with an interpreter
+    identified by ``interpreter_tag``.
+
+    Any argument that refers to a file or directory on the local system (a
+    package directory, a requirements file, a wheel, etc.) has its contents
+    hashed as well, so changing a local package invalidates the entry.
+
+    """
+
+    digest = hashlib.sha1()
+    digest.update(interpreter_tag.encode("utf-8"))
+
+    for i in packages:
+        digest.update(b"\0package\0")
+        for arg in shlex.split(i):
+            digest.update(arg.encode("utf-8"))
+            digest.update(b"\0")
+
+            if os.path.exists(arg):
+                hash_tree(arg, digest)
+
+    return digest.hexdigest()
+
+def get_tree_size(path):
+    """Returns the total size in bytes of all files beneath ``path``."""
+
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for i in file_names:
+            file_path = os.path.join(dir_path, i)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+
+    return total
+
+class FileLock(object):
+    """
+    An advisory lock on the file at ``path``, which is created if it doesn't
+    exist. Locks are taken with ``flock()``, so every :class:`FileLock`
+    object has its own lock: they exclude each other whether they're in
+    different threads, different processes, or (on Linux) on different
+    hosts sharing the file over NFS. A lock held by a process that dies is
+    released along with the process.
+
+    As a context manager, the lock is acquired (waiting as long as
+    necessary) and released.
+
+    """
+
+    def __init__(self, path, shared = False):
+        self.path = path
+        self.shared = shared
+        self._file = None
+
+    def acquire(self, blocking = True):
+        """
+        Acquires the lock.
+
+        :returns: ``False`` if ``blocking`` is ``False`` and the lock is held
+                by somebody else, ``True`` otherwise.
+
+        """
+
+        f = open(self.path, "a")
+
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(f.fileno(), operation)
+        except (IOError, OSError) as e:
+            f.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+
+            raise
+
+        self._file = f
+        return True
+
+    def release(self):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+class ScratchDirectory(object):
+    """
+    A new, empty directory within ``parent`` (available as ``path``) for
+    work in progress. It's locked until :meth:`release` is called, which
+    lets :func:`clean_scratch` tell a directory whose owner died from one
+    that is still in use.
+
+    """
+
+    def __init__(self, parent):
+        while True:
+            fd, lock_path = tempfile.mkstemp(prefix = SCRATCH_PREFIX,
+                suffix = ".lock", dir = parent)
+            os.close(fd)
+
+            self._lock = FileLock(lock_path)
+            self._lock.acquire()
+
+            # clean_scratch() may have deleted the lock file before we
+            # managed to lock it
+            if os.path.exists(lock_path):
+                break
+
+            self._lock.release()
+
+        self._lock_path = lock_path
+        self.path = lock_path[:-len(".lock")]
+        os.mkdir(self.path)
+
+    def release(self):
+        """
+        Deletes the directory (if it hasn't been moved elsewhere) and
+        unlocks it.
+
+        """
+
+        shutil.rmtree(self.path, ignore_errors = True)
+        os.remove(self._lock_path)
+        self._lock.release()
+
+def clean_scratch(parent):
+    """
+    Deletes any scratch directories (see :class:`ScratchDirectory`) within
+    ``parent`` that were left behind by processes that died.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    for i in os.listdir(parent):
+        if not i.startswith(SCRATCH_PREFIX):
+            continue
+
+        path = os.path.join(parent, i)
+        if i.endswith(".lock"):
+            lock = FileLock(path)
+            if not lock.acquire(blocking = False):
+                continue
+
+            try:
+                directory = path[:-len(".lock")]
+                if os.path.exists(directory):
+                    log.debug("Deleting abandoned %s.", directory)
+                    shutil.rmtree(directory, ignore_errors = True)
+
+                os.remove(path)
+            except OSError:
+                # Already cleaned up by somebody else
+                pass
+            finally:
+                lock.release()
+        elif not os.path.exists(path + ".lock"):
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+
+            if age > STALE_SCRATCH_AGE:
+                log.debug("Deleting abandoned %s.", path)
+                shutil.rmtree(path, ignore_errors = True)
+
+class DirectoryCache(object):
+    """
+    A directory of entries (each itself a directory) named after their keys.
+    Entries are evicted least recently used first whenever the cache grows
+    larger than ``max_size`` bytes.
+
+    Subclasses decide what goes into an entry.
+
+    Any number of threads and processes may share a cache. Entries are
+    created in scratch directories and moved into place once complete, so a
+    partial entry is never visible and one left by a crash is cleaned up
+    later. Anything reading an entry should hold :meth:`use` while doing so,
+    which keeps the entry from being evicted.
+
+    """
+
+    #: The directory within the cache directory that holds the entries
+    directory = None
+
+    #: What the cache is called in log messages
+    description = None
+
+    def __init__(self, path, max_size = DEFAULT_MAX_SIZE):
+        self.path = os.path.join(path, self.directory)
+        self.max_size = max_size
+
+        self._locks_dir = os.path.join(self.path, ".locks")
+        if not os.path.isdir(self._locks_dir):
+            try:
+                os.makedirs(self._locks_dir)
+            except OSError as e:
+                # Somebody else may have just created it
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def lock(self, key):
+        """
+        Returns a :class:`FileLock` for creating the entry for ``key``.
+        Holding it while looking up and creating an entry makes concurrent
+        builds (in any process) that need the same entry create it only
+        once.
+
+        """
+
+        return FileLock(os.path.join(self._locks_dir, key + ".create"))
+
+    def use(self, key):
+        """
+        Returns a shared :class:`FileLock` that keeps the entry for ``key``
+        from being evicted while it's held. It should be acquired before
+        looking the entry up.
+
+        """
+
+        return FileLock(self._use_lock_path(key), shared = True)
+
+    def _use_lock_path(self, key):
+        return os.path.join(self._locks_dir, key + ".use")
+
+    def _lookup_entry(self, key):
+        """
+        Returns the path of the entry for ``key``, or ``None`` if there is no
+        such entry.
+
+        """
+
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            return None
+
+        # The entry's modification time is what eviction is ordered by
+        os.utime(entry, None)
+
+        return entry
+
+    def _store_entry(self, key, populate):
+        """
+        Creates the entry for ``key`` by calling ``populate`` with an empty
+        directory to fill, then evicts old entries if necessary.
+
+        :returns: The path of the entry.
+
+        """
+
+        log = logging.getLogger("superzippy")
+
+        # Build the entry somewhere private and then move it into place so
+        # that nobody ever sees a partially written entry.
+        scratch = ScratchDirectory(self.path)
+        try:
+            populate(scratch.path)
+
+            try:
+                os.rename(scratch.path, self._entry_path(key))
+            except OSError:
+                # Somebody else stored the same entry before we did, theirs is
+                # just as good as ours.
+                log.debug("%s entry %s already exists.",
+                    self.description.capitalize(), key)
+        finally:
+            scratch.release()
+
+        self.evict(keep = key)
+
+        return self._entry_path(key)
+
+    def evict(self, keep = None):
+        """
+        Deletes the least recently used entries until the cache is no larger
+        than ``max_size``. The entry for the key ``keep`` and entries that are
+        in use (see :meth:`use`) are never deleted. Also cleans up after any
+        process that died while creating an entry.
+
+        """
+
+        log = logging.getLogger("superzippy")
+
+        clean_scratch(self.path)
+
+        entries = []
+        for i in os.listdir(self.path):
+            if i.startswith(".") or i == keep:
+                continue
+
+            try:
+                entry = self._entry_path(i)
+                entries.append(
+                    (os.path.getmtime(entry), get_tree_size(entry), i))
+            except OSError:
+                # Evicted by somebody else while we were looking
+                continue
+
+        total = sum(size for mtime, size, entry in entries)
+        if keep is not None and os.path.isdir(self._entry_path(keep)):
+            total += get_tree_size(self._entry_path(keep))
+
+        # Oldest first
+        entries.sort()
+        for mtime, size, key in entries:
+            if total <= self.max_size:
+                break
+
+            # Only possible while nobody holds a shared lock from use()
+            use_lock = FileLock(self._use_lock_path(key))
+            if not use_lock.acquire(blocking = False):
+                log.debug("Not evicting %s from the %s, it's in use.", key,
+                    self.description)
+                continue
+
+            try:
+                log.debug("Evicting %s from the %s.", key, self.description)
+
+                # Moving the entry out of the way first means nobody can see
+                # it half deleted, even if we die while deleting it.
+                scratch = ScratchDirectory(self.path)
+                try:
+                    os.rename(self._entry_path(key),
+                        os.path.join(scratch.path, key))
+                except OSError:
+                    # Evicted by somebody else
+                    pass
+                finally:
+                    scratch.release()
+            finally:
+                use_lock.release()
+
+            total -= size
+
+class InstallCache(DirectoryCache):
+    """
+    A directory of installed site-packages trees, one per install key (see
+    :func:`get_install_key`).
+
+    """
+
+    directory = "installs"
+    description = "install cache"
+
+    def lookup(self, key):
+        """
+        Returns the path to the cached site-packages tree for ``key``, or
+        ``None`` if there is no such entry.
+
+        """
+
+        entry = self._lookup_entry(key)
+        if entry is None:
+            return None
+
+        return os.path.join(entry, "site-packages")
+
+    def store(self, key, site_package_dir):
+        """
+        Copies the site-packages tree at ``site_package_dir`` into the cache
+        under ``key`` and evicts old entries if necessary.
+
+        :returns: The path to the cached copy.
+
+        """
+
+        def populate(entry):
+            shutil.copytree(site_package_dir,
+                os.path.join(entry, "site-packages"), symlinks = True)
+
+        return os.path.join(self._store_entry(key, populate), "site-packages")
@@ -0,0 +1,108 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module containing the ``superzippy`` command's entry point.
+
+If a daemon (see :mod:`superzippy.daemon`) is running, builds are handed off
+to it and this module is all that gets imported. Otherwise, or if the daemon
+can't do the build, the build is done in this process as usual.
+
+"""
+
+# stdlib
+import json
+import os
+import os.path
+import socket
+import sys
+
+# internal
+from . import cache
+
+def get_socket_path():
+    """
+    Returns the path of the daemon's socket. This is ``$SUPERZIPPY_SOCKET``
+    if set, otherwise ``daemon.sock`` in the default cache directory.
+
+    """
+
+    return os.environ.get("SUPERZIPPY_SOCKET") or \
+        os.path.join(cache.get_default_cache_dir(), "daemon.sock")
+
+def build_with_daemon(args, path = None, output = sys.stderr):
+    """
+    Asks the daemon listening at ``path`` to do the build described by the
+    command line arguments ``args``, writing its log messages to ``output``.
+
+    :returns: The build's exit status, or ``None`` if there is no daemon or
+            the daemon can't do this build.
+
+    """
+
+    if path is None:
+        path = get_socket_path()
+
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            return None
+
+        # The daemon should build for the same interpreter this process would
+        # (an explicit --python later in args still wins).
+        request = {
+            "args": ["--python", sys.executable] + list(args),
+            "cwd": os.getcwd()
+        }
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+        for line in sock.makefile("rb"):
+            message = json.loads(line.decode("utf-8"))
+            if "log" in message:
+                output.write(message["log"] + "\n")
+                output.flush()
+            elif "exit" in message:
+                return message["exit"]
+            elif "fallback" in message:
+                return None
+
+        # The daemon went away before finishing
+        return None
+    finally:
+        sock.close()
+
+def run():
+    command = sys.argv[1:2]
+    if command == ["serve"]:
+        from . import daemon
+        sys.exit(daemon.run(sys.argv[2:]))
+
+    use_daemon = command not in (["build-all"], ["lock"]) and \
+        not os.environ.get("SUPERZIPPY_NO_DAEMON") and \
+        not set(["-h", "--help"]) & set(sys.argv[1:])
+    if use_daemon:
+        return_value = build_with_daemon(sys.argv[1:])
+        if return_value is not None:
+            sys.exit(return_value)
+
+    from . import packaging
+    packaging.run()
@@ -0,0 +1,222 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that decides how each file in an archive should be compressed.
+
+A policy is an ordered list of rules. Each rule has some conditions (globs
+matched against the file's name in the archive and limits on the file's
+size) and a method. The first rule whose conditions all match a file decides
+how that file is compressed.
+
+Rules can be written as strings of the form ``CONDITIONS=METHOD``, where
+``CONDITIONS`` is a space separated list of globs and size limits (ex:
+``>1M`` or ``<64K``) and ``METHOD`` is ``store``, ``deflate``, or
+``deflate-N`` where ``N`` is a compression level from 0 to 9.
+
+>>> policy = CompressionPolicy.parse(["*.png=store", ">1M=deflate-9"])
+>>> policy.choose("site-packages/foo/logo.png", 100)
+(0, None)
+>>> policy.choose("site-packages/foo/data.json", 2 ** 21)
+(8, 9)
+
+"""
+
+# stdlib
+import fnmatch
+import re
+import zipfile
+
+#: Rules that apply after any the user gives. Files in these formats are
+#: already compressed so deflating them again just costs time.
+DEFAULT_RULES = [
+    "*.png *.jpg *.jpeg *.gif *.ico=store",
+    "*.whl *.egg *.zip *.jar *.gz *.tgz *.bz2 *.xz *.lzma=store",
+    "*.so *.pyd *.dylib=store"
+]
+
+_SIZE_SUFFIXES = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+
+class InvalidRule(ValueError):
+    """
+    Raised when a rule string can't be parsed.
+
+    """
+
+def parse_size(text):
+    """
+    Parses a size like ``512``, ``64K`` or ``1M`` into a number of bytes.
+
+    """
+
+    match = re.match(r"^(\d+)([KMG]?)$", text.upper())
+    if match is None:
+        raise InvalidRule("Invalid size `%s`." % (text, ))
+
+    return int(match.group(1)) * _SIZE_SUFFIXES[match.group(2)]
+
+def parse_method(text):
+    """
+    Parses a method like ``store`` or ``deflate-9``.
+
+    :returns: ``(compression, level)`` where ``level`` is ``None`` for the
+            compression method's default.
+
+    """
+
+    if text == "store":
+        return zipfile.ZIP_STORED, None
+    elif text == "deflate":
+        return zipfile.ZIP_DEFLATED, None
+
+    match = re.match(r"^deflate-([0-9])$", text)
+    if match is None:
+        raise InvalidRule("Invalid compression method `%s`." % (text, ))
+
+    return zipfile.ZIP_DEFLATED, int(match.group(1))
+
+def format_method(compression, level):
+    """
+    The opposite of :func:`parse_method`.
+
+    """
+
+    if compression == zipfile.ZIP_STORED:
+        return "store"
+    elif level is None:
+        return "deflate"
+
+    return "deflate-%d" % (level, )
+
+class Rule(object):
+    """
+    A single compression rule. See the module's documentation.
+
+    """
+
+    def __init__(self, patterns = (), min_size = None, max_size = None,
+            compression = zipfile.ZIP_DEFLATED, level = None):
+        self.patterns = list(patterns)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.compression = compression
+        self.level = level
+
+    @classmethod
+    def parse(cls, text):
+        conditions, separator, method = text.rpartition("=")
+        if not separator:
+            raise InvalidRule("Rule `%s` has no method." % (text, ))
+
+        rule = cls()
+        rule.compression, rule.level = parse_method(method.strip())
+
+        for i in conditions.split():
+            if i.startswith(">"):
+                rule.min_size = parse_size(i[1:]) + 1
+            elif i.startswith("<"):
+                rule.max_size = parse_size(i[1:]) - 1
+            else:
+                rule.patterns.append(i)
+
+        return rule
+
+    def describe(self):
+        """
+        Returns this rule as a string that :meth:`parse` would accept.
+
+        """
+
+        conditions = list(self.patterns)
+        if self.min_size is not None:
+            conditions.append(">%d" % (self.min_size - 1, ))
+        if self.max_size is not None:
+            conditions.append("<%d" % (self.max_size + 1, ))
+
+        return "%s=%s" % (" ".join(conditions),
+            format_method(self.compression, self.level))
+
+    def matches(self, archive_name, size):
+        """
+        Returns ``True`` if this rule applies to a file named
+        ``archive_name`` that is ``size`` bytes large.
+
+        """
+
+        if self.min_size is not None and size < self.min_size:
+            return False
+
+        if self.max_size is not None and size > self.max_size:
+            return False
+
+        # A pattern without a slash only has to match the base name
+        base_name = archive_name.rsplit("/", 1)[-1]
+        return not self.patterns or any(
+            fnmatch.fnmatchcase(archive_name if "/" in i else base_name, i)
+            for i in self.patterns)
+
+class CompressionPolicy(object):
+    """
+    An ordered list of :class:`Rule` objects along with what to do with files
+    that no rule matches.
+
+    """
+
+    def __init__(self, rules = (), compression = zipfile.ZIP_DEFLATED,
+            level = None):
+        self.rules = list(rules)
+        self.compression = compression
+        self.level = level
+
+    @classmethod
+    def parse(cls, rules, use_defaults = True, **kwargs):
+        """
+        Creates a policy from a list of rule strings, followed by
+        :data:`DEFAULT_RULES` if ``use_defaults`` is ``True``.
+
+        """
+
+        if use_defaults:
+            rules = list(rules) + DEFAULT_RULES
+
+        return cls([Rule.parse(i) for i in rules], **kwargs)
+
+    def choose(self, archive_name, size):
+        """
+        Returns ``(compression, level)`` for the file named ``archive_name``
+        (using forward slashes) that is ``size`` bytes large. ``level`` is
+        ``None`` to use the compression method's default.
+
+        """
+
+        for i in self.rules:
+            if i.matches(archive_name, size):
+                return i.compression, i.level
+
+        return self.compression, self.level
+
+    def describe(self):
+        """
+        Returns a string describing the whole policy, one rule per line with
+        a final condition-less rule for files that no other rule matches.
+        Two policies with the same description compress every file the same
+        way.
+
+        """
+
+        return "\n".join([i.describe() for i in self.rules] +
+            ["=" + format_method(self.compression, self.level)])
@@ -0,0 +1,310 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module implementing ``superzippy serve``, a long running process that builds
+Super Zips on behalf of the ``superzippy`` command.
+
+Every build started from the command line pays for starting Python,
+importing superzippy (and ``pkg_resources``), and running the target
+interpreter to find out what it is. The daemon pays for all of that once. It
+also keeps recently compressed archive members in memory (see
+:class:`superzippy.zipdir.MemberCache`) so that packages shared by many
+builds are only compressed once, and keeps the install cache and virtual
+environment templates on disk warm.
+
+The daemon listens on a Unix socket (see
+:func:`superzippy.client.get_socket_path`). A client sends a single line of
+JSON describing the build:
+
+.. code-block:: json
+
+    {"args": ["-o", "foo.sz", ".", "foo:main"], "cwd": "/home/me/foo"}
+
+and the daemon replies with lines of JSON, each of which is one of:
+
+``{"log": "[INFO] ..."}``
+    A log message for the user.
+``{"exit": 0}``
+    The build finished with the given exit status. This is the last line.
+``{"fallback": "reason"}``
+    The daemon can't do this build (ex: it writes the executable to
+    standard output), so the client should do it itself. This is the last
+    line.
+
+Builds run concurrently, each in its own thread, with the daemon's
+environment variables. Output from programs the build runs (with ``-vvv``)
+goes to the daemon's output rather than the client's.
+
+"""
+
+# stdlib
+from optparse import OptionParser, make_option
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+# internal
+from . import buildcontext
+from . import client
+from . import packaging
+from . import zipdir
+
+#: The default size of the in-memory cache of compressed members, in
+#: megabytes.
+DEFAULT_MEMBER_CACHE_SIZE = 256
+
+class _BuildLogHandler(logging.Handler):
+    """
+    Sends the log messages of a single build (``build``, see
+    :mod:`superzippy.buildcontext`) to its client.
+
+    """
+
+    def __init__(self, send, level, build):
+        logging.Handler.__init__(self, level)
+        self.send = send
+        self.addFilter(buildcontext.BuildFilter(build))
+        self.setFormatter(logging.Formatter(packaging.LOG_FORMAT))
+
+    def emit(self, record):
+        try:
+            self.send({"log": self.format(record)})
+        except (IOError, OSError):
+            # The client went away, the build carries on regardless.
+            pass
+
+class BuildHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line.decode("utf-8"))
+            args = [str(i) for i in request["args"]]
+            cwd = str(request["cwd"])
+        except (ValueError, KeyError, TypeError):
+            self.send({"fallback": "invalid request"})
+            return
+
+        self.server.build(args, cwd, self.send)
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Listens at ``path`` for build requests, running up to ``workers`` builds
+    at once and sharing ``member_cache`` (a
+    :class:`superzippy.zipdir.MemberCache`) between them.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, workers, member_cache):
+        socketserver.UnixStreamServer.__init__(self, path, BuildHandler)
+
+        self.member_cache = member_cache
+        self.workers = threading.BoundedSemaphore(workers)
+
+    def build(self, args, cwd, send):
+        """
+        Builds a Super Zip as if ``superzippy`` had been run with ``args`` in
+        the directory ``cwd``, sending the results with ``send``.
+
+        """
+
+        log = logging.getLogger("superzippy.daemon")
+
+        try:
+            options, args = packaging.parse_arguments(args)
+        except SystemExit:
+            # The client will show the user what's wrong when it tries
+            # itself.
+            send({"fallback": "invalid arguments"})
+            return
+
+        if options.output == "-":
+            send({"fallback": "can't write to the client's standard output"})
+            return
+
+        args = packaging.resolve_paths(options, args, cwd)
+        options.member_cache = self.member_cache
+
+        with self.workers:
+            log.info("Building %s in %s.", args[-1], cwd)
+            start_time = time.time()
+
+            build_log = logging.getLogger("superzippy")
+            with buildcontext.build_context() as build:
+                handler = _BuildLogHandler(send,
+                    packaging.get_log_level(options), build)
+                build_log.addHandler(handler)
+                try:
+                    return_value = packaging.main(options, args)
+                except Exception:
+                    build_log.critical("Unexpected error.",
+                        exc_info = sys.exc_info())
+                    return_value = 1
+                finally:
+                    build_log.removeHandler(handler)
+
+            log.info("Built %s in %.2f seconds (exit status %d).", args[-1],
+                time.time() - start_time, return_value)
+
+        send({"exit": return_value})
+
+def is_listening(path):
+    """
+    Returns ``True`` if something is accepting connections at ``path``.
+
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+def parse_arguments(args):
+    option_list = [
+        make_option(
+            "-v", "--verbose", action = "count", default = 0,
+            help = "Log each build the daemon does."
+        ),
+        make_option(
+            "-q", "--quiet", action = "store_true",
+            help = "Only log errors."
+        ),
+        make_option(
+            "--socket", action = "store", default = None,
+            help =
+                "The path of the socket to listen on. Defaults to the "
+                "SUPERZIPPY_SOCKET environment variable if set, otherwise "
+                "daemon.sock in the default cache directory."
+        ),
+        make_option(
+            "--workers", action = "store", type = "int",
+            default = multiprocessing.cpu_count(),
+            help =
+                "The number of builds to run at once. Defaults to the number "
+                "of CPUs (%default)."
+        ),
+        make_option(
+            "--member-cache-size", action = "store", type = "int",
+            default = DEFAULT_MEMBER_CACHE_SIZE,
+            help =
+                "The amount of memory, in megabytes, to use to remember "
+                "compressed files between builds. Defaults to %default."
+        )
+    ]
+
+    parser = OptionParser(
+        usage = "usage: %prog serve [options]",
+        description =
+            "Runs a daemon that does the builds of any superzippy commands "
+            "run while it's running, which saves each of them from "
+            "starting up from scratch.",
+        option_list = option_list
+    )
+
+    options, args = parser.parse_args(args)
+
+    if args:
+        parser.error("serve takes no arguments.")
+
+    if options.socket is None:
+        options.socket = client.get_socket_path()
+
+    return options, args
+
+def setup_logging(options):
+    # Messages about the daemon itself go to its standard error...
+    log = logging.getLogger("superzippy.daemon")
+    log.propagate = False
+    log.setLevel(packaging.get_log_level(options))
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(packaging.LOG_FORMAT))
+    log.addHandler(handler)
+
+    # while messages from builds only go to their clients, which each
+    # decide what level they want.
+    build_log = logging.getLogger("superzippy")
+    build_log.propagate = False
+    build_log.setLevel(logging.DEBUG)
+
+def _raise_exit(signal_number, frame):
+    sys.exit(0)
+
+def main(options, args):
+    log = logging.getLogger("superzippy.daemon")
+
+    path = options.socket
+    if os.path.exists(path):
+        if is_listening(path):
+            log.critical("A daemon is already listening at %s.", path)
+            return 1
+
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(path)
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    # Only this user may connect
+    old_umask = os.umask(0o077)
+    try:
+        server = BuildServer(path, max(options.workers, 1),
+            zipdir.MemberCache(options.member_cache_size * 2 ** 20))
+    finally:
+        os.umask(old_umask)
+
+    signal.signal(signal.SIGTERM, _raise_exit)
+
+    log.warn("Listening at %s.", path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+        log.info("Compressed member cache: %d hits, %d misses.",
+            server.member_cache.hits, server.member_cache.misses)
+
+    return 0
+
+def run(args):
+    options, args = parse_arguments(args)
+    setup_logging(options)
+    return main(options, args)
@@ -0,0 +1,275 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that installs packages into a fresh virtual environment with pip.
+
+"""
+
+# stdlib
+import logging
+import os
+import os.path
+import shlex
+import subprocess
+import time
+
+# internal
+from . import metrics as build_metrics
+from . import venvpool
+from .buildcontext import ThreadPool
+
+#: Options that may be given alongside package names to a single pip
+#: invocation without changing how the other packages are installed. Each of
+#: these takes a single value.
+BATCHABLE_OPTIONS = set(["-r", "--requirement", "-e", "--editable"])
+
+def is_batchable(args):
+    """
+    Returns ``True`` if the pip arguments ``args`` (a list of strings) can be
+    merged with other such arguments into a single ``pip install``. Anything
+    that passes options to pip (ex: ``--global-option``) affects every package
+    in the invocation and so must be installed on its own.
+
+    """
+
+    expecting_value = False
+    for i in args:
+        if expecting_value:
+            expecting_value = False
+        elif i in BATCHABLE_OPTIONS:
+            expecting_value = True
+        elif i.startswith("-"):
+            return False
+
+    return True
+
+def group_package_arguments(packages, batch = True):
+    """
+    Splits each string in ``packages`` into pip arguments and merges runs of
+    consecutive batchable packages (see :func:`is_batchable`) together.
+
+    :param packages: A list of strings that would each be given to
+            ``pip install``.
+    :param batch: If ``False``, no merging is done and every package gets its
+            own group.
+    :returns: A list of lists of pip arguments, one per pip invocation. The
+            original order of the packages is preserved.
+
+    >>> group_package_arguments(["a", "-r b.txt", "c --foo", "d"])
+    [['a', '-r', 'b.txt'], ['c', '--foo'], ['d']]
+
+    """
+
+    groups = []
+    last_batchable = False
+    for i in packages:
+        args = shlex.split(i)
+        batchable = batch and is_batchable(args)
+
+        if batchable and last_batchable:
+            groups[-1] += args
+        else:
+            groups.append(args)
+
+        last_batchable = batchable
+
+    return groups
+
+def split_batch(args):
+    """
+    Splits a merged batch of pip arguments back up into one list of
+    arguments per requirement (a ``-r file`` pair counts as one).
+
+    """
+
+    result = []
+    expecting_value = False
+    for i in args:
+        if expecting_value:
+            result[-1].append(i)
+            expecting_value = False
+        else:
+            result.append([i])
+            expecting_value = i in BATCHABLE_OPTIONS
+
+    return result
+
+def prefetch_wheels(pip_command, args, wheel_dir, jobs, output_target,
+        cwd = None):
+    """
+    Downloads and builds wheels for the batch of pip arguments ``args`` using
+    up to ``jobs`` concurrent ``pip wheel`` processes, each handling a single
+    requirement. This warms pip's download and wheel caches so that the
+    subsequent (single) ``pip install`` of the whole batch has almost nothing
+    left to do.
+
+    :param cwd: The directory to run pip in, which relative paths in
+            ``args`` are relative to.
+    :returns: ``True`` if every ``pip wheel`` process succeeded.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    def build(requirement):
+        log.debug("Prefetching wheels with `pip wheel %s`.",
+            " ".join(requirement))
+
+        return subprocess.call(
+            pip_command + ["wheel", "--wheel-dir", wheel_dir] + requirement,
+            stdout = output_target,
+            stderr = subprocess.STDOUT,
+            cwd = cwd
+        )
+
+    pool = ThreadPool(jobs)
+    try:
+        return_values = pool.map(build, split_batch(args))
+    finally:
+        pool.close()
+        pool.join()
+
+    return all(i == 0 for i in return_values)
+
+def install_packages(options, packages, virtualenv_dir, output_target,
+        metrics = None):
+    """
+    Creates a virtual environment at ``virtualenv_dir`` (which should be an
+    empty directory) and installs ``packages`` into it with pip. See
+    :func:`superzippy.venvpool.create_environment`.
+
+    :param metrics: A :class:`superzippy.metrics.Metrics` object to record
+            the ``virtualenv`` and ``pip install`` phases in.
+
+    :returns: The path to the virtual environment's site-packages directory,
+            or ``None`` if something went wrong (the problem will have been
+            logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    if metrics is None:
+        metrics = build_metrics.Metrics()
+
+    #### Create virtual environment
+
+    log.debug("Creating virtual environment at %s.", virtualenv_dir)
+
+    with metrics.phase("virtualenv") as record:
+        if not venvpool.create_environment(options, virtualenv_dir,
+                output_target):
+            return None
+
+        record["files"] = build_metrics.count_files(virtualenv_dir)
+
+    ##### Install package and dependencies
+
+    # pip is run through the environment's interpreter rather than through
+    # bin/pip, whose #! line would point into the template if this
+    # environment was cloned from one.
+    pip_command = [os.path.join(virtualenv_dir, "bin", "python"), "-m", "pip"]
+    wheel_dir = os.path.join(virtualenv_dir, "superzippy-wheels")
+
+    start_time = time.time()
+    for args in group_package_arguments(packages, options.batch_install):
+        find_links = []
+        if options.wheel_dir:
+            find_links = ["--find-links", options.wheel_dir]
+
+        if options.jobs > 1 and is_batchable(args) and \
+                len(split_batch(args)) > 1:
+            # A failure here isn't fatal, pip install will report whatever
+            # the actual problem is.
+            with metrics.phase("pip prefetch", arguments = args):
+                if not prefetch_wheels(pip_command, args, wheel_dir,
+                        options.jobs, output_target, options.cwd):
+                    log.warn("Could not prefetch wheels for `%s`.",
+                        " ".join(args))
+
+            find_links += ["--find-links", wheel_dir]
+
+        log.debug("Installing packages with `pip install %s`.",
+            " ".join(args))
+
+        command = pip_command + ["install"] + find_links + args
+        with metrics.phase("pip install", arguments = args) as record:
+            files_before = build_metrics.count_files(virtualenv_dir)
+
+            return_value = subprocess.call(
+                command,
+                stdout = output_target,
+                stderr = subprocess.STDOUT,
+                cwd = options.cwd
+            )
+
+            record["files"] = \
+                build_metrics.count_files(virtualenv_dir) - files_before
+
+        if return_value != 0:
+            log.critical("pip returned non-zero exit status (%d).", return_value)
+            return None
+
+    if not packages:
+        log.warn("No packages specified.")
+    else:
+        log.info("Installed packages in %.2f seconds.",
+            time.time() - start_time)
+
+    #### Uninstall extraneous packages (pip and setuptools)
+    return_value = subprocess.call(
+        pip_command + ["uninstall", "--yes", "pip", "setuptools"],
+        stdout = output_target,
+        stderr = subprocess.STDOUT
+    )
+
+    if return_value != 0:
+        log.critical("pip returned non-zero exit status (%d).",
+            return_value)
+        return None
+
+    #### Find the site-packages directory
+
+    # TODO: We should look at pip's source code and figure out how it decides
+    # where site-packages is and use the same algorithm.
+
+    site_package_dir = None
+    for root, dirs, files in os.walk(virtualenv_dir):
+        if "site-packages" in dirs:
+            found = os.path.join(root, "site-packages")
+
+            # We'll only use the first one, but we want to detect them all.
+            if site_package_dir is not None:
+                log.warn(
+                    "Multiple site-packages directories found. `%s` will be "
+                    "used. `%s` was found afterwards.",
+                    site_package_dir,
+                    found
+                )
+            else:
+                site_package_dir = found
+
+    # A couple .pth files are consistently left over from the previous step,
+    # delete them.
+    extraneous_pth_files = ["easy-install.pth", "setuptools.pth"]
+    for i in extraneous_pth_files:
+        path = os.path.join(site_package_dir, i)
+        if os.path.exists(path):
+            os.remove(path)
+
+    return site_package_dir
@@ -0,0 +1,427 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module implementing ``superzippy lock``, which resolves packages once into a
+lock file, and reading lock files back for builds given ``--lock``.
+
+A lock file is a requirements file in pip's hash-checking format, listing
+every package that resolving the packages installed, pinned to an exact
+version and followed by the hashes of its files:
+
+.. code-block:: text
+
+    # interpreter: CPython-3.11.7-linux
+    args==0.1.0 \\
+        --hash=sha256:59cd8a5fafe2aec38dec676a8fa64ff9154e623ae23e4d81ed1af...
+    clint==0.5.1 \\
+        --hash=sha256:ff6c58a1f34bc0d3c884b2a3eded885320f0673fd9c9b495d3982...
+
+Local packages (project directories) can't be pinned, so they're left out of
+the lock file, though their dependencies aren't. A build from a lock file
+installs the locked packages without resolving any dependencies, and then
+installs the local packages on top of them, again without dependencies.
+
+Resolving is done by asking pip what it would install (``pip install
+--dry-run --report``), which requires pip 22.2 or newer in the virtual
+environment.
+
+"""
+
+# stdlib
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shlex
+import subprocess
+import sys
+
+# external
+import pkg_resources
+
+# internal
+from . import cache
+from . import venvpool
+from . import wheels
+
+#: The lock file written when no output file is given.
+DEFAULT_LOCK_FILE = "superzippy.lock"
+
+class InvalidLockFile(ValueError):
+    """
+    Raised when a lock file can't be understood, or can't be used with the
+    packages being built.
+
+    """
+
+class LockedPackage(object):
+    """
+    A package pinned to an exact version, along with the hashes (strings
+    like ``sha256:abc...``) that its file may have.
+
+    """
+
+    def __init__(self, name, version, hashes):
+        self.name = name
+        self.version = version
+        self.hashes = list(hashes)
+
+    def __eq__(self, other):
+        return (self.name, self.version, self.hashes) == \
+            (other.name, other.version, other.hashes)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "LockedPackage(%r, %r, %r)" % (self.name, self.version,
+            self.hashes)
+
+    @property
+    def requirement(self):
+        return "%s==%s" % (self.name, self.version)
+
+    @property
+    def key(self):
+        return wheels.normalize_name(self.name)
+
+    def matches(self, path):
+        """
+        Returns ``True`` if the file at ``path`` has one of this package's
+        hashes.
+
+        """
+
+        algorithms = set(i.split(":", 1)[0] for i in self.hashes)
+        for algorithm in algorithms:
+            try:
+                digest = hashlib.new(algorithm)
+            except ValueError:
+                continue
+
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    digest.update(chunk)
+
+            if "%s:%s" % (algorithm, digest.hexdigest()) in self.hashes:
+                return True
+
+        return False
+
+class LockFile(object):
+    """
+    The contents of a lock file: a list of :class:`LockedPackage` objects
+    and the tag (see :func:`superzippy.cache.get_interpreter_tag`) of the
+    interpreter they were resolved for.
+
+    """
+
+    def __init__(self, packages, interpreter_tag = None):
+        self.packages = sorted(packages, key = lambda x: x.key)
+        self.interpreter_tag = interpreter_tag
+
+    def find(self, name):
+        """
+        Returns the locked package named ``name`` or ``None``.
+
+        """
+
+        key = wheels.normalize_name(name)
+        for i in self.packages:
+            if i.key == key:
+                return i
+
+        return None
+
+    def dumps(self):
+        lines = [
+            "# This file was generated by superzippy lock. Build with",
+            "# --lock to install exactly these packages.",
+            "#"
+        ]
+
+        if self.interpreter_tag:
+            lines.append("# interpreter: %s" % (self.interpreter_tag, ))
+
+        for i in self.packages:
+            lines.append(" \\\n".join([i.requirement] +
+                ["    --hash=%s" % (j, ) for j in i.hashes]))
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def loads(cls, text):
+        """
+        Parses the contents of a lock file.
+
+        :raises InvalidLockFile: If anything but pinned requirements with
+                hashes is found.
+
+        """
+
+        interpreter_tag = None
+        packages = []
+
+        for line in text.replace("\\\n", " ").splitlines():
+            comment = line.partition("#")[2].strip()
+            if comment.startswith("interpreter:"):
+                interpreter_tag = comment[len("interpreter:"):].strip()
+
+            args = shlex.split(line.partition("#")[0])
+            if not args:
+                continue
+
+            hashes = []
+            for i in args[1:]:
+                if not i.startswith("--hash="):
+                    raise InvalidLockFile("Unexpected %s in lock file." %
+                        (i, ))
+                hashes.append(i[len("--hash="):])
+
+            name, _, version = args[0].partition("==")
+            if not name or not version or not hashes:
+                raise InvalidLockFile("%s is not pinned with a hash." %
+                    (args[0], ))
+
+            packages.append(LockedPackage(name, version, hashes))
+
+        return cls(packages, interpreter_tag)
+
+def read_lock_file(path):
+    """
+    Reads the lock file at ``path``.
+
+    :raises InvalidLockFile: If it can't be understood.
+    :raises IOError: If it can't be read.
+
+    """
+
+    with open(path) as f:
+        return LockFile.loads(f.read())
+
+def parse_report(report):
+    """
+    Turns a pip installation report (see ``pip install --report``) into a
+    list of :class:`LockedPackage` objects.
+
+    :returns: ``(locked packages, names of local packages)``
+    :raises InvalidLockFile: If a package that isn't local has no hash.
+
+    """
+
+    locked = []
+    local = []
+    for i in report["install"]:
+        name = i["metadata"]["name"]
+        download_info = i.get("download_info", {})
+
+        if "dir_info" in download_info:
+            local.append(name)
+            continue
+
+        hashes = download_info.get("archive_info", {}).get("hashes", {})
+        if not hashes:
+            raise InvalidLockFile("pip did not report a hash for %s, so it "
+                "can't be locked." % (name, ))
+
+        locked.append(LockedPackage(name, i["metadata"]["version"],
+            ["%s:%s" % (k, v) for k, v in sorted(hashes.items())]))
+
+    return locked, local
+
+def resolve(options, packages, virtualenv_dir, output_target):
+    """
+    Works out which packages installing ``packages`` (a list of strings that
+    would each be given to ``pip install``) would install, without
+    installing them, using a new virtual environment at ``virtualenv_dir``.
+    Every package is resolved at once, by a single pip invocation.
+
+    :returns: A :class:`LockFile`, or ``None`` if something went wrong (the
+            problem will have been logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    if not venvpool.create_environment(options, virtualenv_dir,
+            output_target):
+        return None
+
+    report_path = os.path.join(virtualenv_dir, "superzippy-report.json")
+
+    command = [os.path.join(virtualenv_dir, "bin", "python"), "-m", "pip",
+        "install", "--dry-run", "--ignore-installed", "--report",
+        report_path]
+    if options.wheel_dir:
+        command += ["--find-links", options.wheel_dir]
+    for i in packages:
+        command += shlex.split(i)
+
+    log.debug("Resolving packages with `%s`.", " ".join(command))
+
+    return_value = subprocess.call(
+        command,
+        stdout = output_target,
+        stderr = subprocess.STDOUT,
+        cwd = options.cwd
+    )
+    if return_value != 0:
+        log.critical("pip returned non-zero exit status (%d). Locking "
+            "requires pip 22.2 or newer.", return_value)
+        return None
+
+    with open(report_path) as f:
+        report = json.load(f)
+
+    try:
+        locked, local = parse_report(report)
+    except InvalidLockFile as e:
+        log.critical("%s", e)
+        return None
+
+    for i in local:
+        log.info("%s is a local package, so it isn't locked.", i)
+
+    return LockFile(locked, cache.get_interpreter_tag(options.python))
+
+def get_locked_packages(options, packages, interpreter_tag):
+    """
+    Works out what to install for a build given ``--lock``. Local packages
+    in ``packages`` are installed without their dependencies (which are
+    expected to be in the lock file). Anything else must be a requirement
+    that the lock file satisfies, and isn't installed on its own.
+
+    :returns: ``(lock file, local packages)``
+    :raises InvalidLockFile: If a package isn't in the lock file, or the
+            lock file can't be understood.
+    :raises IOError: If the lock file can't be read.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    lock_file = read_lock_file(options.lock)
+    if lock_file.interpreter_tag not in (None, interpreter_tag):
+        log.warn("%s was locked for %s, not %s.", options.lock,
+            lock_file.interpreter_tag, interpreter_tag)
+
+    local = []
+    for i in packages:
+        args = shlex.split(i)
+        name = args[0]
+        if os.path.exists(os.path.join(options.cwd, name)):
+            local.append(i)
+            continue
+
+        try:
+            requirement = pkg_resources.Requirement.parse(name)
+        except ValueError:
+            requirement = None
+
+        # Options given to pip alongside the package would be lost
+        if requirement is None or len(args) > 1:
+            raise InvalidLockFile("%s can't be built from a lock file." %
+                (i, ))
+
+        locked = lock_file.find(requirement.project_name)
+        if locked is None or locked.version not in requirement:
+            raise InvalidLockFile("%s is not in %s. Run superzippy lock "
+                "again." % (name, options.lock))
+
+    return lock_file, local
+
+#### The superzippy lock command
+
+def parse_arguments(args):
+    # Imported here because the packaging module depends on this one
+    from . import compression
+    from . import packaging
+
+    parser = packaging.get_option_parser()
+    parser.set_usage("usage: %prog lock [options] [PACKAGE1 PACKAGE2 ...]")
+    parser.description = (
+        "Resolves every PACKAGE and requirements file (see -r) at once and "
+        "writes every package that would be installed, pinned to an exact "
+        "version with the hashes of its files, to a lock file (%s unless "
+        "-o is given). Builds given --lock install exactly those packages "
+        "without resolving anything." % (DEFAULT_LOCK_FILE, ))
+
+    options, args = parser.parse_args(args)
+
+    if not args and not options.requirements:
+        parser.error("1 or more packages or requirements files must be "
+            "supplied.")
+
+    try:
+        packaging.prepare_options(options)
+    except compression.InvalidRule as e:
+        parser.error(str(e))
+
+    return options, args
+
+def main(options, args):
+    # Imported here because the packaging module depends on this one
+    from . import packaging
+
+    log = logging.getLogger("superzippy")
+
+    packages = args + ["-r %s" % (i, ) for i in options.requirements]
+    output_file = os.path.join(options.cwd,
+        options.output or DEFAULT_LOCK_FILE)
+
+    cleanup = []
+    try:
+        if options.verbose < 3:
+            output_target = open(os.devnull, "w")
+            cleanup.append(output_target.close)
+        else:
+            output_target = None
+
+        lock_file = resolve(options, packages,
+            packaging.create_virtualenv_dir(options, cleanup), output_target)
+        if lock_file is None:
+            return 1
+    finally:
+        for i in reversed(cleanup):
+            try:
+                i()
+            except Exception:
+                log.warn("Could not clean up after locking.",
+                    exc_info = sys.exc_info())
+
+    try:
+        with open(output_file, "w") as f:
+            f.write(lock_file.dumps())
+    except IOError:
+        log.critical("Could not write to lock file at '%s'.", output_file,
+            exc_info = sys.exc_info())
+        return 1
+
+    log.info("Locked %d packages in %s.", len(lock_file.packages),
+        output_file)
+
+    return 0
+
+def run(args):
+    # Imported here because the packaging module depends on this one
+    from . import packaging
+
+    options, args = parse_arguments(args)
+    packaging.setup_logging(options, args)
+    return main(options, args)
@@ -0,0 +1,154 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that describes what goes into an archive without copying anything.
+
+Rather than assembling the archive's contents in a directory and then
+zipping the directory up, a :class:`Manifest` records where each member's
+data lives (a file anywhere on disk, or bytes in memory). The archive writer
+then reads each file exactly once, straight from where it already is.
+
+"""
+
+# stdlib
+from collections import OrderedDict
+import os
+import os.path
+
+def _is_within(path, directory):
+    return path == directory or path.startswith(directory + os.sep)
+
+class Manifest(object):
+    """
+    An ordered mapping of archive names (using forward slashes) to the data
+    that should be stored under them.
+
+    >>> manifest = Manifest()
+    >>> manifest.add_tree("site-packages", "/tmp/venv/lib/site-packages")
+    >>> manifest.add_bytes("superconfig.py", b"entry_point = 'foo:bar'")
+
+    """
+
+    def __init__(self):
+        # Maps archive names to (path, data) tuples, exactly one of which is
+        # not None.
+        self._entries = OrderedDict()
+
+    def add_file(self, archive_name, path):
+        """
+        Adds the file at ``path`` as ``archive_name``, replacing anything
+        already there.
+
+        """
+
+        self._entries.pop(archive_name, None)
+        self._entries[archive_name] = (path, None)
+
+    def add_bytes(self, archive_name, data):
+        """
+        Adds ``data`` as ``archive_name``, replacing anything already there.
+
+        """
+
+        self._entries.pop(archive_name, None)
+        self._entries[archive_name] = (None, data)
+
+    def add_tree(self, prefix, path):
+        """
+        Adds every file beneath the directory ``path``, named relative to
+        ``path`` and placed within ``prefix`` (which may be empty).
+        Symbolic links to directories are followed, unless they point back
+        at a directory they're within.
+
+        """
+
+        for dir_path, dir_names, file_names in os.walk(path,
+                followlinks = True):
+            real_dir = os.path.realpath(dir_path)
+            dir_names[:] = [i for i in dir_names
+                if not _is_within(real_dir,
+                    os.path.realpath(os.path.join(dir_path, i)))]
+
+            relative_dir = os.path.relpath(dir_path, path)
+            if relative_dir == os.curdir:
+                parts = []
+            else:
+                parts = relative_dir.split(os.sep)
+
+            if prefix:
+                parts.insert(0, prefix)
+
+            for i in file_names:
+                self.add_file("/".join(parts + [i]),
+                    os.path.join(dir_path, i))
+
+    def remove(self, archive_name):
+        del self._entries[archive_name]
+
+    def get(self, archive_name):
+        """
+        Returns ``(path, data)`` for ``archive_name``. Exactly one of the two
+        is ``None``.
+
+        """
+
+        return self._entries[archive_name]
+
+    def read(self, archive_name):
+        """
+        Returns the contents of ``archive_name`` as bytes.
+
+        """
+
+        path, data = self._entries[archive_name]
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+
+        return data
+
+    def get_files(self, prefix):
+        """
+        Returns a dictionary mapping the names of the entries within
+        ``prefix`` (relative to ``prefix``) to the paths of their files.
+        Entries stored as bytes are left out.
+
+        """
+
+        prefix = prefix.rstrip("/") + "/"
+        return dict((name[len(prefix):], path)
+            for name, (path, data) in self._entries.items()
+            if name.startswith(prefix) and path is not None)
+
+    def items(self):
+        """
+        Returns a list of ``(archive_name, path, data)`` tuples in the order
+        the entries were added.
+
+        """
+
+        return [(k, path, data) for k, (path, data) in self._entries.items()]
+
+    def __contains__(self, archive_name):
+        return archive_name in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,156 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that measures how long each phase of a build takes and how much work
+it does, so that slow builds can be tracked down.
+
+Each phase records:
+
+``wall_time``
+    Seconds elapsed.
+``cpu_time``
+    Seconds of CPU time used by this process and any subprocesses (ex: pip)
+    that finished during the phase.
+``bytes_read``, ``bytes_written``
+    Bytes read and written by this process and any subprocesses that
+    finished during the phase (on Linux, from ``/proc/self/io``, otherwise
+    ``null``).
+``files``
+    The number of files the phase produced (or removed, for phases that
+    remove files), or ``null`` if that doesn't make sense for the phase.
+
+The counters are process wide, so phases of builds running concurrently in
+the same process (ex: with ``build-all``) include each other's work.
+
+"""
+
+# stdlib
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+#: Bumped whenever the format of the metrics file changes incompatibly.
+FORMAT_VERSION = 1
+
+def get_io_counters():
+    """
+    Returns the number of bytes this process has read and written so far as
+    ``(read, written)``, or ``(None, None)`` if that can't be determined.
+
+    """
+
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+def get_cpu_time():
+    """
+    Returns the CPU time used so far by this process and all of its
+    subprocesses that have been waited for.
+
+    """
+
+    return sum(os.times()[:4])
+
+def count_files(path):
+    """
+    Returns the number of files beneath ``path``.
+
+    """
+
+    return sum(len(file_names) for dir_path, dir_names, file_names in
+        os.walk(path))
+
+class Metrics(object):
+    """
+    The phases of a single build.
+
+    >>> metrics = Metrics()
+    >>> with metrics.phase("zip") as record:
+    ...     record["files"] = zip_everything()
+
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.start_time = time.time()
+        self.start_cpu_time = get_cpu_time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **details):
+        """
+        Measures the code within the ``with`` block as a phase called
+        ``name``. The phase's record (a dictionary containing ``details``) is
+        yielded so that the block can fill in ``files`` or override any of
+        the measurements.
+
+        Phases are listed in the order they start, and may be nested.
+
+        """
+
+        record = dict(name = name, files = None, **details)
+        with self._lock:
+            self.phases.append(record)
+
+        start_time = time.time()
+        start_cpu_time = get_cpu_time()
+        start_read, start_written = get_io_counters()
+        try:
+            yield record
+        finally:
+            end_read, end_written = get_io_counters()
+
+            measured = {
+                "wall_time": time.time() - start_time,
+                "cpu_time": get_cpu_time() - start_cpu_time,
+                "bytes_read": None,
+                "bytes_written": None
+            }
+            if start_read is not None and end_read is not None:
+                measured["bytes_read"] = end_read - start_read
+                measured["bytes_written"] = end_written - start_written
+
+            for k, v in measured.items():
+                record.setdefault(k, v)
+
+    def to_dict(self, succeeded):
+        return {
+            "version": FORMAT_VERSION,
+            "succeeded": succeeded,
+            "wall_time": time.time() - self.start_time,
+            "cpu_time": get_cpu_time() - self.start_cpu_time,
+            "phases": self.phases
+        }
+
+    def write(self, path, succeeded):
+        """
+        Writes the metrics to ``path`` as JSON.
+
+        """
+
+        with open(path, "w") as f:
+            json.dump(self.to_dict(succeeded), f, indent = 4,
+                sort_keys = True)
+            f.write("\n")
@@ -0,0 +1,136 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that creates the index of the modules in an archive's site-packages
+directory, which the bootstrapper's importer (see
+``superzippy/bootstrapper/zipindex.py``) uses instead of ``zipimport``.
+
+The index is a JSON object with three keys:
+
+``members``
+    Maps the name of every member beneath site-packages (relative to
+    site-packages) to ``[offset, compression method, compressed size,
+    size]``, where ``offset`` is that of the member's local header as the
+    central directory gives it.
+
+``modules``
+    Maps the location of every module in site-packages (ex: ``foo/bar`` for
+    ``foo/bar.py`` or ``foo/bar/__init__.py``) to ``[is package, source
+    member, bytecode member]``. Either member may be ``null``. Modules are
+    indexed by location rather than by name since directories other than
+    site-packages itself may be on ``sys.path`` (ex: when named by a
+    ``.pth`` file), so ``foo/bar`` may be imported as ``bar``.
+
+``directories``
+    The name of every directory beneath site-packages, which may be portions
+    of namespace packages.
+
+"""
+
+# stdlib
+import json
+import posixpath
+import re
+
+#: The name of the member holding the index.
+INDEX_NAME = "superzippy-index.json"
+
+#: The directory whose contents are indexed.
+SITE_PACKAGES = "site-packages/"
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def get_module_location(name):
+    """
+    Returns ``(module location, is package)`` for the member ``name``
+    (relative to site-packages), or ``None`` if it isn't a module's source
+    or bytecode.
+
+    >>> get_module_location("foo/bar.py")
+    ('foo/bar', False)
+    >>> get_module_location("foo/__init__.pyc")
+    ('foo', True)
+    >>> get_module_location("foo-1.0.dist-info/foo.py")
+    ('foo-1.0.dist-info/foo', False)
+    >>> get_module_location("foo/bar-baz.py") is None
+    True
+
+    """
+
+    base, extension = posixpath.splitext(name)
+    if extension not in (".py", ".pyc"):
+        return None
+
+    parts = base.split("/")
+    is_package = parts[-1] == "__init__"
+    if is_package:
+        parts.pop()
+
+    if not parts or not _IDENTIFIER_RE.match(parts[-1]):
+        return None
+
+    return "/".join(parts), is_package
+
+def create_index(members):
+    """
+    Creates the index of the archive whose members are described by
+    ``members`` (see :func:`superzippy.zipdir.zip_manifest`).
+
+    :returns: ``(INDEX_NAME, the index as bytes)``
+
+    """
+
+    index_members = {}
+    modules = {}
+    directories = set()
+
+    for name, info in members.items():
+        if not name.startswith(SITE_PACKAGES):
+            continue
+
+        name = name[len(SITE_PACKAGES):]
+        index_members[name] = list(info)
+
+        parts = name.split("/")
+        for i in range(1, len(parts)):
+            directories.add("/".join(parts[:i]))
+
+        module = get_module_location(name)
+        if module is None:
+            continue
+
+        location, is_package = module
+        entry = modules.get(location)
+
+        # A package wins over a module with the same name, just like when
+        # importing from a directory.
+        if entry is None or (is_package and not entry[0]):
+            entry = modules[location] = [is_package, None, None]
+        elif entry[0] and not is_package:
+            continue
+
+        entry[1 if name.endswith(".py") else 2] = name
+
+    index = {
+        "members": index_members,
+        "modules": modules,
+        "directories": sorted(directories)
+    }
+
+    return INDEX_NAME, json.dumps(index, sort_keys = True,
+        separators = (",", ":")).encode("utf-8")
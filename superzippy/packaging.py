@@ -27,30 +27,40 @@ import logging
 import sys
 import tempfile
 import os
+import hashlib
+import json
 import pkg_resources
 import shutil
 import shlex
-import errno
+import multiprocessing
 import re
+import zipfile
 
 # internal
 from . import  zipdir
+from . import cache
+from . import installer
+from . import venvpool
+from . import wheels
+from . import bytecode
+from . import compression
+from . import treeshake
+from . import metrics
+from . import manifest
+from . import buildcache
+from . import lockfile
+from . import moduleindex
+from . import pthfiles
+from .bootstrapper import extractcache
+
+def get_option_parser():
+    """
+    Returns the parser for the ``superzippy`` command's arguments. The
+    destination of each option is the name it has in the options that the
+    rest of this module (and :class:`superzippy.Builder`) expects.
+
+    """
 
-DEVNULL = open(os.devnull, "w")
-
-_dirty_files = []
-def destroy_dirty_files():
-    global _dirty_files
-
-    log = logging.getLogger("superzippy")
-
-    for i in _dirty_files:
-        log.debug("Deleting %s.", i)
-        shutil.rmtree(i)
-
-    _dirty_files = []
-
-def parse_arguments(args = sys.argv[1:]):
     option_list = [
         make_option(
             "-v", "--verbose", action = "count", default=0,
@@ -69,8 +79,9 @@ def parse_arguments(args = sys.argv[1:]):
         make_option(
             "-o", "--output", action = "store", default = None,
             help =
-                "The name of the output file. Defaults to the name of the "
-                "last package specified on the command line."
+                "The name of the output file, or - to write the executable "
+                "to standard output. Defaults to the name of the last "
+                "package specified on the command line."
         ),
         make_option(
             "-r", "--requirements", action = "append", default = [],
@@ -78,6 +89,16 @@ def parse_arguments(args = sys.argv[1:]):
                 "A path to a requirements.txt file to parse and install from. "
                 "This option may be specified multiple times."
         ),
+        make_option(
+            "--lock", action = "store", default = None, metavar = "FILE",
+            help =
+                "A lock file written by superzippy lock. Exactly the "
+                "packages it lists are installed, without resolving any "
+                "dependencies, and then any local packages are installed "
+                "without their dependencies. Every other package must be "
+                "in the lock file, and requirements files are ignored "
+                "(they should have been given to superzippy lock)."
+        ),
         make_option(
             "-c", "--raw-copy", action = "append", default = [],
             dest = "raw_copy",
@@ -88,17 +109,189 @@ def parse_arguments(args = sys.argv[1:]):
         ),
         make_option(
             "--raw-copy-rename", action = "append", default = [],
-            dest = "raw_copy_rename",
+            dest = "raw_copy_rename", nargs = 2, metavar = "PATH NAME",
             help =
                 "Takes 2 arguments, first a path to a file or directory to "
                 "copy into the zuper zip directly, and second the name that "
                 "file should have (this name will be importable from within "
                 "the executable."
+        ),
+        make_option(
+            "-p", "--python", action = "store", default = sys.executable,
+            help =
+                "The Python interpreter to create the virtual environment "
+                "with. Defaults to the interpreter running superzippy."
+        ),
+        make_option(
+            "--cache-dir", action = "store", dest = "cache_dir",
+            default = cache.get_default_cache_dir(),
+            help =
+                "The directory to cache installed packages in. Defaults to "
+                "%default."
+        ),
+        make_option(
+            "--cache-size", action = "store", type = "int",
+            dest = "cache_size", default = cache.DEFAULT_MAX_SIZE // 2 ** 20,
+            help =
+                "The maximum size of the install cache in megabytes. The "
+                "least recently used entries are deleted once the cache grows "
+                "larger than this. Defaults to %default."
+        ),
+        make_option(
+            "--build-cache-size", action = "store", type = "int",
+            default = buildcache.DEFAULT_MAX_SIZE // 2 ** 20,
+            help =
+                "The maximum size of the build cache, which holds finished "
+                "executables so that building exactly the same thing again "
+                "just copies the earlier result, in megabytes. Defaults to "
+                "%default."
+        ),
+        make_option(
+            "--no-cache", action = "store_false", dest = "use_cache",
+            default = True,
+            help =
+                "Do not use the install cache or the build cache. Packages "
+                "will always be installed from scratch."
+        ),
+        make_option(
+            "-j", "--jobs", action = "store", type = "int",
+            default = multiprocessing.cpu_count(),
+            help =
+                "The number of packages to download and build concurrently, "
+                "and the number of files to compress at once. Defaults to "
+                "the number of CPUs (%default)."
+        ),
+        make_option(
+            "--no-batch-install", action = "store_false",
+            dest = "batch_install", default = True,
+            help =
+                "Run pip once for every package rather than installing all "
+                "of the packages with a single pip invocation."
+        ),
+        make_option(
+            "--no-venv-pool", action = "store_false", dest = "use_venv_pool",
+            default = True,
+            help =
+                "Always create a new virtual environment with virtualenv "
+                "rather than cloning a template kept in the cache directory."
+        ),
+        make_option(
+            "-w", "--wheel-dir", action = "store", dest = "wheel_dir",
+            default = None,
+            help =
+                "A directory of wheels to install packages from. If every "
+                "package is pinned to an exact version and it and its "
+                "dependencies are available as pure-Python wheels in this "
+                "directory, the wheels are unpacked directly without "
+                "creating a virtual environment or running pip. Otherwise "
+                "the directory is given to pip with --find-links."
+        ),
+        make_option(
+            "--no-compile", action = "store_false", dest = "compile",
+            default = True,
+            help =
+                "Do not compile modules to bytecode ahead of time. Modules "
+                "will be compiled from source every time they're imported."
+        ),
+        make_option(
+            "-O", "--optimize", action = "count", default = 0,
+            help =
+                "Compile bytecode as if by python -O. May be specified twice "
+                "to compile as if by python -OO (which removes docstrings)."
+        ),
+        make_option(
+            "--no-source", action = "store_false", dest = "include_source",
+            default = True,
+            help =
+                "Leave the source of any module that compiled successfully "
+                "out of the executable. Tracebacks won't be able to show "
+                "the offending lines, and the executable will only work with "
+                "the version of Python it was built with."
+        ),
+        make_option(
+            "--compress", action = "append", default = [],
+            dest = "compression_rules", metavar = "RULE",
+            help =
+                "A rule of the form CONDITIONS=METHOD deciding how matching "
+                "files are compressed. CONDITIONS is a space separated list "
+                "of globs matched against names in the executable (ex: "
+                "*.png or site-packages/foo/*) and size limits (ex: >1M or "
+                "<64K). METHOD is store, deflate, or deflate-N where N is a "
+                "level from 0 to 9. The first matching rule wins. This "
+                "option may be specified multiple times."
+        ),
+        make_option(
+            "--no-default-compression-rules", action = "store_false",
+            dest = "default_compression_rules", default = True,
+            help =
+                "Don't add the built-in rules that store already compressed "
+                "files (images, archives, and shared libraries) after any "
+                "rules given with --compress."
+        ),
+        make_option(
+            "--incremental", action = "store_true", default = False,
+            help =
+                "If the output file already exists, copy the compressed "
+                "data of every file that hasn't changed from it rather than "
+                "compressing everything again. A file is copied if its name, "
+                "size, and SHA-1 digest match those recorded in the old "
+                "file's superzippy-archive.json and both were built with the "
+                "same compression rules. Modification times aren't compared "
+                "since files regenerated on every build (ex: bytecode) would "
+                "never match."
+        ),
+        make_option(
+            "--metrics-file", action = "store", default = None,
+            metavar = "FILE",
+            help =
+                "Write how long each phase of the build took (wall and CPU "
+                "time), how many bytes it read and wrote, and how many files "
+                "it produced to FILE as JSON."
+        ),
+        make_option(
+            "--tree-shake", action = "store_true", default = False,
+            help =
+                "Leave out any modules in site-packages that the entry "
+                "point's module can't import. Imports are found by reading "
+                "each module's source, so modules imported dynamically (ex: "
+                "plugins) must be named with --keep."
+        ),
+        make_option(
+            "--keep", action = "append", default = [], metavar = "MODULE",
+            help =
+                "A module or package that --tree-shake must not leave out, "
+                "along with everything it imports. May be a comma separated "
+                "list and may be specified multiple times."
+        ),
+        make_option(
+            "--lazy-import", action = "append", default = [],
+            dest = "lazy_import", metavar = "MODULE",
+            help =
+                "A module or package whose code shouldn't run until it's "
+                "first used (when one of its attributes is looked up) "
+                "rather than when it's imported. Set "
+                "SUPERZIPPY_LAZY_IMPORT_REPORT when running the executable "
+                "to see which were used. May be a comma separated list and "
+                "may be specified multiple times."
+        ),
+        make_option(
+            "--extract", action = "append", default = [], metavar = "MODULE",
+            help =
+                "A top-level package or module in site-packages to extract "
+                "into a cache directory (within $XDG_CACHE_HOME/superzippy) "
+                "the first time the executable runs, and import from there "
+                "rather than from the executable. For packages that need "
+                "their files to be real files (ex: ones that use "
+                "pkg_resources.resource_filename()). May be a comma "
+                "separated list and may be specified multiple times."
         )
     ]
 
     parser = OptionParser(
-        usage = "usage: %prog [options] [PACKAGE1 PACKAGE2 ...] [ENTRY POINT]",
+        usage =
+            "usage: %prog [options] [PACKAGE1 PACKAGE2 ...] [ENTRY POINT]\n"
+            "       %prog build-all [options] MANIFEST\n"
+            "       %prog lock [options] [PACKAGE1 PACKAGE2 ...]",
         description =
             "Zips up a package and adds superzippy's super bootstrap logic to "
             "it. ENTRY POINT should be in the format module:function. Just "
@@ -108,198 +301,284 @@ def parse_arguments(args = sys.argv[1:]):
         option_list = option_list
     )
 
+    return parser
+
+def prepare_options(options):
+    """
+    Adds the options that are worked out from the others (or aren't given on
+    the command line) to ``options``.
+
+    :raises superzippy.compression.InvalidRule: If a compression rule is
+            invalid.
+
+    """
+
+    options.compression_policy = compression.CompressionPolicy.parse(
+        options.compression_rules,
+        use_defaults = options.default_compression_rules)
+
+    # The directory that relative paths are relative to (which isn't this
+    # process's working directory when building for a superzippy serve
+    # client) and the MemberCache to use, if any.
+    options.cwd = os.getcwd()
+    options.member_cache = None
+
+def split_module_list(values):
+    """
+    Returns every module named in ``values``, a list of comma separated lists
+    of modules as given to options like ``--keep``.
+
+    >>> split_module_list(["foo, bar", "baz"])
+    ['foo', 'bar', 'baz']
+
+    """
+
+    return [j.strip() for i in values for j in i.split(",") if j.strip()]
+
+def get_extract_key(options, archive_manifest, names, interpreter_tag):
+    """
+    Hashes everything that decides what the top-level packages and modules
+    in ``names`` look like once the executable extracts them (see
+    ``superzippy/bootstrapper/extractcache.py``): their files, and how
+    they'll be compiled.
+
+    :returns: The hash, or ``None`` if a name isn't a top-level package or
+            module in site-packages (the problem will have been logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    members = sorted(i[len("site-packages/"):] for i in archive_manifest
+        if i.startswith("site-packages/"))
+
+    for i in names:
+        if "." in i or not any(extractcache.is_extracted(j, [i])
+                for j in members):
+            log.critical("Can't extract %s, it's not a top-level package or "
+                "module in site-packages.", i)
+            return None
+
+    digest = hashlib.sha1(json.dumps([interpreter_tag, options.compile,
+        options.optimize, options.include_source]).encode("utf-8"))
+    digest.update(pkg_resources.resource_string("superzippy.bootstrapper",
+        "extractcache.py"))
+    for i in members:
+        if extractcache.is_extracted(i, names):
+            digest.update(i.encode("utf-8") + b"\0")
+            digest.update(hashlib.sha1(archive_manifest.read(
+                "site-packages/" + i)).digest())
+
+    return digest.hexdigest()
+
+def parse_arguments(args = sys.argv[1:]):
+    parser = get_option_parser()
+
     options, args = parser.parse_args(args)
 
     if len(args) < 1:
         parser.error("1 or more arguments must be supplied.")
 
+    try:
+        prepare_options(options)
+    except compression.InvalidRule as e:
+        parser.error(str(e))
+
     return (options, args)
 
-def setup_logging(options, args):
-    if options.verbose >= 2:
-        log_level = logging.DEBUG
-    elif options.verbose == 1:
-        log_level = logging.INFO
-    elif options.quiet:
-        log_level = logging.CRITICAL
-    else:
-        log_level = logging.WARN
+def resolve_paths(options, args, cwd):
+    """
+    Makes every path in ``options`` and ``args`` (as returned by
+    :func:`parse_arguments`) that's relative to ``cwd`` absolute, so that
+    the build doesn't depend on the working directory of the process doing
+    it (ex: the daemon's).
 
-    format = "[%(levelname)s] %(message)s"
+    :returns: The new ``args``.
 
-    logging.basicConfig(level = log_level, format = format)
+    """
 
-    logging.getLogger("superzippy").debug("Logging initialized.")
+    resolve = lambda x: os.path.join(cwd, x)
 
-def main(options, args):
-    log = logging.getLogger("superzippy")
+    options.cwd = cwd
 
-    packages = args[0:-1]
-    entry_point = args[-1]
+    if options.output not in (None, "-"):
+        options.output = resolve(options.output)
 
-    # Append any requirements.txt files to the packages list.
-    packages += ["-r %s" % i for i in options.requirements]
+    for i in ("wheel_dir", "metrics_file", "cache_dir", "lock"):
+        if getattr(options, i) is not None:
+            setattr(options, i, resolve(getattr(options, i)))
 
-    # Create the virtualenv directory
-    virtualenv_dir = tempfile.mkdtemp()
-    _dirty_files.append(virtualenv_dir)
+    # Interpreters given by name are looked up on the PATH instead
+    if os.sep in options.python or \
+            (os.altsep and os.altsep in options.python):
+        options.python = resolve(options.python)
 
-    #### Create virtual environment
+    options.requirements = [resolve(i) for i in options.requirements]
+    options.raw_copy = [resolve(i) for i in options.raw_copy]
+    options.raw_copy_rename = [(resolve(path), name)
+        for path, name in options.raw_copy_rename]
 
-    log.debug("Creating virtual environment at %s.", virtualenv_dir)
-    output_target = None if options.verbose >= 3 else DEVNULL
+    packages = []
+    for i in args[:-1]:
+        # Package arguments may contain pip options, so only the parts that
+        # are paths are changed.
+        parts = shlex.split(i)
+        resolved = [resolve(j) if os.path.exists(resolve(j)) else j
+            for j in parts]
+        if resolved != parts:
+            i = " ".join(shlex.quote(j) for j in resolved)
 
-    return_value = subprocess.call(
-        ["virtualenv", virtualenv_dir],
-        stdout = output_target,
-        stderr = subprocess.STDOUT
-    )
+        packages.append(i)
 
-    if return_value != 0:
-        log.critical(
-            "virtualenv returned non-zero exit status (%d).", return_value
-        )
-        return 1
+    return packages + args[-1:]
 
-    ##### Install package and dependencies
+def get_binary_stdout():
+    """
+    Returns a file object that writes bytes to standard output.
 
-    pip_path = os.path.join(virtualenv_dir, "bin", "pip")
+    """
 
-    for i in packages:
-        log.debug("Installing package with `pip install %s`.", i)
+    return getattr(sys.stdout, "buffer", sys.stdout)
 
-        command = [pip_path, "install"] + shlex.split(i)
-        return_value = subprocess.call(
-            command,
-            stdout = output_target,
-            stderr = subprocess.STDOUT
-        )
+def get_log_level(options):
+    if options.verbose >= 2:
+        return logging.DEBUG
+    elif options.verbose == 1:
+        return logging.INFO
+    elif options.quiet:
+        return logging.CRITICAL
+    else:
+        return logging.WARN
 
-        if return_value != 0:
-            log.critical("pip returned non-zero exit status (%d).", return_value)
-            return 1
+#: The format of every log message.
+LOG_FORMAT = "[%(levelname)s] %(message)s"
 
-    if not packages:
-        log.warn("No packages specified.")
+def setup_logging(options, args):
+    log_level = get_log_level(options)
 
-    #### Uninstall extraneous packages (pip and setuptools)
-    return_value = subprocess.call(
-        [pip_path, "uninstall", "--yes", "pip", "setuptools"],
-        stdout = output_target,
-        stderr = subprocess.STDOUT
-    )
+    format = LOG_FORMAT
 
-    if return_value != 0:
-        log.critical("pip returned non-zero exit status (%d).",
-            return_value)
-        return 1
+    logging.basicConfig(level = log_level, format = format)
 
-    #### Move site packages over to build directory
+    logging.getLogger("superzippy").debug("Logging initialized.")
 
-    # TODO: We should look at pip's source code and figure out how it decides
-    # where site-packages is and use the same algorithm.
+def run_pip(options, packages, output_target, build_metrics, cleanup):
+    """
+    Installs ``packages`` into a new virtual environment with pip. See
+    :func:`superzippy.installer.install_packages`.
 
-    build_dir = tempfile.mkdtemp()
-    _dirty_files.append(build_dir)
+    :param cleanup: A list to append functions to call once the build is
+            over to (see :func:`build`).
 
-    site_package_dir = None
-    for root, dirs, files in os.walk(virtualenv_dir):
-        if "site-packages" in dirs:
-            found = os.path.join(root, "site-packages")
+    :returns: The path to the virtual environment's site-packages directory,
+            or ``None`` if something went wrong (the problem will have been
+            logged).
 
-            # We'll only use the first one, but we want to detect them all.
-            if site_package_dir is not None:
-                log.warn(
-                    "Multiple site-packages directories found. `%s` will be "
-                    "used. `%s` was found afterwards.",
-                    site_package_dir,
-                    found
-                )
-            else:
-                site_package_dir = found
+    """
 
-    # A couple .pth files are consistently left over from the previous step,
-    # delete them.
-    extraneous_pth_files = ["easy-install.pth", "setuptools.pth"]
-    for i in extraneous_pth_files:
-        path = os.path.join(site_package_dir, i)
-        if os.path.exists(path):
-            os.remove(path)
+    return installer.install_packages(options, packages,
+        create_virtualenv_dir(options, cleanup), output_target,
+        build_metrics)
 
-    shutil.move(site_package_dir, build_dir)
+def create_virtualenv_dir(options, cleanup):
+    """
+    Creates an empty directory to put a virtual environment in, which is
+    deleted once the build is over.
 
-    #### Perform any necessary raw copies.
-    raw_copies = options.raw_copy_rename
+    :param cleanup: See :func:`build`.
 
-    for i in options.raw_copy:
-        if i[-1] == "/":
-            i = i[0:-1]
+    """
 
-        raw_copies.append((i, os.path.basename(i)))
+    # Cloning a template is cheapest when the clone can hardlink to it,
+    # which requires the clone to be on the same device.
+    if options.use_venv_pool:
+        scratch = cache.ScratchDirectory(
+            venvpool.VirtualenvPool(options.cache_dir).scratch_dir)
+        cleanup.append(scratch.release)
+        return scratch.path
 
-    for file_path, dest_name in raw_copies:
-        log.debug(
-            "Performing raw copy of `%s`, destination name: `%s`.",
-            file_path,
-            dest_name
-        )
+    virtualenv_dir = tempfile.mkdtemp()
+    cleanup.append(lambda: shutil.rmtree(virtualenv_dir))
+    return virtualenv_dir
 
-        dest = os.path.join(build_dir, "site-packages", dest_name)
+def install_site_packages(options, packages, interpreter_tag,
+        output_target, build_metrics, cleanup):
+    """
+    Installs ``packages``, either by finding them in the install cache or by
+    installing them with pip (in which case they're added to the cache).
+    The cache entry is kept from being evicted until the build is over.
 
-        try:
-            shutil.copytree(file_path, dest)
-        except OSError as e:
-            if e.errno == errno.ENOTDIR:
-                shutil.copy(file_path, dest)
-            else:
-                raise
+    :returns: The path to a site-packages directory containing the packages,
+            which must not be modified, or ``None`` if something went wrong
+            (the problem will have been logged).
 
-    ##### Install bootstrapper
+    """
 
-    log.debug("Adding bootstrapper to the archive.")
+    log = logging.getLogger("superzippy")
 
-    bootstrap_files = {
-        "__init__.py": "__init__.py",
-        "bootstrapper.py": "__main__.py",
-        "zipsite.py": "zipsite.py",
-        "module_locator.py": "module_locator.py"
-    }
+    if not options.use_cache:
+        return run_pip(options, packages, output_target, build_metrics,
+            cleanup)
 
-    for k, v in bootstrap_files.items():
-        source = pkg_resources.resource_stream("superzippy.bootstrapper", k)
-        dest = open(os.path.join(build_dir, v), "wb")
+    install_cache = cache.InstallCache(
+        options.cache_dir, options.cache_size * 2 ** 20)
+    install_key = cache.get_install_key(packages, interpreter_tag)
 
-        shutil.copyfileobj(source, dest)
+    use_lock = install_cache.use(install_key)
+    use_lock.acquire()
+    cleanup.append(use_lock.release)
 
-        source.close()
-        dest.close()
+    # Concurrent builds of the same packages (ex: with build-all, or other
+    # superzippy processes sharing the cache) wait here for whoever got here
+    # first and then use what it added to the cache.
+    with install_cache.lock(install_key):
+        site_package_dir = install_cache.lookup(install_key)
+        if site_package_dir is None:
+            site_package_dir = run_pip(options, packages, output_target,
+                build_metrics, cleanup)
+            if site_package_dir is None:
+                return None
 
-    ##### Install configuration
+            log.debug("Adding packages to the install cache.")
+            with build_metrics.phase("install cache store"):
+                install_cache.store(install_key, site_package_dir)
 
-    log.debug("Adding configuration file to archive.")
+            return site_package_dir
 
-    with open(os.path.join(build_dir, "superconfig.py"), "w") as f:
-        f.write("entry_point = '%s'" % entry_point)
+    log.debug("Using cached packages from %s.", site_package_dir)
 
-    ##### Zip everything up into final file
+    return site_package_dir
+
+def get_output_file(options, packages):
+    """
+    Decides where the executable should be written.
+
+    :returns: The path, ``-`` for standard output, or ``None`` if no name
+            could be chosen (the problem will have been logged).
+
+    """
 
-    log.debug("Zipping up %s.", build_dir)
+    log = logging.getLogger("superzippy")
 
     if options.output:
-        output_file = options.output
+        return options.output
     elif packages:
         last_package = shlex.split(packages[-1])[0]
 
         if os.path.isdir(last_package):
             # Figure out the name of the package the user pointed at on their
             # system.
-            setup_program = subprocess.Popen(["/usr/bin/env", "python",
-                os.path.join(last_package, "setup.py"), "--name"],
-                stdout = subprocess.PIPE, stderr = DEVNULL)
-            if setup_program.wait() != 0:
+            with open(os.devnull, "w") as devnull:
+                setup_program = subprocess.Popen(["/usr/bin/env", "python",
+                    os.path.join(last_package, "setup.py"), "--name"],
+                    stdout = subprocess.PIPE, stderr = devnull,
+                    cwd = options.cwd)
+                return_value = setup_program.wait()
+
+            if return_value != 0:
                 log.critical("Could not determine name of package at %s.",
                     last_package)
-                return 1
+                return None
 
             # Grab the output of the setup program
             package_name_raw = setup_program.stdout.read()
@@ -317,7 +596,7 @@ def main(options, args):
             if re.match("[A-Za-z0-9_-]+", package_name) is None:
                 log.critical("Could nto determine name of package. setup.py "
                     "is reporting an illegal name of %s", package_name)
-                return 1
+                return None
 
             output_file = package_name + ".sz"
         else:
@@ -333,10 +612,315 @@ def main(options, args):
 
     else:
         log.critical("No output file or packages specified.")
+        return None
+
+    # Relative to where superzippy was run, which isn't this process's
+    # working directory when building in the daemon.
+    return os.path.join(options.cwd, output_file)
+
+def main(options, args):
+    log = logging.getLogger("superzippy")
+
+    build_metrics = metrics.Metrics()
+    cleanup = []
+
+    return_value = 1
+    try:
+        return_value = build(options, args, build_metrics, cleanup)
+    finally:
+        for i in reversed(cleanup):
+            try:
+                i()
+            except Exception:
+                log.warn("Could not clean up after the build.",
+                    exc_info = sys.exc_info())
+
+        if options.metrics_file:
+            build_metrics.write(options.metrics_file, return_value == 0)
+
+    return return_value
+
+def build(options, args, build_metrics, cleanup):
+    """
+    Does the actual work of :func:`main`, recording each phase in
+    ``build_metrics``.
+
+    :param cleanup: A list that functions to call once the build is over,
+            whether it succeeded or not, are appended to. They're called in
+            reverse order. Everything the build creates or locks is tracked
+            here rather than globally so that concurrent builds don't clean
+            up after each other.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    packages = args[0:-1]
+    entry_point = args[-1]
+
+    # Named after the packages the user gave, before any requirements files
+    # or lock file are added to them.
+    output_file = get_output_file(options, packages)
+    if output_file is None:
         return 1
 
+    interpreter_tag = cache.get_interpreter_tag(options.python)
+
+    lock_file = None
+    if options.lock:
+        try:
+            lock_file, local_packages = lockfile.get_locked_packages(
+                options, packages, interpreter_tag)
+        except (IOError, lockfile.InvalidLockFile) as e:
+            log.critical("Could not use lock file %s: %s", options.lock, e)
+            return 1
+
+        # Each of these is its own pip invocation, and with hashes in the
+        # lock file pip checks every file it installs for the first.
+        packages = ["-r %s --no-deps" % (options.lock, )] + \
+            ["%s --no-deps" % (i, ) for i in local_packages]
+    else:
+        # Append any requirements.txt files to the packages list.
+        packages += ["-r %s" % i for i in options.requirements]
+
+    # Nothing is copied here; the archive is written straight from wherever
+    # its contents already are. This only holds files that have to be
+    # created (ex: bytecode).
+    staging_dir = tempfile.mkdtemp()
+    cleanup.append(lambda: shutil.rmtree(staging_dir))
+
+    archive_manifest = manifest.Manifest()
+
+    if options.verbose < 3:
+        output_target = open(os.devnull, "w")
+        cleanup.append(output_target.close)
+    elif options.output == "-":
+        # Standard output is reserved for the archive
+        output_target = sys.stderr
+    else:
+        output_target = None
+
+    # (path, destination name) for every raw copy
+    raw_copies = list(options.raw_copy_rename)
+
+    for i in options.raw_copy:
+        if i[-1] == "/":
+            i = i[0:-1]
+
+        raw_copies.append((i, os.path.basename(i)))
+
+    #### Look for an identical earlier build
+
+    if options.use_cache:
+        build_cache = buildcache.BuildCache(options.cache_dir,
+            options.build_cache_size * 2 ** 20)
+
+        with build_metrics.phase("build cache lookup") as record:
+            build_inputs = buildcache.get_build_inputs(options, packages,
+                raw_copies, entry_point, interpreter_tag)
+            build_key = buildcache.get_build_key(build_inputs)
+
+            use_lock = build_cache.use(build_key)
+            use_lock.acquire()
+            cleanup.append(use_lock.release)
+
+            cached_archive = build_cache.lookup(build_key)
+            record["hit"] = cached_archive is not None
+
+        if cached_archive is not None:
+            log.info("Using the cached build %s.", build_key)
+            return copy_cached_build(cached_archive, output_file)
+
+        if output_file != "-":
+            previous_inputs = build_cache.find_previous_inputs(output_file)
+            if previous_inputs is None:
+                log.info("Not in the build cache: %s hasn't been built "
+                    "before.", output_file)
+            else:
+                log.info("Not in the build cache: %s.", ", ".join(
+                    buildcache.describe_changes(previous_inputs,
+                        build_inputs)))
+
+    #### Install straight from wheels if possible
+
+    installed = False
+    if options.wheel_dir:
+        site_package_dir = os.path.join(staging_dir, "site-packages")
+        with build_metrics.phase("wheels") as record:
+            # Local packages always need pip
+            if lock_file is not None and len(packages) == 1:
+                installed = wheels.install_wheels(options, [],
+                    interpreter_tag, site_package_dir,
+                    locked = lock_file.packages)
+            else:
+                installed = wheels.install_wheels(options, packages,
+                    interpreter_tag, site_package_dir)
+            if installed:
+                record["files"] = metrics.count_files(site_package_dir)
+
+    if installed:
+        log.debug("Installed packages from wheels in %s.", options.wheel_dir)
+    else:
+        site_package_dir = install_site_packages(options, packages,
+            interpreter_tag, output_target, build_metrics, cleanup)
+        if site_package_dir is None:
+            return 1
+
+    archive_manifest.add_tree("site-packages", site_package_dir)
+
+    #### Perform any necessary raw copies.
+
+    with build_metrics.phase("raw copies") as record:
+        files_before = len(archive_manifest)
+        for file_path, dest_name in raw_copies:
+            log.debug(
+                "Performing raw copy of `%s`, destination name: `%s`.",
+                file_path,
+                dest_name
+            )
+
+            dest = "site-packages/" + dest_name.replace(os.sep, "/")
+
+            if os.path.isdir(file_path):
+                archive_manifest.add_tree(dest, file_path)
+            else:
+                archive_manifest.add_file(dest, file_path)
+
+        record["files"] = len(archive_manifest) - files_before
+
+    ##### Read .pth files
+
+    site_paths, site_imports = pthfiles.evaluate(archive_manifest)
+    log.debug("The .pth files add %d directories to sys.path and have "
+        "%d import lines.", len(site_paths), len(site_imports))
+
+    ##### Remove unreachable modules
+
+    if options.tree_shake:
+        keep = split_module_list(options.keep)
+        with build_metrics.phase("tree shake") as record:
+            files = archive_manifest.get_files("site-packages")
+            removed = treeshake.find_unreachable(files,
+                [entry_point.split(":")[0]], keep,
+                [i[len("site-packages/"):] for i in site_paths
+                    if i.startswith("site-packages/")])
+
+            removed_bytes = 0
+            for i in removed:
+                archive_manifest.remove("site-packages/" + i)
+                removed_bytes += os.path.getsize(files[i])
+
+            record["files"] = len(removed)
+            record["bytes_removed"] = removed_bytes
+
+        log.info("Tree shaking removed %d files (%d bytes).", len(removed),
+            removed_bytes)
+
+    ##### Install bootstrapper
+
+    log.debug("Adding bootstrapper to the archive.")
+
+    bootstrap_files = {
+        "__init__.py": "__init__.py",
+        "bootstrapper.py": "__main__.py",
+        "zipsite.py": "zipsite.py",
+        "zipindex.py": "zipindex.py",
+        "lazyimport.py": "lazyimport.py",
+        "extractcache.py": "extractcache.py",
+        "module_locator.py": "module_locator.py"
+    }
+
+    with build_metrics.phase("bootstrapper") as record:
+        for k, v in bootstrap_files.items():
+            archive_manifest.add_bytes(v, pkg_resources.resource_string(
+                "superzippy.bootstrapper", k))
+
+        ##### Install configuration
+
+        log.debug("Adding configuration file to archive.")
+
+        extract_names = split_module_list(options.extract)
+        extract_key = None
+        if extract_names:
+            extract_key = get_extract_key(options, archive_manifest,
+                extract_names, interpreter_tag)
+            if extract_key is None:
+                return 1
+
+        config = [
+            "entry_point = '%s'" % (entry_point, ),
+            "site_paths = %r" % (site_paths, ),
+            "site_imports = %r" % (site_imports, ),
+            "lazy_imports = %r" % (split_module_list(options.lazy_import), ),
+            "extract_names = %r" % (extract_names, ),
+            "extract_key = %r" % (extract_key, )
+        ]
+        archive_manifest.add_bytes("superconfig.py",
+            "\n".join(config).encode("utf-8"))
+
+        record["files"] = len(bootstrap_files) + 1
+
+    ##### Compile bytecode
+
+    if options.compile:
+        with build_metrics.phase("compile"):
+            bytecode.compile_manifest(options, archive_manifest,
+                os.path.join(staging_dir, "bytecode"), output_target)
+
+    ##### Zip everything up into final file
+
+    log.debug("Zipping up %d files.", len(archive_manifest))
+
+    # The shebang goes in front of the archive so that the file can be
+    # executed directly. Zip readers find the central directory at the back
+    # of the file so the prefix doesn't get in their way.
+    shebang = b"#!/usr/bin/env python\n"
+
+    previous = None
+    if options.incremental and output_file != "-" and \
+            os.path.exists(output_file):
+        try:
+            previous = zipdir.PreviousArchive(output_file,
+                options.compression_policy)
+        except (IOError, zipfile.BadZipfile):
+            log.warn("Could not read %s, compressing everything again.",
+                output_file, exc_info = sys.exc_info())
+        else:
+            if not previous.usable:
+                log.info("%s was compressed differently, compressing "
+                    "everything again.", output_file)
+
     try:
-        zipdir.zip_directory(build_dir, output_file)
+        with build_metrics.phase("zip") as record:
+            record["files"] = len(archive_manifest)
+            if output_file == "-":
+                zipdir.zip_manifest(archive_manifest, get_binary_stdout(),
+                    jobs = options.jobs, prefix = shebang,
+                    policy = options.compression_policy,
+                    member_cache = options.member_cache,
+                    index = moduleindex.create_index)
+            elif previous is not None:
+                try:
+                    replace_file(output_file,
+                        lambda f: zipdir.zip_manifest(archive_manifest, f,
+                            jobs = options.jobs, prefix = shebang,
+                            policy = options.compression_policy,
+                            member_cache = options.member_cache,
+                            previous = previous,
+                            index = moduleindex.create_index))
+                finally:
+                    previous.close()
+
+                record["files_reused"] = previous.reused
+                log.info("Reused %d of %d files from the previous %s.",
+                    previous.reused, len(archive_manifest), output_file)
+            else:
+                replace_file(output_file,
+                    lambda f: zipdir.zip_manifest(archive_manifest, f,
+                        jobs = options.jobs, prefix = shebang,
+                        policy = options.compression_policy,
+                        member_cache = options.member_cache,
+                        index = moduleindex.create_index))
     except IOError:
         log.critical(
             "Could not write to output file at '%s'.",
@@ -345,25 +929,89 @@ def main(options, args):
         )
         return 1
 
-    #### Make that file executable
+    #### Remember the build
+
+    if options.use_cache and output_file != "-":
+        with build_metrics.phase("build cache store"):
+            build_cache.store(build_key, output_file, build_inputs,
+                output_file)
+
+    return 0
+
+def replace_file(path, write):
+    """
+    Calls ``write`` with a file object opened for writing in binary mode,
+    and then replaces the file at ``path`` with what was written and makes
+    it executable.
+
+    Everything is written to a temporary file next to ``path`` which is then
+    renamed, so a copy of the old file that's still running (and reading
+    its archive through a memory map) keeps its own contents rather than
+    seeing them change or get truncated. Nothing is left behind if ``write``
+    fails. Symbolic links are followed, and anything that isn't a regular
+    file (ex: ``/dev/null``) is written to directly.
+
+    """
+
+    path = os.path.realpath(path)
+    if os.path.exists(path) and not os.path.isfile(path):
+        with open(path, "wb") as f:
+            write(f)
+
+        return
+
+    fd, temp_path = tempfile.mkstemp(prefix = ".superzippy-",
+        dir = os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+
+        os.chmod(temp_path, 0o755)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+def copy_cached_build(cached_archive, output_file):
+    """
+    Copies the cached archive at ``cached_archive`` to ``output_file`` (which
+    may be ``-`` for standard output).
 
-    with open(output_file, "rb") as f:
-        data = f.read()
+    :returns: The build's exit status.
 
-    with open(output_file, "wb") as f:
-        f.write(b"#!/usr/bin/env python\n" + data)
+    """
+
+    log = logging.getLogger("superzippy")
 
-    os.chmod(output_file, 0o755)
+    try:
+        if output_file == "-":
+            with open(cached_archive, "rb") as f:
+                shutil.copyfileobj(f, get_binary_stdout())
+        else:
+            with open(cached_archive, "rb") as source:
+                replace_file(output_file,
+                    lambda f: shutil.copyfileobj(source, f))
+    except IOError:
+        log.critical(
+            "Could not write to output file at '%s'.",
+            output_file,
+            exc_info = sys.exc_info()
+        )
+        return 1
 
     return 0
 
 def run():
+    if sys.argv[1:2] == ["build-all"]:
+        # Imported here because the batch module depends on this one
+        from . import batch
+        sys.exit(batch.run(sys.argv[2:]))
+    elif sys.argv[1:2] == ["lock"]:
+        sys.exit(lockfile.run(sys.argv[2:]))
+
     options, args = parse_arguments()
     setup_logging(options, args)
-    try:
-        main(options, args)
-    finally:
-        destroy_dirty_files()
+    sys.exit(main(options, args))
 
 if __name__ == "__main__":
     run()
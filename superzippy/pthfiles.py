@@ -0,0 +1,110 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that evaluates the ``.pth`` files in an archive's site-packages
+directory while building, so that the bootstrapper doesn't have to search
+the archive for them every time it runs.
+
+A ``.pth`` file names directories to add to ``sys.path``, one per line, and
+may have lines starting with ``import`` that are executed instead. The
+directories can all be worked out from the archive's contents, so only the
+``import`` lines are left for the bootstrapper.
+
+"""
+
+# stdlib
+import locale
+import logging
+import posixpath
+
+def _decode(data):
+    """
+    Decodes the contents of a ``.pth`` file like ``site.addpackage()`` does:
+    as UTF-8 (with or without a byte order mark), or in the locale's
+    preferred encoding if that fails.
+
+    :returns: The text, or ``None`` if it can't be decoded either way.
+
+    """
+
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        return data.decode(locale.getpreferredencoding(False))
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+def evaluate(archive_manifest, site_dir = "site-packages"):
+    """
+    Reads every ``.pth`` file directly in ``site_dir`` (in order of their
+    names, like ``site.addsitedir()``) from ``archive_manifest``.
+
+    :returns: ``(paths, imports)``. ``paths`` is a list of the directories
+            (archive names using forward slashes) to add to ``sys.path``, in
+            the order they're named. ``imports`` is a list of ``(.pth file,
+            line number, line)`` tuples for each ``import`` line, in the
+            order they should be executed.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    directories = set([""])
+    for name in archive_manifest:
+        parts = name.split("/")
+        for i in range(1, len(parts)):
+            directories.add("/".join(parts[:i]))
+
+    pth_files = sorted(i for i in archive_manifest
+        if posixpath.dirname(i) == site_dir and i.endswith(".pth"))
+
+    paths = []
+    known = set([site_dir])
+    imports = []
+    for pth_file in pth_files:
+        lines = _decode(archive_manifest.read(pth_file))
+        if lines is None:
+            log.warning("Ignoring %s, it could not be decoded as UTF-8 or %s.",
+                pth_file, locale.getpreferredencoding(False))
+            continue
+
+        for n, line in enumerate(lines.splitlines()):
+            if line.startswith("#") or not line.strip():
+                continue
+
+            if line.startswith(("import ", "import\t")):
+                imports.append((posixpath.basename(pth_file), n + 1, line))
+                continue
+
+            path = posixpath.normpath(posixpath.join(site_dir,
+                line.rstrip()))
+            if path in known:
+                continue
+
+            if path not in directories:
+                log.warning("Ignoring line %d of %s, %s is not a directory in "
+                    "the archive.", n + 1, pth_file, line.rstrip())
+                continue
+
+            known.add(path)
+            paths.append(path)
+
+    return paths, imports
@@ -0,0 +1,167 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for timing things and comparing the timings against stored baselines.
+
+The benchmarks are slow and their results depend on the machine, so they
+only run when the ``SUPERZIPPY_BENCHMARK`` environment variable is set:
+
+``SUPERZIPPY_BENCHMARK=1``
+    Run the benchmarks and fail any that are slower than their baseline by
+    more than the baseline's threshold.
+``SUPERZIPPY_BENCHMARK=update``
+    Run the benchmarks and store the results as the new baselines.
+
+If ``SUPERZIPPY_BENCHMARK_RESULTS`` is set, every result is also written to
+the JSON file it names.
+
+"""
+
+# stdlib
+import json
+import multiprocessing
+import os
+import os.path
+import platform
+import sys
+import time
+
+#: Where the baselines are stored.
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+#: How many times slower than its baseline a benchmark may be, unless the
+#: baseline says otherwise.
+DEFAULT_THRESHOLD = 1.5
+
+#: Differences smaller than this many seconds are never regressions, timings
+#: that small are mostly noise.
+MINIMUM_DIFFERENCE = 0.1
+
+def get_mode():
+    """
+    Returns ``None``, ``"compare"``, or ``"update"`` depending on the
+    ``SUPERZIPPY_BENCHMARK`` environment variable.
+
+    """
+
+    value = os.environ.get("SUPERZIPPY_BENCHMARK", "")
+    if not value or value == "0":
+        return None
+    elif value == "update":
+        return "update"
+    else:
+        return "compare"
+
+def get_machine():
+    """
+    Returns a short description of this machine and interpreter, stored with
+    the baselines so that it's clear where they came from.
+
+    """
+
+    return "%s-%s %s %s (%d CPUs)" % (platform.python_implementation(),
+        platform.python_version(), platform.system(), platform.machine(),
+        multiprocessing.cpu_count())
+
+def measure(func, repeat = 5, setup = None):
+    """
+    Calls ``func`` ``repeat`` times and returns the fastest time in seconds.
+    The fastest time is the one least disturbed by whatever else the machine
+    was doing. If ``setup`` is given it's called (untimed) before each call.
+
+    """
+
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+
+        start_time = time.time()
+        func()
+        elapsed = time.time() - start_time
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+class Baselines(object):
+    """
+    The stored baselines along with the results of this run.
+
+    """
+
+    def __init__(self, path = BASELINES_PATH):
+        self.path = path
+        self.results = {}
+
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except IOError:
+            self.data = {}
+
+        self.data.setdefault("benchmarks", {})
+
+    def check(self, name, seconds):
+        """
+        Records ``seconds`` as the result of benchmark ``name``.
+
+        :returns: ``None`` if the result is acceptable, otherwise a message
+                describing the regression.
+
+        """
+
+        self.results[name] = seconds
+
+        baseline = self.data["benchmarks"].get(name)
+        if baseline is None:
+            sys.stderr.write("No baseline for benchmark %s.\n" % (name, ))
+            return None
+
+        threshold = baseline.get("threshold", DEFAULT_THRESHOLD)
+        limit = max(baseline["seconds"] * threshold,
+            baseline["seconds"] + MINIMUM_DIFFERENCE)
+        if seconds > limit:
+            return ("%s took %.3fs, more than %.1fx its baseline of %.3fs." %
+                (name, seconds, threshold, baseline["seconds"]))
+
+        return None
+
+    def save(self):
+        """
+        Replaces the baselines with the results of this run, keeping any
+        custom thresholds.
+
+        """
+
+        benchmarks = self.data["benchmarks"]
+        for name, seconds in self.results.items():
+            benchmarks.setdefault(name, {})["seconds"] = round(seconds, 4)
+
+        self.data["machine"] = get_machine()
+
+        with open(self.path, "w") as f:
+            json.dump(self.data, f, indent = 4, sort_keys = True)
+            f.write("\n")
+
+    def write_results(self, path):
+        with open(path, "w") as f:
+            json.dump({"machine": get_machine(), "results": self.results}, f,
+                indent = 4, sort_keys = True)
+            f.write("\n")
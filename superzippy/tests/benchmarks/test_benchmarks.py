@@ -0,0 +1,137 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of building Super Zips and starting them up. See the harness
+module for how to run them.
+
+"""
+
+# stdlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# external
+import pytest
+
+# test helpers
+from .. import file_utilities
+from ..acceptance import sample_info
+from . import harness
+
+# internal
+from ... import zipdir
+
+pytestmark = pytest.mark.skipif(harness.get_mode() is None,
+    reason = "Set SUPERZIPPY_BENCHMARK to run the benchmarks.")
+
+#: Synthetic trees to zip, as (file count, file size) pairs.
+TREES = {
+    "small-files": (3000, 1024),
+    "large-files": (4, 2 ** 20),
+    "mixed": (300, 16 * 1024)
+}
+
+#: Samples that are built. The passthrough-options sample only builds with
+#: Python 2.
+SAMPLES = ["simple", "readme"]
+
+baselines = None
+
+def setup_module(module):
+    global baselines
+    baselines = harness.Baselines()
+
+def teardown_module(module):
+    if harness.get_mode() == "update":
+        baselines.save()
+
+    results_path = os.environ.get("SUPERZIPPY_BENCHMARK_RESULTS")
+    if results_path:
+        baselines.write_results(results_path)
+
+def check(name, seconds):
+    sys.stderr.write("%s: %.4fs\n" % (name, seconds))
+
+    problem = baselines.check(name, seconds)
+    if problem is not None and harness.get_mode() == "compare":
+        pytest.fail(problem)
+
+@pytest.mark.parametrize("tree_name", sorted(TREES))
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_zip_directory(tree_name, jobs):
+    file_count, file_size = TREES[tree_name]
+
+    tree = file_utilities.create_test_directory(["tree"] +
+        [("tree/%d.txt" % (i, ), file_size) for i in range(file_count)])
+    output_dir = tempfile.mkdtemp()
+    try:
+        output_path = os.path.join(output_dir, "test.zip")
+
+        seconds = harness.measure(
+            lambda: zipdir.zip_directory(tree, output_path, jobs = jobs))
+
+        check("zip_directory.%s.jobs-%d" % (tree_name, jobs), seconds)
+    finally:
+        shutil.rmtree(tree)
+        shutil.rmtree(output_dir)
+
+def run_superzip(superzip_path, args, cwd):
+    start_time = time.time()
+    subprocess.call([superzip_path] + args, stdout = subprocess.PIPE,
+        cwd = cwd)
+    return time.time() - start_time
+
+@pytest.mark.parametrize("sample", SAMPLES)
+def test_build_and_startup(sample):
+    """
+    Times a build with an empty cache, a build with a warm cache, the first
+    run of the result, and later runs of the result.
+
+    """
+
+    sample_dir = sample_info.get_sample_dir(sample)
+    config = sample_info.get_sample_config(sample)
+    entry_point = config.get_entry_points()[0]
+    args = entry_point.expected_output[0][0]
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        superzip_path = os.path.join(temp_dir, "sample.sz")
+        command = ["superzippy", "-q", "-o", superzip_path, "--cache-dir",
+            os.path.join(temp_dir, "cache")] + entry_point.options + \
+            [sample_dir, entry_point.name]
+
+        def build():
+            assert subprocess.call(command, cwd = sample_dir) == 0
+
+        check("build.%s.cold" % (sample, ), harness.measure(build, repeat = 1))
+        check("build.%s.warm" % (sample, ), harness.measure(build))
+
+        # The first run of a new Super Zip. It isn't a cold start: the file
+        # was just written, so it's still in the page cache. Only what the
+        # Super Zip caches for itself (ex: extracted packages) is empty.
+        check("startup.%s.first" % (sample, ),
+            run_superzip(superzip_path, args, temp_dir))
+        check("startup.%s.warm" % (sample, ), harness.measure(
+            lambda: run_superzip(superzip_path, args, temp_dir)))
+    finally:
+        shutil.rmtree(temp_dir)
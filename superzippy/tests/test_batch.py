@@ -0,0 +1,118 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# external
+import pytest
+
+# internal
+from .. import batch
+
+# stdlib
+import json
+import logging
+import tempfile
+import shutil
+import os
+
+@pytest.fixture
+def manifest_dir(request):
+    path = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(path))
+    return path
+
+def write_manifest(manifest_dir, manifest):
+    path = os.path.join(manifest_dir, "manifest.json")
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+    return path
+
+class TestLoadManifest:
+    def test_defaults(self, manifest_dir):
+        path = write_manifest(manifest_dir, {
+            "defaults": {"options": ["-O"], "requirements": ["a.txt"]},
+            "target": [
+                {"entry_point": "a:main", "output": "dist/a.sz",
+                    "options": ["--no-source"]},
+                {"name": "b", "entry_point": "b:main", "requirements": []}
+            ]
+        })
+
+        a, b = batch.load_manifest(path)
+
+        assert a["name"] == "a.sz"
+        assert a["options"] == ["-O", "--no-source"]
+        assert a["requirements"] == ["a.txt"]
+
+        assert b["name"] == "b"
+        assert b["options"] == ["-O"]
+        assert b["requirements"] == []
+
+    @pytest.mark.parametrize("manifest", [
+        {},
+        {"target": [{"name": "a"}]},
+        {"target": [{"entry_point": "a:main", "bogus": 1}]}
+    ])
+    def test_invalid(self, manifest_dir, manifest):
+        with pytest.raises(batch.InvalidManifest):
+            batch.load_manifest(write_manifest(manifest_dir, manifest))
+
+def test_target_arguments():
+    args = batch.get_target_arguments({
+        "options": ["-O"],
+        "output": "dist/a.sz",
+        "requirements": ["reqs.txt"],
+        "packages": ["pkg", "PyYAML --global-option='--without-libyaml'"],
+        "entry_point": "a:main"
+    })
+
+    assert args == [
+        "-O",
+        "-o", "dist/a.sz",
+        "-r", "reqs.txt",
+        "pkg",
+        "PyYAML --global-option='--without-libyaml'",
+        "a:main"
+    ]
+
+def test_target_logging(manifest_dir, capsys):
+    """
+    Messages logged while building a target should name it.
+
+    """
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    handler.addFilter(batch.TargetFilter())
+
+    log = logging.getLogger("superzippy")
+    log.addHandler(handler)
+    level = log.level
+    log.setLevel(logging.INFO)
+    try:
+        # The arguments are invalid, so the build stops right away
+        name, succeeded, seconds = batch.build_target("a", ["--bogus"],
+            manifest_dir)
+        log.info("Done.")
+    finally:
+        log.setLevel(level)
+        log.removeHandler(handler)
+
+    assert (name, succeeded) == ("a", False)
+    assert [(i.superzippy_target, i.getMessage()) for i in records] == \
+        [("a: ", "Building a."), ("", "Done.")]
@@ -0,0 +1,123 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import buildcache
+from .. import packaging
+
+# stdlib
+import json
+import logging
+import mmap
+import shutil
+import os
+
+def test_describe_changes():
+    old = {"entry point": "a", "package foo": "b", "package bar": "c"}
+    new = {"entry point": "a", "package foo": "x", "package baz": "d"}
+
+    assert sorted(buildcache.describe_changes(old, new)) == [
+        "package bar was removed", "package baz was added",
+        "package foo changed"]
+    assert buildcache.describe_changes(new, new) == []
+
+def test_store_and_lookup():
+    test_dir = file_utilities.create_test_directory([("archive", 100)])
+    try:
+        build_cache = buildcache.BuildCache(os.path.join(test_dir, "cache"))
+        assert build_cache.lookup("abc") is None
+
+        inputs = {"entry point": "a"}
+        output = os.path.join(test_dir, "out.sz")
+        build_cache.store("abc", os.path.join(test_dir, "archive"), inputs,
+            output)
+
+        with open(build_cache.lookup("abc"), "rb") as f:
+            with open(os.path.join(test_dir, "archive"), "rb") as original:
+                assert f.read() == original.read()
+
+        assert build_cache.find_previous_inputs(output) == inputs
+        assert build_cache.find_previous_inputs(
+            os.path.join(test_dir, "other.sz")) is None
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_memoized_build(caplog):
+    """
+    Building the same thing twice should reuse the first build, and changing
+    an input should say what changed.
+
+    """
+
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    try:
+        with open(os.path.join(test_dir, "hello.py"), "w") as f:
+            f.write("def main():\n    print('hello')\n")
+
+        output = os.path.join(test_dir, "hello.sz")
+        metrics_file = os.path.join(test_dir, "metrics.json")
+
+        def build():
+            options, args = packaging.parse_arguments(["-o", output, "-w",
+                os.path.join(test_dir, "wheels"), "-c",
+                os.path.join(test_dir, "hello.py"), "--cache-dir",
+                os.path.join(test_dir, "cache"), "--metrics-file",
+                metrics_file, "hello:main"])
+            assert packaging.main(options, args) == 0
+
+            with open(metrics_file) as f:
+                phases = json.load(f)["phases"]
+            return [i["hit"] for i in phases
+                if i["name"] == "build cache lookup"][0]
+
+        caplog.set_level(logging.INFO, logger = "superzippy")
+
+        assert not build()
+        assert "hasn't been built before" in caplog.text
+
+        os.remove(output)
+        assert build()
+        assert os.path.exists(output)
+
+        # A copy that's still running (with the old file mapped into memory)
+        # must keep its contents while the output is replaced, both by a
+        # cached build and a new one.
+        for expect_hit in (True, False):
+            if not expect_hit:
+                with open(os.path.join(test_dir, "hello.py"), "a") as f:
+                    f.write("\n")
+
+            with open(output, "rb") as f:
+                old_data = f.read()
+                old_map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                assert build() == expect_hit
+                assert old_map[:] == old_data
+            finally:
+                old_map.close()
+
+            assert os.access(output, os.X_OK)
+            assert not [i for i in os.listdir(test_dir)
+                if i.startswith(".superzippy-")]
+
+        assert "raw copy %s changed" % (os.path.join(test_dir, "hello.py"), ) \
+            in caplog.text
+    finally:
+        shutil.rmtree(test_dir)
@@ -0,0 +1,114 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import BuildError, Builder
+
+# stdlib
+import asyncio
+import shutil
+import subprocess
+import threading
+import os
+
+import pytest
+
+def _write_hello(test_dir, name):
+    with open(os.path.join(test_dir, name + ".py"), "w") as f:
+        f.write("def main():\n    print(%r)\n" % (name, ))
+
+def test_concurrent_builds():
+    """
+    Builds running at once in different threads shouldn't interfere with
+    each other.
+
+    """
+
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    try:
+        names = ["hello%d" % (i, ) for i in range(4)]
+        for i in names:
+            _write_hello(test_dir, i)
+
+        builder = Builder(2 ** 20, wheel_dir = "wheels", cache_dir = "cache")
+
+        errors = []
+        def build(name):
+            try:
+                builder.build(name + ".sz", [], name + ":main",
+                    cwd = test_dir, raw_copy = [name + ".py"])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target = build, args = (i, ))
+            for i in names]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+
+        assert errors == []
+        for i in names:
+            output = subprocess.check_output(
+                [os.path.join(test_dir, i + ".sz")])
+            assert output.strip() == i.encode("ascii")
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_build_async():
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    try:
+        _write_hello(test_dir, "hello")
+        builder = Builder(wheel_dir = os.path.join(test_dir, "wheels"),
+            use_cache = False)
+
+        async def build_both():
+            return await asyncio.gather(*[
+                builder.build_async(os.path.join(test_dir, i), [],
+                    "hello:main",
+                    raw_copy = [os.path.join(test_dir, "hello.py")])
+                for i in ("a.sz", "b.sz")])
+
+        outputs = asyncio.run(build_both())
+        assert outputs == [os.path.join(test_dir, "a.sz"),
+            os.path.join(test_dir, "b.sz")]
+        for i in outputs:
+            assert subprocess.check_output([i]).strip() == b"hello"
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_errors():
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    try:
+        _write_hello(test_dir, "hello")
+
+        with pytest.raises(TypeError):
+            Builder(not_an_option = True)
+
+        builder = Builder(wheel_dir = "wheels", use_cache = False)
+        with pytest.raises(TypeError):
+            builder.build("hello.sz", [], "hello:main", jobz = 2)
+
+        with pytest.raises(BuildError) as excinfo:
+            builder.build(os.path.join("missing", "hello.sz"), [],
+                "hello:main", cwd = test_dir, raw_copy = ["hello.py"])
+        assert "Could not write" in str(excinfo.value)
+    finally:
+        shutil.rmtree(test_dir)
@@ -0,0 +1,79 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import bytecode
+from .. import manifest
+from .. import zipdir
+
+# stdlib
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+
+class Options(object):
+    python = sys.executable
+    optimize = 0
+    include_source = False
+
+def test_compiled_archive():
+    """
+    Compiled modules should sit next to their sources without the sources
+    being modified, and should still be importable from a zip file once the
+    sources are removed.
+
+    """
+
+    tree = file_utilities.create_test_directory(
+        ["pkg", "pkg/__pycache__", ("pkg/__pycache__/junk.pyc", 10)])
+    staging_dir = tempfile.mkdtemp()
+    output_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tree, "pkg", "__init__.py"), "w") as f:
+            f.write("VALUE = 'compiled'\n")
+
+        archive_manifest = manifest.Manifest()
+        archive_manifest.add_tree("", tree)
+        archive_manifest.add_bytes("pkg/generated.py", b"VALUE = 'memory'\n")
+        archive_manifest.add_bytes("pkg/broken.py", b"def broken(:\n")
+
+        bytecode.compile_manifest(Options(), archive_manifest, staging_dir,
+            None)
+
+        assert sorted(archive_manifest) == ["pkg/__init__.pyc",
+            "pkg/broken.py", "pkg/generated.pyc"]
+        assert set(file_utilities.get_files(tree)) == set(["pkg",
+            os.path.join("pkg", "__init__.py"),
+            os.path.join("pkg", "__pycache__"),
+            os.path.join("pkg", "__pycache__", "junk.pyc")])
+
+        archive = os.path.join(output_dir, "test.zip")
+        zipdir.zip_manifest(archive_manifest, archive)
+
+        output = subprocess.check_output([sys.executable, "-c",
+            "import sys; sys.path.insert(0, %r); import pkg, pkg.generated; "
+            "sys.stdout.write(pkg.VALUE + pkg.generated.VALUE)" % (archive, )])
+        assert output == b"compiledmemory"
+    finally:
+        shutil.rmtree(tree)
+        shutil.rmtree(staging_dir)
+        shutil.rmtree(output_dir)
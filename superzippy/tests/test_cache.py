@@ -0,0 +1,213 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# external
+import pytest
+
+# internal
+from .. import cache
+
+# stdlib
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+
+@pytest.fixture
+def cache_dir(request):
+    path = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(path))
+    return path
+
+class TestInstallKey:
+    def test_stable(self):
+        key = cache.get_install_key(["clint", "-r foo.txt"], "CPython-2.7.3")
+        assert key == \
+            cache.get_install_key(["clint", "-r foo.txt"], "CPython-2.7.3")
+
+    def test_interpreter(self):
+        assert cache.get_install_key(["clint"], "CPython-2.7.3") != \
+            cache.get_install_key(["clint"], "CPython-3.3.0")
+
+    def test_local_contents(self):
+        """
+        Changing a file inside of a local package should change the key, but
+        build artifacts pip leaves behind should not.
+
+        """
+
+        package_dir = file_utilities.create_test_directory(
+            ["pkg", ("pkg/main.py", 100), ("setup.py", 100)])
+        try:
+            key = cache.get_install_key([package_dir], "CPython-2.7.3")
+
+            os.mkdir(os.path.join(package_dir, "build"))
+            open(os.path.join(package_dir, "build", "junk"), "w").close()
+            assert key == cache.get_install_key([package_dir], "CPython-2.7.3")
+
+            with open(os.path.join(package_dir, "pkg", "main.py"), "a") as f:
+                f.write("print('hi')\n")
+            assert key != cache.get_install_key([package_dir], "CPython-2.7.3")
+        finally:
+            shutil.rmtree(package_dir)
+
+class TestInstallCache:
+    def test_round_trip(self, cache_dir):
+        install_cache = cache.InstallCache(cache_dir)
+        assert install_cache.lookup("abc") is None
+
+        site_packages = file_utilities.create_test_directory(
+            ["foo", ("foo/__init__.py", 10)])
+        try:
+            cached = install_cache.store("abc", site_packages)
+        finally:
+            shutil.rmtree(site_packages)
+
+        assert install_cache.lookup("abc") == cached
+        assert set(file_utilities.get_files(cached)) == \
+            set(["foo", "foo/__init__.py"])
+
+    def test_eviction(self, cache_dir):
+        """
+        The least recently used entry should be evicted once the cache grows
+        too large.
+
+        """
+
+        install_cache = cache.InstallCache(cache_dir, max_size = 2500)
+
+        site_packages = file_utilities.create_test_directory(
+            [("big.py", 1000)])
+        try:
+            install_cache.store("first", site_packages)
+            install_cache.store("second", site_packages)
+
+            # Make sure first is older than second, then use it so that it
+            # becomes the most recently used.
+            old_time = os.path.getmtime(install_cache._entry_path("second"))
+            os.utime(install_cache._entry_path("second"),
+                (old_time - 100, old_time - 100))
+            install_cache.lookup("first")
+
+            install_cache.store("third", site_packages)
+        finally:
+            shutil.rmtree(site_packages)
+
+        assert install_cache.lookup("first") is not None
+        assert install_cache.lookup("second") is None
+        assert install_cache.lookup("third") is not None
+
+    def test_in_use(self, cache_dir):
+        """
+        Entries in use must survive eviction.
+
+        """
+
+        install_cache = cache.InstallCache(cache_dir, max_size = 1500)
+
+        site_packages = file_utilities.create_test_directory(
+            [("big.py", 1000)])
+        try:
+            install_cache.store("first", site_packages)
+            with install_cache.use("first"):
+                install_cache.store("second", site_packages)
+                assert install_cache.lookup("first") is not None
+
+            install_cache.store("third", site_packages)
+        finally:
+            shutil.rmtree(site_packages)
+
+        assert install_cache.lookup("first") is None
+        assert install_cache.lookup("third") is not None
+        assert not [i for i in os.listdir(install_cache.path)
+            if i.startswith(cache.SCRATCH_PREFIX)]
+
+    def test_concurrent_processes(self, cache_dir):
+        """
+        Several processes that need the same entry should create it once.
+
+        """
+
+        script = (
+            "import sys, os\n"
+            "from superzippy import cache\n"
+            "cache_dir, log = sys.argv[1:]\n"
+            "install_cache = cache.InstallCache(cache_dir)\n"
+            "with install_cache.use('key'):\n"
+            "    with install_cache.lock('key'):\n"
+            "        if install_cache.lookup('key') is None:\n"
+            "            with open(log, 'a') as f:\n"
+            "                f.write('installed\\n')\n"
+            "            site_packages = os.path.join(cache_dir, 'tree')\n"
+            "            os.mkdir(site_packages)\n"
+            "            install_cache.store('key', site_packages)\n"
+        )
+
+        log = os.path.join(cache_dir, "log")
+        processes = [subprocess.Popen([sys.executable, "-c", script,
+            cache_dir, log]) for i in range(4)]
+        assert [i.wait() for i in processes] == [0] * 4
+
+        with open(log) as f:
+            assert f.read() == "installed\n"
+
+class TestScratchDirectory:
+    def test_clean_scratch(self, cache_dir):
+        """
+        Scratch directories should only be cleaned up once their owners are
+        gone.
+
+        """
+
+        scratch = cache.ScratchDirectory(cache_dir)
+        assert os.path.isdir(scratch.path)
+
+        # A process that dies without releasing its scratch directory
+        subprocess.check_call([sys.executable, "-c",
+            "import sys, os; from superzippy import cache; "
+            "scratch = cache.ScratchDirectory(sys.argv[1]); "
+            "open(os.path.join(scratch.path, 'junk'), 'w').close(); "
+            "os._exit(0)", cache_dir])
+        assert len(os.listdir(cache_dir)) == 4
+
+        cache.clean_scratch(cache_dir)
+        assert sorted(os.listdir(cache_dir)) == sorted([
+            os.path.basename(scratch.path),
+            os.path.basename(scratch.path) + ".lock"])
+
+        scratch.release()
+        assert os.listdir(cache_dir) == []
+
+    def test_file_lock(self, cache_dir):
+        path = os.path.join(cache_dir, "lock")
+
+        with cache.FileLock(path):
+            assert not cache.FileLock(path).acquire(blocking = False)
+            assert not cache.FileLock(path, shared = True).acquire(
+                blocking = False)
+
+        shared = cache.FileLock(path, shared = True)
+        with shared:
+            other = cache.FileLock(path, shared = True)
+            assert other.acquire(blocking = False)
+            other.release()
+
+            assert not cache.FileLock(path).acquire(blocking = False)
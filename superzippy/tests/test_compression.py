@@ -0,0 +1,66 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# external
+import pytest
+
+# internal
+from .. import compression
+
+# stdlib
+import zipfile
+
+STORED = (zipfile.ZIP_STORED, None)
+DEFLATED = (zipfile.ZIP_DEFLATED, None)
+
+class TestCompressionPolicy:
+    cases = [
+        # Default rules
+        ([], "site-packages/foo/logo.png", 10, STORED),
+        ([], "site-packages/foo/_speedups.so", 10, STORED),
+        ([], "site-packages/foo/__init__.py", 10, DEFLATED),
+
+        # Globs with a slash match the whole name, others the base name
+        (["site-packages/foo/*=store"], "site-packages/foo/a.pyc", 10,
+            STORED),
+        (["site-packages/foo/*=store"], "site-packages/bar/a.pyc", 10,
+            DEFLATED),
+        (["*.pyc=deflate-1"], "site-packages/bar/a.pyc", 10,
+            (zipfile.ZIP_DEFLATED, 1)),
+
+        # Size limits
+        ([">1K=deflate-9"], "data.json", 1024, DEFLATED),
+        ([">1K=deflate-9"], "data.json", 1025, (zipfile.ZIP_DEFLATED, 9)),
+        (["<64=store"], "tiny.py", 63, STORED),
+        (["<64=store"], "tiny.py", 64, DEFLATED),
+        (["*.json >1K=store"], "small.json", 10, DEFLATED),
+        (["*.json >1K=store"], "big.json", 2048, STORED),
+
+        # User rules come before the defaults
+        (["*.png=deflate"], "logo.png", 10, DEFLATED)
+    ]
+
+    @pytest.mark.parametrize(("rules", "name", "size", "expected"), cases)
+    def test_choose(self, rules, name, size, expected):
+        policy = compression.CompressionPolicy.parse(rules)
+        assert policy.choose(name, size) == expected
+
+    @pytest.mark.parametrize("rule", ["*.png", "*.png=zip", ">1Q=store",
+        "*.png=deflate-10"])
+    def test_invalid(self, rule):
+        with pytest.raises(compression.InvalidRule):
+            compression.Rule.parse(rule)
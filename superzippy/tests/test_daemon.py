@@ -0,0 +1,178 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import buildcontext
+from .. import client
+from .. import daemon
+from .. import packaging
+from .. import zipdir
+
+# stdlib
+from contextlib import closing
+import io
+import logging
+import shutil
+import subprocess
+import tempfile
+import threading
+import zipfile
+import os
+
+def test_resolve_paths():
+    test_dir = file_utilities.create_test_directory(["pkg", ("req.txt", 10)])
+    try:
+        options, args = packaging.parse_arguments(["-o", "out.sz",
+            "-r", "req.txt", "-c", "pkg", "--wheel-dir", "/wheels",
+            "--raw-copy-rename", "pkg", "renamed", "--lock", "x.lock",
+            "--metrics-file", "metrics.json", "--cache-dir", "cache",
+            "--python", "venv/bin/python",
+            "pkg", "pkg --no-deps", "six --no-deps", "pkg:main"])
+        args = packaging.resolve_paths(options, args, test_dir)
+
+        resolved = lambda x: os.path.join(test_dir, x)
+        assert options.cwd == test_dir
+        assert options.output == resolved("out.sz")
+        assert options.requirements == [resolved("req.txt")]
+        assert options.raw_copy == [resolved("pkg")]
+        assert options.raw_copy_rename == [(resolved("pkg"), "renamed")]
+        assert options.lock == resolved("x.lock")
+        assert options.metrics_file == resolved("metrics.json")
+        assert options.cache_dir == resolved("cache")
+        assert options.python == resolved("venv/bin/python")
+        assert options.wheel_dir == "/wheels"
+        assert args == [os.path.join(test_dir, "pkg"),
+            os.path.join(test_dir, "pkg") + " --no-deps", "six --no-deps",
+            "pkg:main"]
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_build_log_handler():
+    """
+    A build's messages should reach its client even when they're logged by
+    the build's worker threads, and no other build's messages should.
+
+    """
+
+    log = logging.getLogger("superzippy")
+    sent = []
+
+    def log_in_other_build():
+        with buildcontext.build_context():
+            log.error("other")
+
+    with buildcontext.build_context() as build:
+        handler = daemon._BuildLogHandler(sent.append, logging.INFO, build)
+        log.addHandler(handler)
+        try:
+            log.error("main")
+
+            pool = buildcontext.ThreadPool(2)
+            try:
+                pool.map(log.error, ["worker"] * 4)
+            finally:
+                pool.close()
+                pool.join()
+
+            thread = threading.Thread(target = log_in_other_build)
+            thread.start()
+            thread.join()
+        finally:
+            log.removeHandler(handler)
+
+    assert [i["log"].split()[-1] for i in sent] == ["main"] + ["worker"] * 4
+
+def test_output_file_from_client_directory():
+    """
+    When no output file is given, it should be named and placed relative to
+    the client's directory rather than the daemon's.
+
+    """
+
+    test_dir = file_utilities.create_test_directory(["pkg"])
+    try:
+        with open(os.path.join(test_dir, "pkg", "setup.py"), "w") as f:
+            f.write("print('named')\n")
+
+        for package, expected in [("pkg", "named.sz"),
+                ("six==1.0", "six.sz")]:
+            options, args = packaging.parse_arguments([package, "pkg:main"])
+            args = packaging.resolve_paths(options, args, test_dir)
+
+            assert os.getcwd() != test_dir
+            assert packaging.get_output_file(options, args[:-1]) == \
+                os.path.join(test_dir, expected)
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_build_server():
+    """
+    Builds done through the daemon should work from the client's directory,
+    send their log messages to the client, and defer to the client when they
+    can't be done by the daemon.
+
+    """
+
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    socket_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(test_dir, "hello.py"), "w") as f:
+            f.write("def main():\n    print('hello')\n")
+
+        path = os.path.join(socket_dir, "daemon.sock")
+        server = daemon.BuildServer(path, 2, zipdir.MemberCache(2 ** 20))
+        thread = threading.Thread(target = server.serve_forever)
+        thread.start()
+        try:
+            assert daemon.is_listening(path)
+
+            os.chdir(test_dir)
+            output = io.StringIO()
+            assert client.build_with_daemon(["-o", "hello.sz", "-w",
+                "wheels", "-c", "hello.py", "--cache-dir", "cache",
+                "hello:main"], path, output) == 0
+
+            executable = os.path.join(test_dir, "hello.sz")
+            assert subprocess.check_output([executable]).strip() == b"hello"
+            with closing(zipfile.ZipFile(executable)) as f:
+                assert "site-packages/hello.py" in f.namelist()
+
+            output = io.StringIO()
+            assert client.build_with_daemon(["-w", "wheels", "hello:main"],
+                path, output) == 1
+            assert "No output file or packages specified." in \
+                output.getvalue()
+
+            assert client.build_with_daemon(["-o", "-", "-w", "wheels",
+                "hello:main"], path, output) is None
+            assert client.build_with_daemon(["--not-an-option"], path,
+                output) is None
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        assert not daemon.is_listening(path)
+        assert client.build_with_daemon(["hello:main"], path) is None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(test_dir)
+        shutil.rmtree(socket_dir)
@@ -0,0 +1,141 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# external
+import pytest
+
+# internal
+from .. import manifest
+from .. import packaging
+from ..bootstrapper import extractcache
+
+# stdlib
+from contextlib import closing
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+@pytest.fixture
+def test_dir(request, monkeypatch):
+    path = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(path))
+    monkeypatch.setenv("XDG_CACHE_HOME", os.path.join(path, "cache"))
+
+    return path
+
+def make_archive(test_dir):
+    path = os.path.join(test_dir, "archive.sz")
+    with closing(zipfile.ZipFile(path, "w")) as f:
+        f.writestr("__main__.py", "")
+        f.writestr("site-packages/foo/__init__.py", "")
+        f.writestr("site-packages/foo/__init__.pyc", "bytecode")
+        f.writestr("site-packages/foo/data/x.txt", "x")
+        f.writestr("site-packages/bar.pyc", "bytecode")
+        f.writestr("site-packages/foobar.py", "")
+        f.writestr("site-packages/baz.cpython-311-x86_64-linux-gnu.so", "")
+        f.writestr("site-packages/baz.pyd", "")
+        f.writestr("site-packages/bazbaz.so", "")
+        f.writestr("site-packages/baz.txt", "")
+
+    return path
+
+def test_extract(test_dir):
+    archive = make_archive(test_dir)
+
+    directory = extractcache.extract(archive, ["foo", "bar", "baz"], "abc")
+    assert directory == os.path.join(extractcache.get_cache_dir(), "abc")
+
+    extracted = []
+    for root, dirs, files in os.walk(directory):
+        extracted += [os.path.relpath(os.path.join(root, i), directory)
+            for i in files]
+
+    # Bytecode with source goes where the regular import system finds it
+    assert sorted(extracted) == sorted([
+        os.path.join("foo", "__init__.py"),
+        os.path.relpath(importlib.util.cache_from_source(
+            os.path.join(directory, "foo", "__init__.py")), directory),
+        os.path.join("foo", "data", "x.txt"),
+        "bar.pyc",
+        "baz.cpython-311-x86_64-linux-gnu.so",
+        "baz.pyd"
+    ])
+
+    # Already extracted, so the archive isn't needed
+    os.remove(archive)
+    assert extractcache.extract(archive, ["foo", "bar", "baz"], "abc") == \
+        directory
+    assert extractcache.extract(archive, ["foo", "bar", "baz"], "def") is None
+    assert os.listdir(extractcache.get_cache_dir()) == ["abc"]
+
+def test_extract_race(test_dir, monkeypatch):
+    archive = make_archive(test_dir)
+    directory = os.path.join(extractcache.get_cache_dir(), "abc")
+
+    # Somebody else finishes extracting while this process is
+    extract_members = extractcache.extract_members
+    def racing_extract_members(archive_path, names, temporary):
+        extract_members(archive_path, names, directory)
+        extract_members(archive_path, names, temporary)
+    monkeypatch.setattr(extractcache, "extract_members",
+        racing_extract_members)
+
+    assert extractcache.extract(archive, ["foo"], "abc") == directory
+    assert os.listdir(extractcache.get_cache_dir()) == ["abc"]
+
+def test_remove_stale(test_dir):
+    cache_dir = os.path.join(test_dir, "extracted")
+    now = time.time()
+    for name, age in [("fresh", 0), ("kept", extractcache.MAX_AGE * 2),
+            ("stale", extractcache.MAX_AGE * 2), (".tmp-new", 0),
+            (".tmp-old", extractcache.TEMPORARY_MAX_AGE * 2)]:
+        os.makedirs(os.path.join(cache_dir, name, "foo"))
+        os.utime(os.path.join(cache_dir, name), (now - age, now - age))
+
+    extractcache.remove_stale(cache_dir, keep = "kept", now = now)
+    assert sorted(os.listdir(cache_dir)) == [".tmp-new", "fresh", "kept"]
+
+def test_get_extract_key(test_dir):
+    class Options(object):
+        compile = True
+        optimize = 0
+        include_source = True
+
+    archive_manifest = manifest.Manifest()
+    archive_manifest.add_bytes("site-packages/foo/__init__.py", b"")
+    archive_manifest.add_bytes("site-packages/bar.py", b"")
+
+    key = packaging.get_extract_key(Options, archive_manifest, ["foo"],
+        "CPython-3.11.7-linux")
+    assert key is not None
+    assert packaging.get_extract_key(Options, archive_manifest, ["foo"],
+        "CPython-3.12.0-linux") != key
+
+    archive_manifest.add_bytes("site-packages/bar.py", b"changed")
+    assert packaging.get_extract_key(Options, archive_manifest, ["foo"],
+        "CPython-3.11.7-linux") == key
+
+    archive_manifest.add_bytes("site-packages/foo/__init__.py", b"changed")
+    assert packaging.get_extract_key(Options, archive_manifest, ["foo"],
+        "CPython-3.11.7-linux") != key
+
+    for i in ("missing", "foo.bar"):
+        assert packaging.get_extract_key(Options, archive_manifest, [i],
+            "CPython-3.11.7-linux") is None
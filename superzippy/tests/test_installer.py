@@ -0,0 +1,53 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# external
+import pytest
+
+# internal
+from .. import installer
+
+class TestGroupPackageArguments:
+    cases = [
+        (["a", "b"], [["a", "b"]]),
+        (["a", "-r b.txt", "-e ./c"], [["a", "-r", "b.txt", "-e", "./c"]]),
+        (
+            ["a", "PyYAML --global-option='--without-libyaml'", "b", "c"],
+            [
+                ["a"],
+                ["PyYAML", "--global-option=--without-libyaml"],
+                ["b", "c"]
+            ]
+        ),
+        (
+            ["PyYAML --global-option='--without-libyaml'", "."],
+            [["PyYAML", "--global-option=--without-libyaml"], ["."]]
+        )
+    ]
+
+    @pytest.mark.parametrize(("packages", "expected"), cases)
+    def test_grouping(self, packages, expected):
+        assert installer.group_package_arguments(packages) == expected
+
+    def test_no_batch(self):
+        assert installer.group_package_arguments(["a", "-r b.txt"],
+            batch = False) == [["a"], ["-r", "b.txt"]]
+
+class TestSplitBatch:
+    def test_split(self):
+        assert installer.split_batch(["a", "-r", "b.txt", "c"]) == \
+            [["a"], ["-r", "b.txt"], ["c"]]
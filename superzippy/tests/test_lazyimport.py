@@ -0,0 +1,66 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# internal
+from .. import packaging
+from ..bootstrapper import lazyimport
+
+# stdlib
+import os
+import shutil
+import sys
+import tempfile
+
+def test_split_module_list():
+    assert packaging.split_module_list(["foo, bar", "", "baz,"]) == \
+        ["foo", "bar", "baz"]
+
+def test_lazy_import():
+    test_dir = tempfile.mkdtemp()
+    finder = lazyimport.LazyFinder(["lazypkg"])
+    try:
+        os.mkdir(os.path.join(test_dir, "lazypkg"))
+        with open(os.path.join(test_dir, "lazypkg", "__init__.py"),
+                "w") as f:
+            f.write("import sys\nsys.superzippy_test.append('lazypkg')\n")
+        with open(os.path.join(test_dir, "lazypkg", "used.py"), "w") as f:
+            f.write("VALUE = 1\n")
+        with open(os.path.join(test_dir, "eager.py"), "w") as f:
+            f.write("import sys\nsys.superzippy_test.append('eager')\n")
+
+        sys.superzippy_test = []
+        sys.path.insert(0, test_dir)
+        sys.meta_path.insert(0, finder)
+
+        import eager
+        import lazypkg
+        assert sys.superzippy_test == ["eager"]
+        assert type(lazypkg) is not type(eager)
+        assert lazyimport.materialized() == []
+
+        import lazypkg.used
+        assert lazypkg.used.VALUE == 1
+        assert sys.superzippy_test == ["eager", "lazypkg"]
+        assert lazyimport.materialized() == ["lazypkg", "lazypkg.used"]
+    finally:
+        sys.meta_path.remove(finder)
+        sys.path.remove(test_dir)
+        for i in ("eager", "lazypkg", "lazypkg.used"):
+            sys.modules.pop(i, None)
+        del sys.superzippy_test
+        del lazyimport._lazy_modules[:]
+        shutil.rmtree(test_dir)
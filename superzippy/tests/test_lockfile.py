@@ -0,0 +1,164 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+from .test_wheels import make_wheel
+
+# external
+import pytest
+
+# internal
+from .. import lockfile
+from .. import packaging
+from .. import wheels
+
+# stdlib
+import hashlib
+import shutil
+import subprocess
+import os
+
+LOCK_FILE = """\
+# interpreter: CPython-3.11.7-linux
+Foo_Bar==1.0 \\
+    --hash=sha256:abc \\
+    --hash=sha256:def
+baz==2.0 --hash=sha256:123  # a comment
+"""
+
+def test_loads_and_dumps():
+    lock_file = lockfile.LockFile.loads(LOCK_FILE)
+    assert lock_file.interpreter_tag == "CPython-3.11.7-linux"
+    assert lock_file.packages == [
+        lockfile.LockedPackage("baz", "2.0", ["sha256:123"]),
+        lockfile.LockedPackage("Foo_Bar", "1.0", ["sha256:abc", "sha256:def"])
+    ]
+    assert lock_file.find("foo.bar").version == "1.0"
+    assert lock_file.find("qux") is None
+
+    reloaded = lockfile.LockFile.loads(lock_file.dumps())
+    assert reloaded.packages == lock_file.packages
+    assert reloaded.interpreter_tag == lock_file.interpreter_tag
+
+@pytest.mark.parametrize("text", [
+    "foo\n",
+    "foo>=1.0 --hash=sha256:abc\n",
+    "foo==1.0\n",
+    "foo==1.0 --no-deps --hash=sha256:abc\n"
+])
+def test_invalid(text):
+    with pytest.raises(lockfile.InvalidLockFile):
+        lockfile.LockFile.loads(text)
+
+def test_parse_report():
+    report = {"install": [
+        {
+            "metadata": {"name": "foo", "version": "1.0"},
+            "download_info": {"url": "file:///foo-1.0-py3-none-any.whl",
+                "archive_info": {"hashes": {"sha256": "abc"}}}
+        },
+        {
+            "metadata": {"name": "myapp", "version": "0.1"},
+            "download_info": {"url": "file:///myapp", "dir_info": {}}
+        }
+    ]}
+
+    locked, local = lockfile.parse_report(report)
+    assert locked == [lockfile.LockedPackage("foo", "1.0", ["sha256:abc"])]
+    assert local == ["myapp"]
+
+    del report["install"][0]["download_info"]["archive_info"]
+    with pytest.raises(lockfile.InvalidLockFile):
+        lockfile.parse_report(report)
+
+def test_get_locked_packages():
+    test_dir = file_utilities.create_test_directory(["myapp"])
+    try:
+        lock_path = os.path.join(test_dir, "superzippy.lock")
+        with open(lock_path, "w") as f:
+            f.write(LOCK_FILE)
+
+        options, args = packaging.parse_arguments(["--lock", lock_path,
+            "foo-bar", "baz==2.0", "myapp", "myapp:main"])
+        options.cwd = test_dir
+
+        lock_file, local = lockfile.get_locked_packages(options, args[:-1],
+            "CPython-3.11.7-linux")
+        assert len(lock_file.packages) == 2
+        assert local == ["myapp"]
+
+        for i in (["baz==3.0"], ["qux"], ["foo-bar --global-option=x"]):
+            with pytest.raises(lockfile.InvalidLockFile):
+                lockfile.get_locked_packages(options, i,
+                    "CPython-3.11.7-linux")
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_build_from_lock():
+    """
+    A build given a lock file should install exactly the locked wheels, and
+    only if their hashes match.
+
+    """
+
+    test_dir = file_utilities.create_test_directory(["wheels"])
+    try:
+        wheel_dir = os.path.join(test_dir, "wheels")
+
+        # bar isn't a dependency of foo, so only the lock file can bring it
+        # in.
+        locked = []
+        for name in ("foo", "bar"):
+            path = make_wheel(wheel_dir, name, "1.0")
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            locked.append(lockfile.LockedPackage(name, "1.0",
+                ["sha256:" + digest]))
+
+        lock_path = os.path.join(test_dir, "superzippy.lock")
+        with open(lock_path, "w") as f:
+            f.write(lockfile.LockFile(locked).dumps())
+
+        with open(os.path.join(test_dir, "hello.py"), "w") as f:
+            f.write("import foo, bar\n"
+                "def main():\n    print(foo.VERSION + bar.VERSION)\n")
+
+        output = os.path.join(test_dir, "hello.sz")
+        options, args = packaging.parse_arguments(["-o", output, "-w",
+            wheel_dir, "--lock", lock_path, "--no-cache", "-c",
+            os.path.join(test_dir, "hello.py"), "foo", "hello:main"])
+        assert packaging.main(options, args) == 0
+        assert subprocess.check_output([output]).strip() == b"1.01.0"
+
+        # Without -o, the executable is named after the packages given
+        # rather than after the lock file's requirements.
+        options, args = packaging.parse_arguments(["-w", wheel_dir,
+            "--lock", lock_path, "--no-cache", "-c",
+            os.path.join(test_dir, "hello.py"), "foo", "hello:main"])
+        args = packaging.resolve_paths(options, args, test_dir)
+        assert packaging.main(options, args) == 0
+        assert os.path.exists(os.path.join(test_dir, "foo.sz"))
+
+        python_version = (3, 3)
+        wheel_directory = wheels.WheelDirectory(wheel_dir, python_version)
+        assert len(wheels.find_locked(locked, wheel_directory)) == 2
+
+        locked[0].hashes = ["sha256:0"]
+        assert wheels.find_locked(locked, wheel_directory) is None
+    finally:
+        shutil.rmtree(test_dir)
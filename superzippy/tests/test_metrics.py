@@ -0,0 +1,71 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import metrics
+
+# stdlib
+import json
+import tempfile
+import shutil
+import os
+
+def test_phases():
+    tree = file_utilities.create_test_directory(
+        ["a", ("a/b", 10), ("c", 20)])
+    output_dir = tempfile.mkdtemp()
+    try:
+        build_metrics = metrics.Metrics()
+
+        with build_metrics.phase("outer", extra = "detail") as record:
+            record["files"] = metrics.count_files(tree)
+
+            with build_metrics.phase("inner"):
+                with open(os.path.join(output_dir, "out"), "wb") as f:
+                    f.write(b"x" * 1000)
+
+        try:
+            with build_metrics.phase("failing"):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        path = os.path.join(output_dir, "metrics.json")
+        build_metrics.write(path, False)
+        with open(path) as f:
+            result = json.load(f)
+
+        assert result["version"] == metrics.FORMAT_VERSION
+        assert result["succeeded"] is False
+        assert [i["name"] for i in result["phases"]] == \
+            ["outer", "inner", "failing"]
+
+        outer, inner, failing = result["phases"]
+        assert outer["files"] == 2
+        assert outer["extra"] == "detail"
+        assert inner["files"] is None
+        assert outer["wall_time"] >= inner["wall_time"] >= 0
+        assert failing["cpu_time"] >= 0
+
+        if metrics.get_io_counters()[0] is not None:
+            assert inner["bytes_written"] >= 1000
+    finally:
+        shutil.rmtree(tree)
+        shutil.rmtree(output_dir)
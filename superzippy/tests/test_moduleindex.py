@@ -0,0 +1,237 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# external
+import pytest
+
+# internal
+from .. import compression
+from .. import manifest
+from .. import moduleindex
+from .. import zipdir
+from ..bootstrapper import zipindex
+
+# stdlib
+from contextlib import closing
+import importlib.util
+import io
+import json
+import os
+import py_compile
+import tempfile
+import shutil
+import subprocess
+import sys
+import zipfile
+
+def test_create_index():
+    members = {
+        "__main__.py": (0, 8, 10, 20),
+        "site-packages/foo.py": (10, 8, 10, 20),
+        "site-packages/foo/__init__.py": (20, 8, 10, 20),
+        "site-packages/foo/bar.pyc": (30, 8, 10, 20),
+        "site-packages/foo/data/x.txt": (40, 0, 10, 10),
+        "site-packages/foo-1.0.dist-info/METADATA": (50, 8, 10, 20)
+    }
+
+    name, data = moduleindex.create_index(members)
+    assert name == zipindex.INDEX_NAME == moduleindex.INDEX_NAME
+
+    index = json.loads(data.decode("utf-8"))
+    assert set(index["members"]) == set(i[len("site-packages/"):]
+        for i in members if i.startswith("site-packages/"))
+    assert index["members"]["foo/bar.pyc"] == [30, 8, 10, 20]
+    assert index["modules"] == {
+        "foo": [True, "foo/__init__.py", None],
+        "foo/bar": [False, None, "foo/bar.pyc"]
+    }
+    assert index["directories"] == ["foo", "foo-1.0.dist-info", "foo/data"]
+
+@pytest.fixture
+def archive(request):
+    """
+    An archive with an index and a #! line written to a pipe-like file, so
+    that its offsets don't account for the #! line.
+
+    """
+
+    test_dir = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(test_dir))
+
+    compiled = os.path.join(test_dir, "compiled.pyc")
+    with open(os.path.join(test_dir, "compiled.py"), "w") as f:
+        f.write("VALUE = 'compiled'\n")
+    py_compile.compile(os.path.join(test_dir, "compiled.py"), compiled,
+        "site-packages/pkg/compiled.py", True)
+
+    archive_manifest = manifest.Manifest()
+    archive_manifest.add_bytes("__main__.py", b"")
+    archive_manifest.add_bytes("site-packages/pkg/__init__.py",
+        b"VALUE = 'pkg'\n")
+    archive_manifest.add_bytes("site-packages/pkg/source.py",
+        b"# -*- coding: latin-1 -*-\nVALUE = '\xe9'\n")
+    archive_manifest.add_file("site-packages/pkg/compiled.pyc", compiled)
+    archive_manifest.add_bytes("site-packages/pkg/data.txt", b"x" * 1000)
+    archive_manifest.add_bytes("site-packages/lib-1.0.egg/extra.py",
+        b"VALUE = 'extra'\n")
+
+    class Pipe(io.BytesIO):
+        def seekable(self):
+            return False
+
+        def tell(self):
+            raise IOError("Not seekable.")
+
+    # Bytecode is stored so that it's read without being copied
+    output = Pipe()
+    zipdir.zip_manifest(archive_manifest, output, prefix = b"#!python\n",
+        policy = compression.CompressionPolicy.parse(["*.pyc=store"]),
+        index = moduleindex.create_index)
+
+    path = os.path.join(test_dir, "archive.sz")
+    with open(path, "wb") as f:
+        f.write(output.getvalue())
+
+    return path
+
+def test_read(archive):
+    indexed = zipindex.IndexedArchive(archive)
+    with closing(zipfile.ZipFile(archive)) as f:
+        # zipimport on Python 3.7 and older can't read archives with one
+        assert f.comment == b""
+
+        for name in indexed.members:
+            assert indexed.read(name) == f.read("site-packages/" + name)
+            assert bytes(indexed.read_buffer(name)) == indexed.read(name)
+
+    assert isinstance(indexed.read_buffer("pkg/compiled.pyc"), memoryview)
+    assert isinstance(indexed.read_buffer("pkg/data.txt"), bytes)
+
+def test_import(archive):
+    root = os.path.join(archive, "site-packages")
+    importer = zipindex.IndexedImporter(zipindex.IndexedArchive(archive),
+        root)
+
+    assert importer.find_spec("pkg") is None # Not on sys.path
+    assert importer.find_spec("pkg.missing", [root]) is None
+    assert importer.find_spec("pkg.source", ["/elsewhere"]) is None
+
+    values = []
+    for name in ("pkg.source", "pkg.compiled"):
+        spec = importer.find_spec(name, [os.path.join(root, "pkg")])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        values.append(module.VALUE)
+
+    assert values == [u"\xe9", "compiled"]
+    assert importer.get_source("pkg.compiled") is None
+    assert importer.is_package("pkg")
+    assert importer.get_data(os.path.join(root, "pkg", "data.txt")) == \
+        b"x" * 1000
+    with pytest.raises(IOError):
+        importer.get_data(os.path.join(root, "pkg", "missing.txt"))
+
+    finder = importer.path_hook(os.path.join(root, "pkg"))
+    assert list(finder.iter_modules("pkg.")) == \
+        [("pkg.compiled", False), ("pkg.source", False)]
+    with pytest.raises(ImportError):
+        importer.path_hook(os.path.join(root, "missing"))
+
+def test_import_from_directory(archive):
+    # Directories in site-packages may be put on sys.path by .pth files
+    root = os.path.join(archive, "site-packages")
+    importer = zipindex.IndexedImporter(zipindex.IndexedArchive(archive),
+        root)
+
+    assert importer.find_spec("extra", [root]) is None
+
+    # Packages extracted out of the archive are imported from elsewhere
+    excluding = zipindex.IndexedImporter(importer.indexed, root, ["pkg"])
+    assert excluding.find_spec("pkg.source", [os.path.join(root, "pkg")]) \
+        is None
+    assert importer.find_spec("pkg.source", [os.path.join(root, "pkg")]) \
+        is not None
+
+    finder = importer.path_hook(os.path.join(root, "lib-1.0.egg"))
+    spec = finder.find_spec("extra")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    assert module.VALUE == "extra"
+    assert spec.origin == os.path.join(root, "lib-1.0.egg", "extra.py")
+    assert not importer.is_package("extra")
+
+def test_pkg_resources(archive):
+    pytest.importorskip("pkg_resources")
+
+    # pkg_resources is imported after the importer is installed, in a
+    # process of its own so that it's imported fresh.
+    script = "\n".join([
+        "import sys, zipindex",
+        "root = sys.argv[1] + '/site-packages'",
+        "assert zipindex.install(sys.argv[1], root)",
+        "sys.path.insert(0, root)",
+        "import pkg",
+        "assert isinstance(pkg.__loader__, zipindex.IndexedImporter)",
+        "import pkg_resources",
+        "print(pkg_resources.resource_exists('pkg', 'data.txt'))",
+        "print(pkg_resources.resource_exists('pkg', 'missing.txt'))",
+        "print(pkg_resources.resource_isdir('pkg', 'data.txt'))",
+        "print(sorted(pkg_resources.resource_listdir('pkg', '')))",
+        "print(len(pkg_resources.resource_string('pkg', 'data.txt')))",
+    ])
+    bootstrapper = os.path.dirname(zipindex.__file__)
+    output = subprocess.check_output([sys.executable, "-W", "ignore", "-c",
+        "import sys; sys.path.insert(0, %r); exec(%r)" %
+            (bootstrapper, script), archive])
+
+    assert output.decode("utf-8").split("\n")[:-1] == [
+        "True", "False", "False",
+        "['__init__.py', 'compiled.pyc', 'data.txt', 'source.py']", "1000"
+    ]
+
+def test_no_index():
+    test_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(test_dir, "archive.zip")
+        with closing(zipfile.ZipFile(path, "w")) as f:
+            f.writestr("site-packages/foo.py", "")
+
+        with pytest.raises(ValueError):
+            zipindex.IndexedArchive(path)
+        assert not zipindex.install(path, os.path.join(path, "site-packages"))
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_built_without_index():
+    """
+    The central directory of an archive built without an index ends with
+    some other member, which mustn't be mistaken for one.
+
+    """
+
+    test_dir = tempfile.mkdtemp()
+    try:
+        archive_manifest = manifest.Manifest()
+        archive_manifest.add_bytes("site-packages/foo.py", b"")
+        path = os.path.join(test_dir, "archive.sz")
+        zipdir.zip_manifest(archive_manifest, path)
+
+        with pytest.raises(ValueError):
+            zipindex.IndexedArchive(path)
+    finally:
+        shutil.rmtree(test_dir)
@@ -0,0 +1,73 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# internal
+from .. import manifest
+from .. import pthfiles
+
+# stdlib
+import locale
+import os
+import shutil
+import tempfile
+
+def test_evaluate():
+    test_dir = tempfile.mkdtemp()
+    try:
+        pth_file = os.path.join(test_dir, "b.pth")
+        with open(pth_file, "w") as f:
+            f.write("import sys; sys.b = True\nlib/../egg\n")
+
+        archive_manifest = manifest.Manifest()
+        archive_manifest.add_file("site-packages/b.pth", pth_file)
+        archive_manifest.add_bytes("site-packages/a.pth",
+            b"# comment\n\nlib\n.\n/usr/lib\nmissing\nimport\tos\nlib\n")
+        archive_manifest.add_bytes("site-packages/lib/foo/bar.py", b"")
+        archive_manifest.add_bytes("site-packages/egg/EGG-INFO", b"")
+        archive_manifest.add_bytes("site-packages/lib/nested.pth",
+            b"nested\n")
+
+        assert pthfiles.evaluate(archive_manifest) == (
+            ["site-packages/lib", "site-packages/egg"],
+            [("a.pth", 7, "import\tos"),
+                ("b.pth", 1, "import sys; sys.b = True")]
+        )
+    finally:
+        shutil.rmtree(test_dir)
+
+def test_encodings(monkeypatch):
+    """
+    Files that aren't UTF-8 should be read in the locale's encoding like
+    site does, and skipped if even that fails.
+
+    """
+
+    monkeypatch.setattr(locale, "getpreferredencoding",
+        lambda do_setlocale = True: "latin-1")
+
+    archive_manifest = manifest.Manifest()
+    archive_manifest.add_bytes("site-packages/a.pth",
+        b"\xef\xbb\xbfimport sys\n")
+    archive_manifest.add_bytes("site-packages/b.pth",
+        b"import sys # caf\xe9\n")
+    assert pthfiles.evaluate(archive_manifest)[1] == [
+        ("a.pth", 1, "import sys"), ("b.pth", 1, u"import sys # caf\xe9")]
+
+    monkeypatch.setattr(locale, "getpreferredencoding",
+        lambda do_setlocale = True: "ascii")
+    assert pthfiles.evaluate(archive_manifest)[1] == [
+        ("a.pth", 1, "import sys")]
@@ -0,0 +1,111 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import treeshake
+
+# stdlib
+import shutil
+import os
+
+SOURCES = {
+    "app/__init__.py": "",
+    "app/main.py":
+        "import os\n"
+        "from . import util\n"
+        "from lib.sub import thing\n"
+        "def main():\n"
+        "    import importlib\n"
+        "    importlib.import_module('dynamic')\n",
+    "app/util.py": "import helper\n",
+    "app/unused.py": "import unusedlib\n",
+    "helper.py": "",
+    "lib/__init__.py": "",
+    "lib/sub.py": "thing = 1\n",
+    "lib/other.py": "",
+    "dynamic.py": "",
+    "unusedlib/__init__.py": "",
+    "unusedlib/data.txt": "data",
+    "plugins/__init__.py": "",
+    "plugins/a.py": "",
+    "broken/__init__.py": "def broken(:\n",
+    "broken/part.py": "",
+    "pthmod.py": "",
+    "foo.pth": "import pthmod\n",
+    "datadir/data.txt": "data",
+    "lib-1.0.egg/eggmod.py": "import eggdep\nimport sub\n",
+    "lib-1.0.egg/eggdep.py": "import helper\n",
+    "app/templates/index.html": "<html></html>"
+}
+
+class TestTreeShake:
+    def setup_method(self, method):
+        self.tree = file_utilities.create_test_directory(
+            ["app", "app/templates", "lib", "unusedlib", "plugins", "broken",
+                "datadir", "lib-1.0.egg"])
+        for path, contents in SOURCES.items():
+            with open(os.path.join(self.tree, *path.split("/")), "w") as f:
+                f.write(contents)
+
+        self.files = {}
+        for dir_path, dir_names, file_names in os.walk(self.tree):
+            for i in file_names:
+                file_path = os.path.join(dir_path, i)
+                relative_name = os.path.relpath(file_path, self.tree)
+                self.files[relative_name.replace(os.sep, "/")] = file_path
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tree)
+
+    def test_find_unreachable(self):
+        unreachable = treeshake.find_unreachable(self.files, ["app.main"],
+            keep = ["plugins"])
+
+        assert unreachable == ["app/unused.py", "broken/__init__.py",
+            "broken/part.py", "lib/other.py", "unusedlib/__init__.py",
+            "unusedlib/data.txt"]
+
+    def test_unparseable(self):
+        """
+        A module that can't be parsed should keep its whole package.
+
+        """
+
+        unreachable = treeshake.find_unreachable(self.files, ["broken"])
+
+        assert "broken/part.py" not in unreachable
+        assert "app/main.py" in unreachable
+
+    def test_site_paths(self):
+        """
+        Modules in directories that .pth files add to the path should be
+        found there, and kept when they're reachable from either place.
+
+        """
+
+        unreachable = treeshake.find_unreachable(self.files, ["eggmod"],
+            site_paths = ["lib-1.0.egg", "lib"])
+
+        assert "lib-1.0.egg/eggmod.py" not in unreachable
+        assert "lib-1.0.egg/eggdep.py" not in unreachable
+        assert "helper.py" not in unreachable
+        assert "lib/sub.py" not in unreachable
+        assert "lib/other.py" in unreachable
+        assert "app/main.py" in unreachable
@@ -0,0 +1,57 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# internal
+from .. import venvpool
+
+# stdlib
+import tempfile
+import shutil
+import os
+
+class TestCloneTree:
+    def test_clone(self):
+        """
+        Clones should contain everything in the template, and modifying the
+        files that might be modified in place must not touch the template.
+
+        """
+
+        template = file_utilities.create_test_directory([
+            "bin", ("bin/python", 10), "lib", "lib/site-packages",
+            ("lib/site-packages/foo.py", 10),
+            ("lib/site-packages/easy-install.pth", 10)
+        ])
+        clone = tempfile.mkdtemp()
+        try:
+            venvpool.clone_tree(template, clone)
+
+            assert set(file_utilities.get_files(clone)) == \
+                set(file_utilities.get_files(template))
+
+            pth_file = os.path.join("lib", "site-packages", "easy-install.pth")
+            with open(os.path.join(clone, pth_file), "w") as f:
+                f.write("changed")
+
+            with open(os.path.join(template, pth_file)) as f:
+                assert f.read() != "changed"
+        finally:
+            shutil.rmtree(template)
+            shutil.rmtree(clone)
@@ -0,0 +1,138 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# test helpers
+from . import file_utilities
+
+# external
+import pytest
+
+# internal
+from .. import wheels
+
+# stdlib
+from contextlib import closing
+import zipfile
+import tempfile
+import shutil
+import os
+
+def make_wheel(directory, name, version, requires = (), tag = "py2.py3"):
+    """
+    Creates a minimal pure-Python wheel containing a single module named
+    after the project and returns its path.
+
+    """
+
+    path = os.path.join(directory,
+        "%s-%s-%s-none-any.whl" % (name, version, tag))
+    dist_info = "%s-%s.dist-info" % (name, version)
+    metadata = "Metadata-Version: 2.1\nName: %s\nVersion: %s\n" % (name,
+        version)
+    metadata += "".join("Requires-Dist: %s\n" % (i, ) for i in requires)
+
+    with closing(zipfile.ZipFile(path, "w")) as f:
+        f.writestr("%s.py" % (name, ), "VERSION = %r\n" % (version, ))
+        f.writestr("%s-%s.data/purelib/%s_extra.py" % (name, version, name),
+            "")
+        f.writestr("%s-%s.data/scripts/%s" % (name, version, name), "")
+        f.writestr(dist_info + "/METADATA", metadata)
+
+    return path
+
+@pytest.fixture
+def wheel_dir(request):
+    path = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(path))
+
+    make_wheel(path, "foo", "1.0", requires = ["bar>=2"])
+    make_wheel(path, "bar", "2.0")
+    make_wheel(path, "bar", "2.1")
+    make_wheel(path, "bar", "3.0", tag = "py2")
+    make_wheel(path, "baz", "1.0",
+        requires = ["missing; python_version < '2'"])
+    make_wheel(path, "legacy", "1.0",
+        requires = ["bar; python_version < '3' and sys_platform == 'linux2'"])
+
+    return wheels.WheelDirectory(path, (3, 3),
+        wheels.get_marker_environment("CPython-3.3.0-linux"))
+
+class TestResolve:
+    def test_dependencies(self, wheel_dir):
+        resolved = wheels.resolve(["foo==1.0"], wheel_dir)
+        assert sorted((i.key, i.version) for i in resolved) == \
+            [("bar", "2.1"), ("foo", "1.0")]
+
+    def test_pinned_dependency(self, wheel_dir):
+        resolved = wheels.resolve(["foo==1.0 bar==2.0"], wheel_dir)
+        assert sorted((i.key, i.version) for i in resolved) == \
+            [("bar", "2.0"), ("foo", "1.0")]
+
+    def test_markers(self, wheel_dir):
+        resolved = wheels.resolve(["baz==1.0"], wheel_dir)
+        assert [i.key for i in resolved] == ["baz"]
+
+    def test_target_markers(self, wheel_dir):
+        # Markers are evaluated for the interpreter being built for, not the
+        # one doing the building.
+        resolved = wheels.resolve(["legacy==1.0"], wheel_dir)
+        assert [i.key for i in resolved] == ["legacy"]
+
+        old_wheel_dir = wheels.WheelDirectory(wheel_dir.path, (2, 7),
+            wheels.get_marker_environment("CPython-2.7.18-linux2"))
+        resolved = wheels.resolve(["legacy==1.0"], old_wheel_dir)
+        assert sorted((i.key, i.version) for i in resolved) == \
+            [("bar", "3.0"), ("legacy", "1.0")]
+
+    @pytest.mark.parametrize("packages", [
+        ["foo"],
+        ["foo>=1.0"],
+        ["foo==1.0", "bar==3.0"],
+        ["foo==1.0 --global-option=bla"],
+        ["qux==1.0"]
+    ])
+    def test_unsupported(self, wheel_dir, packages):
+        assert wheels.resolve(packages, wheel_dir) is None
+
+def test_unpack(wheel_dir):
+    site_package_dir = tempfile.mkdtemp()
+    try:
+        wheels.unpack_wheel(wheel_dir.find(
+            wheels.pkg_resources.Requirement.parse("foo==1.0")),
+            site_package_dir)
+
+        assert set(file_utilities.get_files(site_package_dir)) == set([
+            "foo.py", "foo_extra.py", "foo-1.0.dist-info",
+            os.path.join("foo-1.0.dist-info", "METADATA")
+        ])
+    finally:
+        shutil.rmtree(site_package_dir)
+
+def test_unpack_unsafe(wheel_dir):
+    site_package_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(wheel_dir.path, "evil-1.0-py3-none-any.whl")
+        with closing(zipfile.ZipFile(path, "w")) as f:
+            f.writestr("evil.py", "")
+            f.writestr("../evil.py", "")
+
+        with pytest.raises(ValueError):
+            wheels.unpack_wheel(wheels.Wheel(path), site_package_dir)
+
+        assert os.listdir(site_package_dir) == []
+    finally:
+        shutil.rmtree(site_package_dir)
@@ -25,11 +25,15 @@ from . import file_utilities
 import pytest
 
 # internal
+from .. import compression
+from .. import manifest
+from .. import moduleindex
 from .. import zipdir
 
 # stdlib
 from contextlib import closing
 import zipfile
+import zlib
 import tempfile
 import shutil
 import os
@@ -120,3 +124,322 @@ class TestZipDir:
                 file_size = os.stat(
                     os.path.join(test_dir, i[0])).st_size
                 assert file_size == i[1]
+
+class TestParallelZipDir:
+    cases = [
+        ["a", "b", ("a/foo", 1000), ("a/bar", 50000), ("b/baz", 0)],
+        [("bar", 1000)]
+    ]
+
+    @pytest.mark.parametrize("test_case", cases)
+    @pytest.mark.parametrize("large_file_size", [zipdir.LARGE_FILE_SIZE, 500])
+    def test_identical(self, test_case, large_file_size, monkeypatch):
+        """
+        Compressing with several jobs must produce exactly the same archive
+        as compressing serially.
+
+        """
+
+        monkeypatch.setattr(zipdir, "LARGE_FILE_SIZE", large_file_size)
+
+        test_dir = file_utilities.create_test_directory(test_case)
+        output_dir = tempfile.mkdtemp()
+        try:
+            serial = os.path.join(output_dir, "serial.zip")
+            parallel = os.path.join(output_dir, "parallel.zip")
+
+            zipdir.zip_directory(test_dir, serial)
+            zipdir.zip_directory(test_dir, parallel, jobs = 4)
+
+            with open(serial, "rb") as f:
+                serial_data = f.read()
+            with open(parallel, "rb") as f:
+                parallel_data = f.read()
+
+            assert serial_data == parallel_data
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(output_dir)
+
+class TestZipManifest:
+    def test_manifest(self):
+        """
+        Members may come from files anywhere or from memory, and several jobs
+        must still produce the same archive as one.
+
+        """
+
+        test_dir = file_utilities.create_test_directory(
+            ["a", ("a/foo", 1000), ("bar", 5000)])
+        output_dir = tempfile.mkdtemp()
+        try:
+            archive_manifest = manifest.Manifest()
+            archive_manifest.add_tree("site-packages", test_dir)
+            archive_manifest.add_file("renamed", os.path.join(test_dir, "bar"))
+            archive_manifest.add_bytes("memory.py", b"x = 1\n" * 100)
+            archive_manifest.remove("site-packages/bar")
+
+            archives = []
+            for jobs in (1, 4):
+                output = os.path.join(output_dir, "%d.zip" % (jobs, ))
+                zipdir.zip_manifest(archive_manifest, output, jobs = jobs)
+                with open(output, "rb") as f:
+                    archives.append(f.read())
+
+            assert archives[0] == archives[1]
+
+            with closing(zipfile.ZipFile(output)) as f:
+                assert sorted(f.namelist()) == ["memory.py", "renamed",
+                    "site-packages/a/foo", zipdir.ARCHIVE_INFO_NAME]
+                assert f.comment == b""
+                assert f.read("memory.py") == b"x = 1\n" * 100
+                with open(os.path.join(test_dir, "bar"), "rb") as bar:
+                    assert f.read("renamed") == bar.read()
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(output_dir)
+
+    def test_symlinked_directory(self):
+        """
+        Directories that are symbolic links should be added like any other,
+        but a link back to a directory it's within shouldn't go on forever.
+
+        """
+
+        test_dir = file_utilities.create_test_directory(
+            ["a", ("a/foo", 100)])
+        linked_dir = file_utilities.create_test_directory(
+            ["b", ("b/bar", 100)])
+        try:
+            os.symlink(linked_dir, os.path.join(test_dir, "linked"))
+            os.symlink(test_dir, os.path.join(test_dir, "a", "loop"))
+
+            archive_manifest = manifest.Manifest()
+            archive_manifest.add_tree("site-packages", test_dir)
+
+            assert sorted(archive_manifest) == ["site-packages/a/foo",
+                "site-packages/linked/b/bar"]
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(linked_dir)
+
+    def test_member_cache(self):
+        """
+        Archives written with a member cache should be the same as those
+        written without one, and a copy of a tree in another place should be
+        served from the cache.
+
+        """
+
+        test_dir = file_utilities.create_test_directory(
+            ["a", ("a/foo", 1000), ("bar", 5000)])
+        copy_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        try:
+            copy_dir = os.path.join(copy_dir, "copy")
+            shutil.copytree(test_dir, copy_dir)
+
+            member_cache = zipdir.MemberCache(2 ** 20)
+            for jobs in (1, 4):
+                archives = []
+                for path, cache in [(test_dir, None), (test_dir, member_cache),
+                        (copy_dir, member_cache)]:
+                    archive_manifest = manifest.Manifest()
+                    archive_manifest.add_tree("", path)
+
+                    output = os.path.join(output_dir, "test.zip")
+                    zipdir.zip_manifest(archive_manifest, output, jobs = jobs,
+                        member_cache = cache)
+                    with closing(zipfile.ZipFile(output)) as f:
+                        archives.append(sorted((i.filename, i.CRC,
+                            i.compress_size) for i in f.infolist()))
+
+                assert archives[0] == archives[1] == archives[2]
+
+            assert member_cache.misses == 2
+            assert member_cache.hits == 6
+            assert member_cache.size > 0
+
+            # Nothing fits in a tiny cache
+            tiny_cache = zipdir.MemberCache(5)
+            tiny_cache.compress(b"x" * 100, 6)
+            assert tiny_cache.size == 0
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(os.path.dirname(copy_dir))
+            shutil.rmtree(output_dir)
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_previous_archive(self, jobs):
+        """
+        Unchanged members should be copied from the previous archive, and the
+        result should be exactly what a fresh build would have written.
+
+        """
+
+        test_dir = file_utilities.create_test_directory(
+            ["a", ("a/foo", 1000), ("a/bar", 1000), ("baz", 5000)])
+        output_dir = tempfile.mkdtemp()
+        try:
+            archive_manifest = manifest.Manifest()
+            archive_manifest.add_tree("", test_dir)
+            policy = compression.CompressionPolicy()
+
+            # The index shouldn't get in the way of reusing members
+            old = os.path.join(output_dir, "old.zip")
+            zipdir.zip_manifest(archive_manifest, old, policy = policy,
+                index = moduleindex.create_index)
+
+            # Same size, different contents
+            with open(os.path.join(test_dir, "a", "bar"), "wb") as f:
+                f.write(b"x" * 1000)
+
+            new = os.path.join(output_dir, "new.zip")
+            previous = zipdir.PreviousArchive(old, policy)
+            try:
+                assert previous.usable
+                zipdir.zip_manifest(archive_manifest, new, jobs = jobs,
+                    policy = policy, previous = previous)
+            finally:
+                previous.close()
+
+            assert previous.reused == 2
+
+            fresh = os.path.join(output_dir, "fresh.zip")
+            zipdir.zip_manifest(archive_manifest, fresh, policy = policy)
+            with open(new, "rb") as f:
+                new_data = f.read()
+            with open(fresh, "rb") as f:
+                assert f.read() == new_data
+
+            with closing(zipfile.ZipFile(new)) as f:
+                assert f.testzip() is None
+                assert f.read("a/bar") == b"x" * 1000
+
+            # Matching CRCs aren't enough
+            collision = [b"p\xed\xab[\xabN\xc5\"",
+                b"\xa7\xc0\x1aPI\\\xdf\xc3"]
+            assert zlib.crc32(collision[0]) == zlib.crc32(collision[1])
+            collision_manifest = manifest.Manifest()
+            collision_manifest.add_file("c", os.path.join(test_dir, "c"))
+            with open(os.path.join(test_dir, "c"), "wb") as f:
+                f.write(collision[0])
+            zipdir.zip_manifest(collision_manifest, old, policy = policy)
+            with open(os.path.join(test_dir, "c"), "wb") as f:
+                f.write(collision[1])
+
+            previous = zipdir.PreviousArchive(old, policy)
+            try:
+                zipdir.zip_manifest(collision_manifest, new, policy = policy,
+                    previous = previous)
+            finally:
+                previous.close()
+
+            assert previous.reused == 0
+            with closing(zipfile.ZipFile(new)) as f:
+                assert f.read("c") == collision[1]
+
+            # Nothing is reused from an archive compressed differently
+            other_policy = compression.CompressionPolicy(level = 1)
+            previous = zipdir.PreviousArchive(old, other_policy)
+            try:
+                assert not previous.usable
+                assert previous.reuse("baz", b"") is None
+            finally:
+                previous.close()
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(output_dir)
+
+class UnseekableFile(object):
+    """A file object that only supports writing, like a pipe."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+class TestStreaming:
+    test_case = ["a", ("a/foo", 1000), ("a/bar", 50000), ("baz", 10)]
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_prefix_unseekable(self, jobs):
+        """
+        Writing to something that isn't seekable with a prefix should produce
+        a valid archive that begins with the prefix.
+
+        """
+
+        test_dir = file_utilities.create_test_directory(self.test_case)
+        output_dir = tempfile.mkdtemp()
+        try:
+            output = UnseekableFile()
+            zipdir.zip_directory(test_dir, output, jobs = jobs,
+                prefix = b"#!/usr/bin/env python\n")
+
+            archive_path = os.path.join(output_dir, "test.zip")
+            with open(archive_path, "wb") as f:
+                f.write(output.getvalue())
+
+            with open(archive_path, "rb") as f:
+                assert f.readline() == b"#!/usr/bin/env python\n"
+
+            with closing(zipfile.ZipFile(archive_path, "r")) as f:
+                assert f.testzip() is None
+                f.extractall(output_dir)
+
+            for i in ("a/foo", "a/bar", "baz"):
+                with open(os.path.join(test_dir, i), "rb") as f:
+                    expected = f.read()
+                with open(os.path.join(output_dir, i), "rb") as f:
+                    assert f.read() == expected
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(output_dir)
+
+class TestCompressionPolicy:
+    test_case = ["a", ("a/foo.py", 1000), ("a/bar.png", 5000), ("baz", 3000)]
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_policy(self, jobs):
+        """
+        Each file should be compressed as the policy says, no matter how many
+        jobs are used.
+
+        """
+
+        policy = compression.CompressionPolicy.parse(["baz=deflate-9"])
+
+        test_dir = file_utilities.create_test_directory(self.test_case)
+        output_dir = tempfile.mkdtemp()
+        try:
+            archive_path = os.path.join(output_dir, "test.zip")
+            zipdir.zip_directory(test_dir, archive_path, jobs = jobs,
+                policy = policy)
+
+            with closing(zipfile.ZipFile(archive_path, "r")) as f:
+                assert f.testzip() is None
+                assert f.getinfo("a/foo.py").compress_type == \
+                    zipfile.ZIP_DEFLATED
+                assert f.getinfo("a/bar.png").compress_type == \
+                    zipfile.ZIP_STORED
+
+                baz = f.getinfo("baz")
+                assert baz.compress_type == zipfile.ZIP_DEFLATED
+
+                with open(os.path.join(test_dir, "baz"), "rb") as source:
+                    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+                    expected = compressor.compress(source.read()) + \
+                        compressor.flush()
+                assert baz.compress_size == len(expected)
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(output_dir)
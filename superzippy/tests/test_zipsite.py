@@ -0,0 +1,99 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# internal
+from ..bootstrapper import zipsite
+
+# stdlib
+from contextlib import closing
+import os
+import shutil
+import site
+import sys
+import tempfile
+import zipfile
+
+def test_execute_imports(capsys):
+    imports = [
+        ("a.pth", 1, "import sys; sys.superzippy_test = []"),
+        ("a.pth", 2, "import sys; sys.superzippy_test.append(1 / 0)"),
+        ("a.pth", 3, "import sys; sys.superzippy_test.append('a')"),
+        ("b.pth", 1, "import sys; sys.superzippy_test.append('b')")
+    ]
+
+    try:
+        zipsite.execute_imports("/archive.sz/site-packages", imports)
+        assert sys.superzippy_test == ["b"]
+    finally:
+        del sys.superzippy_test
+
+    err = capsys.readouterr()[1]
+    assert "line 2 of %s" % (os.path.join("/archive.sz/site-packages",
+        "a.pth"), ) in err
+    assert "ZeroDivisionError" in err
+
+def test_addsitedir(monkeypatch):
+    """
+    Adding a site directory in an archive should process its .pth files
+    (including directories that only exist because files are in them) while
+    reading the archive only once.
+
+    """
+
+    test_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(test_dir, "archive.sz")
+        with closing(zipfile.ZipFile(path, "w")) as f:
+            f.writestr("site-packages/foo.pth",
+                "# comment\nextra\nmore/\nmissing\n")
+            f.writestr("site-packages/extra/bar.py", "")
+            f.writestr("site-packages/more/", "")
+
+        opened = []
+        original = zipfile.ZipFile
+        class ZipFile(original):
+            def __init__(self, *args, **kwargs):
+                opened.append(args[0])
+                original.__init__(self, *args, **kwargs)
+        monkeypatch.setattr(zipfile, "ZipFile", ZipFile)
+
+        checked = []
+        is_zipfile = zipfile.is_zipfile
+        monkeypatch.setattr(zipfile, "is_zipfile",
+            lambda x: checked.append(x) or is_zipfile(x))
+
+        # User code calling site.addsitedir() at runtime gets it too
+        assert site.addsitedir is zipsite.addsitedir
+
+        site_dir = os.path.join(path, "site-packages")
+        monkeypatch.setattr(sys, "path", list(sys.path))
+        zipsite.addsitedir(site_dir, set(), prepend_mode = True)
+
+        assert sys.path[:3] == [os.path.join(site_dir, "more"),
+            os.path.join(site_dir, "extra"), site_dir]
+        assert opened == [path]
+        assert checked == [path]
+
+        assert zipsite.split_zip_path(os.path.join(site_dir, "extra")) == \
+            (path, os.path.join("site-packages", "extra"))
+        assert zipsite.exists(os.path.join(site_dir, "extra", "bar.py"))
+        assert not zipsite.exists(os.path.join(site_dir, "missing"))
+        assert zipsite.exists(test_dir)
+        assert opened == [path]
+        assert checked == [path]
+    finally:
+        shutil.rmtree(test_dir)
@@ -0,0 +1,331 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that finds the modules in an archive's site-packages directory that
+can't be imported by an entry point, so that they can be left out.
+
+Starting from some root modules, every ``import`` statement (along with calls
+to ``__import__`` and ``importlib.import_module`` with a literal module name)
+is followed to find all of the modules that might be imported. Modules that
+are never reached are left out, as are whole packages (data files and all)
+that are never reached.
+
+Anything imported dynamically (ex: plugins named in a configuration file)
+can't be found this way and must be named explicitly in a keep list.
+
+"""
+
+# stdlib
+import ast
+import logging
+import sys
+
+def _is_identifier_path(parts):
+    return all(i.replace("_", "a").isalnum() for i in parts)
+
+def _module_name(relative_name):
+    """
+    Returns the name of the module at ``relative_name`` (a path relative to
+    site-packages using forward slashes) and whether it's a package, or
+    ``None`` if the path can't be a module.
+
+    """
+
+    parts = relative_name.split("/")
+    if not parts[-1].endswith(".py"):
+        return None
+
+    parts[-1] = parts[-1][:-len(".py")]
+    is_package = parts[-1] == "__init__"
+    if is_package:
+        parts.pop()
+
+    if not parts or not _is_identifier_path(parts):
+        return None
+
+    return ".".join(parts), is_package
+
+class ModuleIndex(object):
+    """
+    Every pure-Python module within a site-packages directory, and within the
+    directories in it that its ``.pth`` files add to the path.
+
+    :ivar modules: A dictionary mapping module names to ``(path,
+            is_package)`` tuples.
+    :ivar directories: A dictionary mapping the names of package directories
+            (including namespace packages with no ``__init__.py``) to their
+            paths relative to site-packages. Only directories containing
+            modules are included.
+
+    """
+
+    def __init__(self, files, site_paths = ()):
+        """
+        :param files: A dictionary mapping the name of every file relative to
+                site-packages (using forward slashes) to its path, like
+                :meth:`superzippy.manifest.Manifest.get_files` returns.
+        :param site_paths: The directories (relative to site-packages, using
+                forward slashes) that are also on the path.
+
+        """
+
+        self.modules = {}
+        self.directories = {}
+        self._prefixes = [""] + [i.rstrip("/") + "/" for i in site_paths]
+
+        for relative_name, file_path in files.items():
+            for prefix, name in self.get_names(relative_name):
+                result = _module_name(name)
+                if result is None:
+                    continue
+
+                self.modules.setdefault(result[0], (file_path, result[1]))
+
+                # Only directories containing modules are packages, others
+                # (ex: a directory of data files added with --raw-copy) are
+                # left alone.
+                parts = name.split("/")[:-1]
+                for i in range(1, len(parts) + 1):
+                    self.directories.setdefault(".".join(parts[:i]),
+                        prefix + "/".join(parts[:i]))
+
+    def get_names(self, relative_name):
+        """
+        Returns a list of ``(prefix, name)`` tuples, one for every directory
+        on the path that the file at ``relative_name`` is within, where
+        ``name`` is the file's name relative to that directory (which is
+        ``prefix`` relative to site-packages).
+
+        """
+
+        return [(i, relative_name[len(i):]) for i in self._prefixes
+            if relative_name.startswith(i)]
+
+    def submodules(self, name):
+        """Returns the names of the modules directly within package
+        ``name``."""
+
+        prefix = name + "."
+        return [i for i in self.modules
+            if i.startswith(prefix) and "." not in i[len(prefix):]]
+
+def _get_string(node):
+    """
+    Returns the value of ``node`` if it's a string literal, otherwise
+    ``None``.
+
+    """
+
+    if sys.version_info >= (3, 8):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+    elif isinstance(node, ast.Str):
+        return node.s
+
+    return None
+
+def _resolve_relative(module_name, is_package, level, name):
+    """
+    Resolves a relative import like ``from ..foo import bar`` (``level`` 2,
+    ``name`` ``"foo"``) made by ``module_name``.
+
+    """
+
+    package = module_name.split(".")
+    if not is_package:
+        package.pop()
+
+    if level > 1:
+        package = package[:-(level - 1)]
+
+    if name:
+        package.append(name)
+
+    return ".".join(package)
+
+def find_imports(path, module_name, is_package):
+    """
+    Returns the names of every module the module at ``path`` might import.
+    Some of these may not be modules at all (``from foo import bar`` yields
+    ``foo.bar`` even if ``bar`` is a function).
+
+    :raises SyntaxError: If the module can't be parsed.
+
+    """
+
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), path)
+
+    result = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            result.update(i.name for i in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = _resolve_relative(module_name, is_package, node.level,
+                    node.module)
+            else:
+                base = node.module
+
+            if base:
+                result.add(base)
+                result.update(base + "." + i.name for i in node.names)
+            else:
+                # A relative import from beyond the top level, which will
+                # fail when run.
+                result.update(i.name for i in node.names)
+        elif isinstance(node, ast.Call) and node.args:
+            # __import__("foo") and importlib.import_module("foo")
+            func_name = getattr(node.func, "id",
+                getattr(node.func, "attr", None))
+            name = _get_string(node.args[0])
+            if func_name in ("__import__", "import_module") and name:
+                result.add(name)
+
+    return result
+
+def find_pth_imports(files):
+    """
+    Returns the names of the modules imported by the ``import`` lines of the
+    ``.pth`` files in ``files`` (see :class:`ModuleIndex`), which run whenever
+    site-packages is added to the path.
+
+    """
+
+    result = set()
+    for relative_name, file_path in files.items():
+        if "/" in relative_name or not relative_name.endswith(".pth"):
+            continue
+
+        with open(file_path) as f:
+            for line in f:
+                if not line.startswith(("import ", "import\t")):
+                    continue
+
+                try:
+                    tree = ast.parse(line)
+                except SyntaxError:
+                    continue
+
+                for node in ast.walk(tree):
+                    if isinstance(node, ast.Import):
+                        result.update(j.name for j in node.names)
+
+    return result
+
+def find_reachable(index, roots):
+    """
+    Returns the names of every module in ``index`` (a :class:`ModuleIndex`)
+    that can be reached by following imports from the modules ``roots``.
+    The parent packages of every reached module are reached as well.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    reachable = set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name in reachable:
+            continue
+
+        # Importing a.b.c imports a and a.b first
+        parts = name.split(".")
+        pending += [".".join(parts[:i]) for i in range(1, len(parts))]
+
+        if name not in index.modules:
+            if name in index.directories:
+                # A namespace package
+                reachable.add(name)
+            continue
+
+        reachable.add(name)
+
+        path, is_package = index.modules[name]
+        try:
+            imports = find_imports(path, name, is_package)
+        except (SyntaxError, ValueError):
+            # Can't tell what it imports, so keep the entire top level
+            # package it's in to be safe.
+            log.debug("Could not parse %s, keeping all of %s.", path,
+                parts[0])
+            imports = [i for i in index.modules
+                if i == parts[0] or i.startswith(parts[0] + ".")]
+
+        for i in imports:
+            if i.endswith(".*"):
+                pending += index.submodules(i[:-len(".*")])
+            else:
+                pending.append(i)
+
+    return reachable
+
+def _is_kept(name, keep):
+    return any(name == i or name.startswith(i + ".") for i in keep)
+
+def _is_reachable(name, index, reachable):
+    """
+    Returns whether the file at ``name`` (relative to a directory on the
+    path) is a module that can be reached, or a file that isn't within a
+    package that can't be reached.
+
+    """
+
+    parts = name.split("/")
+    for i in range(1, len(parts)):
+        package = ".".join(parts[:i])
+        if package in index.directories and package not in reachable:
+            return False
+
+    module = _module_name(name)
+    return module is None or module[0] in reachable
+
+def find_unreachable(files, roots, keep = (), site_paths = ()):
+    """
+    Finds the files in ``files`` (see :class:`ModuleIndex`) that belong to
+    modules that can't be reached from ``roots``, the modules named in
+    ``keep``, or the modules imported by ``.pth`` files. Modules within
+    packages named in ``keep`` are kept as well. Every file within a package
+    that can't be reached (data files and all) is unreachable.
+
+    Modules are looked for in site-packages and in ``site_paths`` (see
+    :class:`ModuleIndex`), and a file is only unreachable if it can't be
+    reached from any of them.
+
+    :returns: A sorted list of the relative names of the unreachable files.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    index = ModuleIndex(files, site_paths)
+
+    kept = [i for i in list(index.modules) + list(index.directories)
+        if _is_kept(i, keep)]
+    reachable = find_reachable(index,
+        list(roots) + kept + sorted(find_pth_imports(files)))
+
+    result = []
+    for relative_name in sorted(files):
+        if not any(_is_reachable(name, index, reachable)
+                for prefix, name in index.get_names(relative_name)):
+            log.debug("Leaving out unreachable file %s.", relative_name)
+            result.append(relative_name)
+
+    return result
@@ -0,0 +1,295 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that keeps pristine virtual environments around so that builds can
+clone one instead of running ``virtualenv`` every time.
+
+Templates are never modified once created. A clone hardlinks the template's
+files where it is safe to do so (files pip only ever replaces wholesale) and
+copies the rest, so cloning costs little more than walking the tree.
+
+"""
+
+# stdlib
+import errno
+import logging
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+
+# internal
+from . import cache
+
+#: The name of the file written into a template once it is complete.
+READY_MARKER = ".superzippy-ready"
+
+def create_virtualenv(python, virtualenv_dir, output_target):
+    """
+    Runs ``virtualenv`` to create a virtual environment at
+    ``virtualenv_dir`` using the interpreter at ``python``.
+
+    :returns: The exit status of ``virtualenv``.
+
+    """
+
+    return subprocess.call(
+        ["virtualenv", "-p", python, virtualenv_dir],
+        stdout = output_target,
+        stderr = subprocess.STDOUT
+    )
+
+def _must_copy(relative_path):
+    """
+    Returns ``True`` if the file at ``relative_path`` (relative to the root of
+    a virtual environment) might be modified in place, and so can't be shared
+    with the template through a hardlink.
+
+    """
+
+    return (relative_path.endswith((".pth", ".cfg")) or
+        relative_path.split(os.sep)[0] in ("bin", "Scripts"))
+
+def clone_tree(source, destination):
+    """
+    Recreates the tree at ``source`` within the existing directory
+    ``destination``. Files are hardlinked unless :func:`_must_copy` says
+    otherwise or ``source`` and ``destination`` are on different devices.
+    Symlinks are recreated as symlinks.
+
+    """
+
+    can_link = hasattr(os, "link")
+    for dir_path, dir_names, file_names in os.walk(source):
+        relative_dir = os.path.relpath(dir_path, source)
+        dest_dir = os.path.normpath(os.path.join(destination, relative_dir))
+
+        for i in list(dir_names):
+            source_path = os.path.join(dir_path, i)
+            if os.path.islink(source_path):
+                # os.walk won't descend into these, so they need to be treated
+                # like files.
+                file_names.append(i)
+            else:
+                os.mkdir(os.path.join(dest_dir, i))
+
+        for i in file_names:
+            source_path = os.path.join(dir_path, i)
+            dest_path = os.path.join(dest_dir, i)
+
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), dest_path)
+                continue
+
+            relative_path = os.path.normpath(os.path.join(relative_dir, i))
+            if can_link and not _must_copy(relative_path):
+                try:
+                    os.link(source_path, dest_path)
+                    continue
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+
+                    # Hardlinks can't cross devices, so no point in trying
+                    # for the rest of the files.
+                    can_link = False
+
+            shutil.copy2(source_path, dest_path)
+
+class VirtualenvPool(object):
+    """
+    A directory of template virtual environments, one per interpreter (as
+    identified by :func:`superzippy.cache.get_interpreter_tag`).
+
+    """
+
+    def __init__(self, path):
+        self.path = os.path.join(path, "venvs")
+        self.scratch_dir = os.path.join(self.path, "scratch")
+
+        for i in (self.path, self.scratch_dir):
+            if not os.path.isdir(i):
+                try:
+                    os.makedirs(i)
+                except OSError as e:
+                    # Somebody else may have just created it
+                    if e.errno != errno.EEXIST:
+                        raise
+
+            cache.clean_scratch(i)
+
+    def _template_path(self, interpreter_tag):
+        return os.path.join(self.path, interpreter_tag)
+
+    def get_template(self, interpreter_tag):
+        """
+        Returns the path to the ready template for ``interpreter_tag`` or
+        ``None`` if there isn't one.
+
+        """
+
+        template = self._template_path(interpreter_tag)
+        if os.path.exists(os.path.join(template, READY_MARKER)):
+            return template
+
+        return None
+
+    def clone(self, interpreter_tag, virtualenv_dir):
+        """
+        Clones the template for ``interpreter_tag`` into the empty directory
+        ``virtualenv_dir``.
+
+        :returns: ``True`` if the template was cloned, ``False`` if there is
+                no template for that interpreter yet.
+
+        """
+
+        template = self.get_template(interpreter_tag)
+        if template is None:
+            return False
+
+        clone_tree(template, virtualenv_dir)
+        os.remove(os.path.join(virtualenv_dir, READY_MARKER))
+
+        return True
+
+    def create_template(self, python, interpreter_tag, output_target = None):
+        """
+        Creates the template for ``interpreter_tag`` by running
+        ``virtualenv``. Does nothing if the template already exists or
+        another process is busy creating it.
+
+        :returns: ``True`` if a template exists once this returns.
+
+        """
+
+        log = logging.getLogger("superzippy")
+
+        if self.get_template(interpreter_tag) is not None:
+            return True
+
+        # Only one process should create a given template at a time. The
+        # lock goes away with its process, so a creator that died doesn't
+        # keep anybody else from trying.
+        lock = cache.FileLock(os.path.join(self.path,
+            "." + interpreter_tag + ".lock"))
+        if not lock.acquire(blocking = False):
+            return False
+
+        try:
+            if self.get_template(interpreter_tag) is not None:
+                return True
+
+            scratch = cache.ScratchDirectory(self.path)
+            try:
+                return_value = create_virtualenv(python, scratch.path,
+                    output_target)
+                if return_value != 0:
+                    log.warn("virtualenv returned non-zero exit status (%d) "
+                        "while creating a template.", return_value)
+                    return False
+
+                open(os.path.join(scratch.path, READY_MARKER), "w").close()
+
+                # A leftover template that was never marked ready has to go
+                # before we can put ours in its place.
+                template = self._template_path(interpreter_tag)
+                if os.path.exists(template):
+                    shutil.rmtree(template)
+
+                os.rename(scratch.path, template)
+
+                return True
+            finally:
+                scratch.release()
+        finally:
+            lock.release()
+
+    def refill_in_background(self, python, interpreter_tag):
+        """
+        Starts a detached process that creates the template for
+        ``interpreter_tag``. The process outlives the current build.
+
+        """
+
+        logging.getLogger("superzippy").debug(
+            "Creating a virtualenv template for %s in the background.",
+            interpreter_tag)
+
+        # The detached process must be able to import superzippy no matter
+        # how we were installed.
+        package_parent = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [package_parent] + env.get("PYTHONPATH", "").split(os.pathsep))
+
+        devnull = open(os.devnull, "w")
+        try:
+            subprocess.Popen(
+                [sys.executable, "-m", "superzippy.venvpool",
+                    os.path.dirname(self.path), python, interpreter_tag],
+                stdin = devnull,
+                stdout = devnull,
+                stderr = devnull,
+                close_fds = True,
+                cwd = "/",
+                env = env,
+                preexec_fn = getattr(os, "setsid", None)
+            )
+        finally:
+            devnull.close()
+
+def create_environment(options, virtualenv_dir, output_target):
+    """
+    Fills the empty directory ``virtualenv_dir`` with a clean virtual
+    environment for ``options.python``, cloning a template from the pool when
+    one is available.
+
+    :returns: ``True`` on success, ``False`` if something went wrong (the
+            problem will have been logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    if options.use_venv_pool:
+        pool = VirtualenvPool(options.cache_dir)
+        interpreter_tag = cache.get_interpreter_tag(options.python)
+
+        if pool.clone(interpreter_tag, virtualenv_dir):
+            log.debug("Cloned virtualenv template for %s.", interpreter_tag)
+            return True
+
+        pool.refill_in_background(options.python, interpreter_tag)
+
+    return_value = create_virtualenv(options.python, virtualenv_dir,
+        output_target)
+    if return_value != 0:
+        log.critical(
+            "virtualenv returned non-zero exit status (%d).", return_value
+        )
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    # Invoked by VirtualenvPool.refill_in_background()
+    cache_dir, python, interpreter_tag = sys.argv[1:]
+    VirtualenvPool(cache_dir).create_template(python, interpreter_tag)
@@ -0,0 +1,448 @@
+# Copyright (c) 2013 John Sullivan
+# Copyright (c) 2013 Other contributers as noted in the CONTRIBUTERS file
+#
+# This file is part of superzippy
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module that installs pure-Python wheels from a local directory by unpacking
+them directly, without a virtual environment or pip.
+
+Only a small subset of what pip does is supported: every requirement must be
+satisfiable by a pure-Python wheel (``none`` ABI, ``any`` platform) in the
+wheel directory. Anything else (an sdist, a local project directory, pip
+options, etc.) makes :func:`resolve` return ``None`` so the caller can fall
+back to pip.
+
+"""
+
+# stdlib
+from contextlib import closing
+from email.parser import Parser
+import logging
+import os
+import os.path
+import re
+import shlex
+import shutil
+import zipfile
+
+# external
+import pkg_resources
+
+# internal
+from .buildcontext import ThreadPool
+
+class UnsupportedRequirement(Exception):
+    """
+    Raised when a requirement can't be handled without pip.
+
+    """
+
+def normalize_name(name):
+    """
+    Normalizes a project name as described in PEP 503.
+
+    >>> normalize_name("Foo.Bar_baz")
+    'foo-bar-baz'
+
+    """
+
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+class Wheel(object):
+    """
+    A wheel file, described by its file name.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        parts = os.path.basename(path)[:-len(".whl")].split("-")
+        if len(parts) == 6:
+            # Drop the build tag
+            del parts[2]
+
+        if len(parts) != 5:
+            raise ValueError("%s is not a valid wheel file name." % (path, ))
+
+        (self.project_name, self.version, python_tags, self.abi_tag,
+            self.platform_tag) = parts
+        self.python_tags = python_tags.split(".")
+
+        self.key = normalize_name(self.project_name)
+        self.parsed_version = pkg_resources.parse_version(self.version)
+
+    def is_compatible(self, python_version):
+        """
+        Returns ``True`` if this is a pure-Python wheel that can be used with
+        Python ``python_version`` (a tuple like ``(2, 7)``).
+
+        """
+
+        if self.abi_tag != "none" or self.platform_tag != "any":
+            return False
+
+        acceptable = set(["py%d" % (python_version[0], ),
+            "py%d%d" % tuple(python_version[:2])])
+        return bool(acceptable.intersection(self.python_tags))
+
+    def get_requirements(self, extras = (), environment = None):
+        """
+        Returns a list of :class:`pkg_resources.Requirement` objects for the
+        dependencies of this wheel whose environment markers match
+        ``environment`` (see :func:`get_marker_environment`), or the current
+        interpreter if it's ``None``.
+
+        """
+
+        with closing(zipfile.ZipFile(self.path)) as f:
+            # The name of the .dist-info directory isn't always escaped the
+            # same way as the wheel's file name, so search for it.
+            for i in f.namelist():
+                if i.endswith(".dist-info/METADATA") and i.count("/") == 1:
+                    metadata = Parser().parsestr(f.read(i).decode("utf-8"))
+                    break
+            else:
+                raise ValueError("%s has no METADATA file." % (self.path, ))
+
+        result = []
+        for i in metadata.get_all("Requires-Dist") or []:
+            requirement = pkg_resources.Requirement.parse(i)
+            if requirement.marker is not None and not any(
+                    requirement.marker.evaluate(
+                        dict(environment or {}, extra = extra))
+                    for extra in tuple(extras) + ("", )):
+                continue
+
+            result.append(requirement)
+
+        return result
+
+def get_marker_environment(interpreter_tag):
+    """
+    Returns the values that environment markers (ex: ``python_version <
+    '3'``) are evaluated against for the interpreter described by
+    ``interpreter_tag`` (see :func:`superzippy.cache.get_interpreter_tag`).
+    Values that the tag doesn't describe (ex: ``platform_machine``) are left
+    out, so the current interpreter's are used for them.
+
+    >>> get_marker_environment("CPython-2.7.18-linux2")["python_version"]
+    '2.7'
+
+    """
+
+    implementation, version, platform = interpreter_tag.split("-", 2)
+
+    environment = {
+        "implementation_name": implementation.lower(),
+        "platform_python_implementation": implementation,
+        "python_version": ".".join(version.split(".")[:2]),
+        "python_full_version": version,
+        "sys_platform": platform,
+        "os_name": "nt" if platform.startswith("win") else "posix"
+    }
+
+    if implementation == "CPython":
+        environment["implementation_version"] = version
+
+    for prefix, system in [("linux", "Linux"), ("darwin", "Darwin"),
+            ("win", "Windows")]:
+        if platform.startswith(prefix):
+            environment["platform_system"] = system
+
+    return environment
+
+class WheelDirectory(object):
+    """
+    The compatible wheels found in a local directory. Environment markers
+    are evaluated against ``environment`` (see
+    :func:`get_marker_environment`), or the current interpreter if it's
+    ``None``.
+
+    """
+
+    def __init__(self, path, python_version, environment = None):
+        self.path = path
+        self.environment = environment
+        self.wheels = {}
+
+        for i in os.listdir(path):
+            if not i.endswith(".whl"):
+                continue
+
+            try:
+                wheel = Wheel(os.path.join(path, i))
+            except ValueError:
+                continue
+
+            if wheel.is_compatible(python_version):
+                self.wheels.setdefault(wheel.key, []).append(wheel)
+
+        # Newest versions first
+        for i in self.wheels.values():
+            i.sort(key = lambda x: x.parsed_version, reverse = True)
+
+    def find(self, requirement):
+        """
+        Returns the newest wheel that satisfies ``requirement`` or ``None``.
+
+        """
+
+        for i in self.wheels.get(normalize_name(requirement.project_name), []):
+            if i.version in requirement:
+                return i
+
+        return None
+
+def _read_requirements_file(path):
+    result = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+
+            args = shlex.split(line)
+            if args[0] in ("-r", "--requirement") and len(args) == 2:
+                nested = os.path.join(os.path.dirname(path), args[1])
+                result += _read_requirements_file(nested)
+            elif line.startswith("-"):
+                raise UnsupportedRequirement(line)
+            else:
+                result.append(line)
+
+    return result
+
+def get_requirements(packages):
+    """
+    Turns ``packages`` (a list of strings that would each be given to
+    ``pip install``) into a list of requirement strings, reading any
+    requirements files.
+
+    :raises UnsupportedRequirement: If anything other than plain requirements
+            and requirements files is present.
+
+    """
+
+    result = []
+    for i in packages:
+        args = shlex.split(i)
+        while args:
+            arg = args.pop(0)
+            if arg in ("-r", "--requirement") and args:
+                result += _read_requirements_file(args.pop(0))
+            elif arg.startswith("-") or os.path.exists(arg):
+                raise UnsupportedRequirement(arg)
+            else:
+                result.append(arg)
+
+    return result
+
+def resolve(packages, wheel_directory):
+    """
+    Figures out which wheels in ``wheel_directory`` (a
+    :class:`WheelDirectory`) need to be installed to satisfy ``packages``
+    and all of their dependencies. The packages given on the command line
+    must be pinned to exact versions (ex: ``clint==0.3.1``); dependencies
+    that aren't are satisfied with the newest matching wheel.
+
+    :returns: A list of :class:`Wheel` objects, or ``None`` if the packages
+            can't be installed from the wheel directory alone (the reason
+            will have been logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    try:
+        requirements = [pkg_resources.Requirement.parse(i)
+            for i in get_requirements(packages)]
+    except (UnsupportedRequirement, ValueError) as e:
+        log.debug("Can't install `%s` from wheels.", e)
+        return None
+
+    for i in requirements:
+        if len(i.specs) != 1 or i.specs[0][0] != "==" or "*" in i.specs[0][1]:
+            log.debug("Can't install `%s` from wheels because it is not "
+                "pinned.", i)
+            return None
+
+    selected = {}
+    pending = [(i, i.extras) for i in requirements]
+    while pending:
+        requirement, extras = pending.pop(0)
+        key = normalize_name(requirement.project_name)
+
+        if key in selected:
+            if selected[key].version not in requirement:
+                log.debug("Conflicting requirements for %s.", key)
+                return None
+
+            continue
+
+        wheel = wheel_directory.find(requirement)
+        if wheel is None:
+            log.debug("No compatible wheel satisfies `%s`.", requirement)
+            return None
+
+        selected[key] = wheel
+        pending += [(i, i.extras) for i in wheel.get_requirements(extras,
+            wheel_directory.environment)]
+
+    return list(selected.values())
+
+def find_locked(locked, wheel_directory):
+    """
+    Finds the wheel in ``wheel_directory`` for each of the
+    :class:`superzippy.lockfile.LockedPackage` objects in ``locked``. No
+    dependencies are looked at, the locked packages are assumed to already
+    include them.
+
+    :returns: A list of :class:`Wheel` objects, or ``None`` if a package has
+            no compatible wheel whose hash matches (the reason will have been
+            logged).
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    result = []
+    for i in locked:
+        wheel = wheel_directory.find(
+            pkg_resources.Requirement.parse(i.requirement))
+        if wheel is None:
+            log.debug("No compatible wheel for locked package %s.",
+                i.requirement)
+            return None
+
+        if not i.matches(wheel.path):
+            log.warn("%s doesn't match the hashes in the lock file.",
+                wheel.path)
+            return None
+
+        result.append(wheel)
+
+    return result
+
+def _is_safe_name(name):
+    """
+    Returns ``False`` if the member ``name`` would be unpacked somewhere
+    other than beneath the directory it's unpacked into.
+
+    >>> _is_safe_name("foo/bar.py")
+    True
+    >>> _is_safe_name("foo/../../bar.py")
+    False
+
+    """
+
+    parts = name.replace("\\", "/").split("/")
+    return not (name.startswith(("/", "\\")) or ":" in parts[0] or
+        ".." in parts)
+
+def unpack_wheel(wheel, site_package_dir):
+    """
+    Unpacks the pure-Python ``wheel`` into ``site_package_dir``. Files in
+    the wheel's ``.data/purelib`` and ``.data/platlib`` directories are moved
+    to the top; scripts, headers, and data files are dropped since they have
+    no use in an executable.
+
+    :raises ValueError: If the wheel has a member that would be unpacked
+            outside of ``site_package_dir`` (nothing is unpacked).
+
+    """
+
+    data_dir = "%s-%s.data/" % (wheel.project_name, wheel.version)
+
+    with closing(zipfile.ZipFile(wheel.path)) as f:
+        for info in f.infolist():
+            if not _is_safe_name(info.filename):
+                raise ValueError("%s has a file outside of its directory: "
+                    "%s" % (wheel.path, info.filename))
+
+        for info in f.infolist():
+            name = info.filename
+            if name.endswith("/"):
+                continue
+
+            if name.startswith(data_dir):
+                scheme, _, name = name[len(data_dir):].partition("/")
+                if scheme not in ("purelib", "platlib"):
+                    continue
+
+            dest = os.path.join(site_package_dir, *name.split("/"))
+            dest_dir = os.path.dirname(dest)
+            if not os.path.isdir(dest_dir):
+                try:
+                    os.makedirs(dest_dir)
+                except OSError:
+                    # Another wheel being unpacked concurrently may have
+                    # created it first.
+                    if not os.path.isdir(dest_dir):
+                        raise
+
+            with closing(f.open(info)) as source:
+                with open(dest, "wb") as dest_file:
+                    shutil.copyfileobj(source, dest_file)
+
+def install_wheels(options, packages, interpreter_tag, site_package_dir,
+        locked = None):
+    """
+    Installs ``packages`` into ``site_package_dir`` straight from the wheels
+    in ``options.wheel_dir``, unpacking up to ``options.jobs`` wheels at once.
+
+    :param locked: A list of :class:`superzippy.lockfile.LockedPackage`
+            objects to install as well, without resolving their
+            dependencies.
+    :returns: ``True`` if the packages were installed, ``False`` if pip must
+            be used instead.
+
+    """
+
+    log = logging.getLogger("superzippy")
+
+    python_version = tuple(
+        int(i) for i in interpreter_tag.split("-")[1].split("."))
+    wheel_directory = WheelDirectory(options.wheel_dir, python_version,
+        get_marker_environment(interpreter_tag))
+
+    wheels = resolve(packages, wheel_directory)
+    if wheels is None:
+        return False
+
+    if locked is not None:
+        found = find_locked(locked, wheel_directory)
+        if found is None:
+            return False
+
+        wheels += found
+
+    log.debug("Unpacking %d wheels.", len(wheels))
+
+    if not os.path.isdir(site_package_dir):
+        os.makedirs(site_package_dir)
+
+    pool = ThreadPool(max(options.jobs, 1))
+    try:
+        pool.map(lambda x: unpack_wheel(x, site_package_dir), wheels)
+    except ValueError as e:
+        log.warn("%s, installing with pip instead.", e)
+        return False
+    finally:
+        pool.close()
+        pool.join()
+
+    return True
@@ -16,8 +16,13 @@
 # limitations under the License.
 
 """
-Module that provides a useful function that can be used to zip up an entire
-directory.
+Module that writes zip files, either of an entire directory or of the files
+described by a :class:`superzippy.manifest.Manifest`.
+
+Members compressed ahead of time (by workers, or taken from a cache) are
+written with the help of some of :class:`zipfile.ZipFile`'s private
+attributes, since its public API can only write data it compresses itself.
+Those attributes are the same from Python 3.7 through 3.13.
 
 """
 
@@ -26,16 +31,412 @@ from __future__ import with_statement
 
 # stdlib
 from contextlib import closing
+from collections import deque, OrderedDict
+import hashlib
+import json
+import struct
+import threading
 import zipfile
-import os
+import zlib
+
+# internal
+from .buildcontext import ThreadPool
+from .compression import CompressionPolicy
+from .manifest import Manifest
+
+#: Files larger than this (in bytes) are compressed by the thread writing the
+#: archive rather than being read entirely into memory by a worker.
+LARGE_FILE_SIZE = 16 * 1024 * 1024
+
+#: The timestamp of members whose data comes from memory, which have no
+#: modification time of their own. It's constant (and the earliest a zip file
+#: can store) so that building the same thing twice gives the same archive.
+MEMORY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
-def zip_directory(path, output_file, compression = zipfile.ZIP_DEFLATED):
+#: The name of the member that every archive written by :func:`zip_manifest`
+#: ends with (besides an index). It holds a JSON object with the compression
+#: policy's description (``"policy"``) and the SHA-1 digest of every member
+#: that :class:`PreviousArchive` may reuse (``"digests"``). It isn't kept in
+#: the archive's comment since zipimport can't find the end of an archive
+#: with a comment on Python 3.7 and older.
+ARCHIVE_INFO_NAME = "superzippy-archive.json"
+
+def _compress(file_path, data, level):
     """
-    Compresses the directory at ``path`` into a zip file at ``output_file``.
+    Compresses the file at ``file_path`` (or ``data`` if ``file_path`` is
+    ``None``) exactly like :class:`zipfile.ZipFile` would with
+    ``ZIP_DEFLATED`` and the compression level ``level`` (which may be
+    ``None`` for the default).
 
-    .. note::
+    :returns: ``(crc, file_size, compressed_data, digest)``, where
+            ``digest`` is the data's SHA-1 digest in hex.
+
+    """
+
+    if file_path is not None:
+        with open(file_path, "rb") as f:
+            data = f.read()
+
+    return _compress_data(data, level, hashlib.sha1(data).hexdigest())
+
+def _compress_data(data, level, digest):
+    if level is None:
+        level = zlib.Z_DEFAULT_COMPRESSION
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    return zlib.crc32(data) & 0xffffffff, len(data), compressed, digest
+
+class MemberCache(object):
+    """
+    Compressed members kept in memory so that files which haven't changed
+    since they were last compressed (ex: the same installed packages going
+    into many builds) don't have to be compressed again. Files are
+    identified by a hash of their contents, which is much cheaper than
+    deflating them and lets a member be reused even when the file was
+    unpacked or installed to a different place. The least recently used
+    members are dropped once the cache holds more than ``max_size`` bytes of
+    compressed data.
 
-        Empty directories are not added to the zip file.
+    Safe to share between threads.
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._members = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compress(self, data, level, digest = None):
+        """
+        Same as :func:`_compress` for ``data``, but uses the cache.
+        ``digest`` may be given if the caller already knows it.
+
+        """
+
+        if digest is None:
+            digest = hashlib.sha1(data).hexdigest()
+        key = (digest, level)
+
+        with self._lock:
+            result = self._members.pop(key, None)
+            if result is not None:
+                # Move it to the end, it's now the most recently used
+                self._members[key] = result
+                self.hits += 1
+                return result
+
+            self.misses += 1
+
+        result = _compress_data(data, level, digest)
+
+        with self._lock:
+            if key not in self._members:
+                self._members[key] = result
+                self.size += len(result[2])
+
+            while self.size > self.max_size and self._members:
+                self.size -= len(self._members.popitem(last = False)[1][2])
+
+        return result
+
+class PreviousArchive(object):
+    """
+    An archive written earlier by :func:`zip_manifest` (ex: the last build of
+    the same executable) whose compressed members can be copied into a new
+    archive rather than compressing the same data again.
+
+    A member is reused when the new file has the same name, size, and SHA-1
+    digest (recorded in :data:`ARCHIVE_INFO_NAME`) as the old member and both
+    archives use the same compression policy (as given by
+    :meth:`CompressionPolicy.describe`). The modification time doesn't have
+    to match since the member's headers are written anew, which lets files
+    that are regenerated on every build (ex: bytecode) be reused too.
+
+    Safe to share between threads.
+
+    """
+
+    def __init__(self, path, policy):
+        self.reused = 0
+
+        self._archive = zipfile.ZipFile(path)
+        self._lock = threading.Lock()
+
+        try:
+            info = json.loads(
+                self._archive.read(ARCHIVE_INFO_NAME).decode("utf-8"))
+        except (KeyError, ValueError):
+            info = {}
+
+        self._digests = info.get("digests", {})
+
+        #: ``False`` if nothing can be reused because the archive was
+        #: compressed differently.
+        self.usable = info.get("policy") == policy.describe()
+
+    def close(self):
+        self._archive.close()
+
+    def _read_raw(self, zinfo):
+        """
+        Returns the compressed data of the member ``zinfo``.
+
+        """
+
+        with self._lock:
+            f = self._archive.fp
+            f.seek(zinfo.header_offset)
+            header = struct.unpack(zipfile.structFileHeader,
+                f.read(zipfile.sizeFileHeader))
+            if header[0] != zipfile.stringFileHeader:
+                raise zipfile.BadZipfile("Bad local header for %s." %
+                    (zinfo.filename, ))
+
+            f.seek(header[zipfile._FH_FILENAME_LENGTH] +
+                header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+            return f.read(zinfo.compress_size)
+
+    def reuse(self, archive_name, data):
+        """
+        Returns the same thing :func:`_compress` would for ``data`` if the
+        previous archive has it stored as ``archive_name``, otherwise
+        ``None``.
+
+        """
+
+        if not self.usable:
+            return None
+
+        zinfo = self._archive.NameToInfo.get(archive_name)
+        old_digest = self._digests.get(archive_name)
+        if zinfo is None or old_digest is None or \
+                zinfo.file_size != len(data) or \
+                zinfo.compress_type != zipfile.ZIP_DEFLATED or \
+                zinfo.flag_bits & 0x1:
+            return None
+
+        digest = hashlib.sha1(data).hexdigest()
+        if digest != old_digest:
+            return None
+
+        compressed = self._read_raw(zinfo)
+        with self._lock:
+            self.reused += 1
+
+        return zinfo.CRC, len(data), compressed, digest
+
+def _compress_file(zinfo, level, file_path, member_cache, previous):
+    """
+    Same as :func:`_compress` for the file at ``file_path`` (to be stored as
+    ``zinfo``), but takes the compressed data from ``previous`` (a
+    :class:`PreviousArchive`) or ``member_cache`` if either has it.
+
+    """
+
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    if previous is not None:
+        result = previous.reuse(zinfo.filename, data)
+        if result is not None:
+            return result
+
+    if member_cache is not None:
+        return member_cache.compress(data, level)
+
+    return _compress(None, data, level)
+
+def _write_compressed(archive, zinfo, crc, file_size, compressed,
+        digest = None):
+    """
+    Adds a member whose data has already been compressed to ``archive``. The
+    bytes written are the same as :meth:`zipfile.ZipFile.write` would have
+    written for the same file. ``digest`` is ignored, it's accepted so that
+    anything :func:`_compress` returns can be passed along.
+
+    """
+
+    zinfo.flag_bits = 0x00
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(compressed)
+    if not zinfo.external_attr:
+        zinfo.external_attr = 0o600 << 16
+
+    zip64 = file_size * 1.05 > zipfile.ZIP64_LIMIT
+    if zip64 and not archive._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+
+    if archive._seekable:
+        archive.fp.seek(archive.start_dir)
+    zinfo.header_offset = archive.fp.tell()
+
+    archive._writecheck(zinfo)
+    archive._didModify = True
+
+    archive.fp.write(zinfo.FileHeader(zip64))
+    archive.fp.write(compressed)
+    archive.start_dir = archive.fp.tell()
+
+    archive.filelist.append(zinfo)
+    archive.NameToInfo[zinfo.filename] = zinfo
+
+def _list_entries(manifest, policy):
+    """
+    Lists every entry in ``manifest`` along with how each should be
+    compressed according to ``policy`` (a
+    :class:`superzippy.compression.CompressionPolicy`).
+
+    :returns: A list of ``(zinfo, level, file_path, data)`` tuples, where
+            ``zinfo`` has its ``compress_type`` set and ``level`` is the
+            compression level (``None`` for the default).
+
+    """
+
+    result = []
+    for archive_name, file_path, data in manifest.items():
+        if file_path is not None:
+            zinfo = zipfile.ZipInfo.from_file(file_path, archive_name)
+        else:
+            zinfo = zipfile.ZipInfo(archive_name, MEMORY_DATE_TIME)
+            zinfo.external_attr = 0o644 << 16
+            zinfo.file_size = len(data)
+
+        zinfo.compress_type, level = policy.choose(archive_name,
+            zinfo.file_size)
+
+        result.append((zinfo, level, file_path, data))
+
+    return result
+
+def _write_entry(archive, zinfo, level, file_path, data):
+    """
+    Adds a single member to ``archive`` without any help from workers.
+
+    """
+
+    if file_path is not None:
+        archive.write(file_path, zinfo.filename, zinfo.compress_type, level)
+    else:
+        archive.writestr(zinfo, data, zinfo.compress_type, level)
+
+def _is_cacheable(zinfo, file_path):
+    return file_path is not None and \
+        zinfo.compress_type == zipfile.ZIP_DEFLATED and \
+        zinfo.file_size <= LARGE_FILE_SIZE
+
+def _write_parallel(archive, entries, jobs, digests, member_cache = None,
+        previous = None):
+    """
+    Adds ``entries`` (see :func:`_list_entries`) to ``archive``, deflating up
+    to ``jobs`` members at once. Members are still written in order, and
+    only a few members per worker are ever held in memory. The digests of
+    members that may be reused later are added to ``digests``.
+
+    """
+
+    pool = ThreadPool(jobs)
+    try:
+        pending = deque()
+        entries = deque(entries)
+        while entries or pending:
+            # Keep every worker busy without reading too far ahead
+            while entries and len(pending) < jobs * 4:
+                zinfo, level, file_path, data = entries.popleft()
+
+                # Stored members have nothing to gain from a worker
+                if zinfo.compress_type != zipfile.ZIP_DEFLATED or \
+                        zinfo.file_size > LARGE_FILE_SIZE:
+                    result = None
+                elif _is_cacheable(zinfo, file_path):
+                    result = pool.apply_async(_compress_file,
+                        (zinfo, level, file_path, member_cache, previous))
+                else:
+                    result = pool.apply_async(_compress,
+                        (file_path, data, level))
+
+                pending.append((zinfo, level, file_path, data, result))
+
+            zinfo, level, file_path, data, result = pending.popleft()
+            if result is None:
+                _write_entry(archive, zinfo, level, file_path, data)
+            else:
+                result = result.get()
+                _write_compressed(archive, zinfo, *result)
+                if _is_cacheable(zinfo, file_path):
+                    digests[zinfo.filename] = result[3]
+    finally:
+        pool.close()
+        pool.join()
+
+def _write_memory(archive, name, data):
+    zinfo = zipfile.ZipInfo(name, MEMORY_DATE_TIME)
+    zinfo.external_attr = 0o644 << 16
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+
+    # Written with its sizes in the local header (even if the output isn't
+    # seekable) so that it can be read without the central directory.
+    _write_compressed(archive, zinfo, *_compress(None, data, None))
+
+def _write_index(archive, index):
+    """
+    Adds the member returned by ``index`` (see :func:`zip_manifest`) to the
+    end of ``archive``.
+
+    """
+
+    # Offsets are given exactly as the central directory gives them, so a
+    # reader corrects for a prefix the same way for both. Newer versions of
+    # zipfile subtract where the archive started when writing them.
+    start = getattr(archive, "_start_disk", 0)
+
+    members = {}
+    for i in archive.filelist:
+        members[i.filename] = (i.header_offset - start, i.compress_type,
+            i.compress_size, i.file_size)
+
+    name, data = index(members)
+    _write_memory(archive, name, data)
+
+def zip_manifest(manifest, output_file, compression = zipfile.ZIP_DEFLATED,
+        jobs = 1, prefix = b"", policy = None, member_cache = None,
+        previous = None, index = None, archive_info = True):
+    """
+    Writes the entries of ``manifest`` (a
+    :class:`superzippy.manifest.Manifest`) into a zip file at
+    ``output_file``, in the order they were added. Each file is read exactly
+    once.
+
+    :param output_file: A path or a file object opened for writing in binary
+            mode. The file object does not need to be seekable (ex: a pipe),
+            and will not be closed.
+    :param compression: How to compress every member. Ignored if ``policy``
+            is given.
+    :param jobs: The number of members to compress at once. The resulting
+            archive is identical no matter how many jobs are used.
+    :param prefix: Bytes to write before the archive (ex: a ``#!`` line).
+            Offsets within the archive account for the prefix.
+    :param policy: A :class:`superzippy.compression.CompressionPolicy` that
+            decides how each member is compressed.
+    :param member_cache: A :class:`MemberCache` to take compressed members
+            from and add them to. The archive is the same either way.
+    :param previous: A :class:`PreviousArchive` to copy unchanged members
+            from. The archive is the same either way.
+    :param index: A function that's given a dictionary mapping the name of
+            every member to ``(offset, compression method, compressed size,
+            size)`` (where ``offset`` is that of the member's local header,
+            as the central directory gives it) and returns ``(name,
+            data)`` for one more member to add to the end of the archive (ex:
+            :func:`superzippy.moduleindex.create_index`). Its entry ends the
+            central directory, which is how a reader finds it.
+    :param archive_info: Whether to add :data:`ARCHIVE_INFO_NAME`, which
+            lets the archive be used as a :class:`PreviousArchive` later.
 
     .. note::
 
@@ -43,8 +444,56 @@ def zip_directory(path, output_file, compression = zipfile.ZIP_DEFLATED):
 
     """
 
+    if not hasattr(output_file, "write"):
+        with open(output_file, "wb") as f:
+            return zip_manifest(manifest, f, compression, jobs, prefix,
+                policy, member_cache, previous, index, archive_info)
+
+    if policy is None:
+        policy = CompressionPolicy(compression = compression)
+
+    entries = _list_entries(manifest, policy)
+
+    output_file.write(prefix)
+    digests = {}
     with closing(zipfile.ZipFile(output_file, "w", compression)) as f:
-        for dir_path, dir_names, file_names in os.walk(path):
-            for i in file_names:
-                file_path = os.path.join(dir_path, i)
-                f.write(file_path, os.path.relpath(file_path, path))
+        if jobs > 1:
+            _write_parallel(f, entries, jobs, digests, member_cache, previous)
+        else:
+            for zinfo, level, file_path, data in entries:
+                if _is_cacheable(zinfo, file_path):
+                    result = _compress_file(zinfo, level, file_path,
+                        member_cache, previous)
+                    _write_compressed(f, zinfo, *result)
+                    digests[zinfo.filename] = result[3]
+                else:
+                    _write_entry(f, zinfo, level, file_path, data)
+
+        if archive_info:
+            info = {"policy": policy.describe(), "digests": digests}
+            _write_memory(f, ARCHIVE_INFO_NAME, json.dumps(info,
+                sort_keys = True, separators = (",", ":")).encode("utf-8"))
+
+        if index is not None:
+            _write_index(f, index)
+
+    output_file.flush()
+
+def zip_directory(path, output_file, compression = zipfile.ZIP_DEFLATED,
+        jobs = 1, prefix = b"", policy = None):
+    """
+    Compresses the directory at ``path`` into a zip file at ``output_file``.
+    The other parameters are the same as :func:`zip_manifest`'s.
+
+    .. note::
+
+        Empty directories are not added to the zip file, and neither is
+        :data:`ARCHIVE_INFO_NAME`.
+
+    """
+
+    manifest = Manifest()
+    manifest.add_tree("", path)
+
+    zip_manifest(manifest, output_file, compression, jobs, prefix, policy,
+        archive_info = False)